@@ -0,0 +1,92 @@
+"""
+Resolution of the attendance session a node device is running now.
+
+Every scan on a node needs its current session. get_active_session
+answers from a per node cache; a cached answer stays valid until the
+current session ends or the node's next session starts, whichever comes
+first, or until an AttendanceSession of the node is saved or deleted
+(see signals.py).
+"""
+import threading
+
+from django.utils import timezone
+
+from .models import AttendanceSession, AttendanceSessionStatusChoices
+
+# node id -> (session or None, time the answer expires or None)
+_active_sessions = {}
+_active_sessions_lock = threading.Lock()
+# bumped on every invalidation so that an answer computed before an
+# invalidation is never stored in the cache
+_active_sessions_generation = 0
+
+
+def _pk(node_device):
+    return getattr(node_device, "pk", node_device)
+
+
+def _resolve(node_id, now):
+    att_session = AttendanceSession.running_sessions(node_id, now).first()
+    next_start = (
+        AttendanceSession.objects.filter(
+            node_device_id=node_id,
+            status=AttendanceSessionStatusChoices.ACTIVE,
+            start_time__gt=now,
+        )
+        .order_by("start_time")
+        .values_list("start_time", flat=True)
+        .first()
+    )
+    expiries = [next_start]
+    if att_session is not None:
+        expiries.append(att_session.start_time + att_session.duration)
+    expiries = [expiry for expiry in expiries if expiry is not None]
+    return att_session, min(expiries) if expiries else None
+
+
+def get_active_session(node_device):
+    """The ACTIVE AttendanceSession of node_device (an instance or its id)
+    running now, the most recently started if several are, or None
+    """
+    node_id = _pk(node_device)
+    now = timezone.now()
+    with _active_sessions_lock:
+        cached = _active_sessions.get(node_id)
+        generation = _active_sessions_generation
+    if cached is not None:
+        att_session, expires = cached
+        if expires is None or now < expires:
+            return att_session
+
+    att_session, expires = _resolve(node_id, now)
+    with _active_sessions_lock:
+        if generation == _active_sessions_generation:
+            _active_sessions[node_id] = (att_session, expires)
+    return att_session
+
+
+def invalidate_node(node_device):
+    """Drop the cached session of a node"""
+    global _active_sessions_generation
+    with _active_sessions_lock:
+        _active_sessions_generation += 1
+        _active_sessions.pop(_pk(node_device), None)
+
+
+def clear_active_sessions():
+    """Drop the cached session of every node"""
+    global _active_sessions_generation
+    with _active_sessions_lock:
+        _active_sessions_generation += 1
+        _active_sessions.clear()
+
+
+def end_expired_sessions(at=None):
+    """Mark every session that is over as ENDED in one UPDATE and return
+    the number of sessions ended
+    """
+    ended = AttendanceSession.end_expired_sessions(at)
+    if ended:
+        # update() doesn't send post_save
+        clear_active_sessions()
+    return ended
@@ -0,0 +1,426 @@
+"""
+Query count and latency benchmarks of the models' hot paths.
+
+generate_dataset fills the database with a synthetic institution: N
+faculties, departments, courses and students, every student registered
+for the courses of their department, and M attendance sessions per
+course with a sign in record for most registered students. Rows are
+written with bulk_create, so a dataset of tens of thousands of records
+is generated in seconds.
+
+run_benchmarks runs every scenario against it, each inside a
+transaction that is rolled back, and returns a BenchmarkResult with the
+number of queries and the time taken by the measured part. Query budgets
+(QUERY_BUDGETS) don't depend on the size of the dataset: a hot path
+whose query count grows with the data is an N+1 regression. From a
+shell:
+
+    from db import benchmarks
+    dataset = benchmarks.generate_dataset(
+        benchmarks.DatasetSize(students_per_department=500)
+    )
+    for result in benchmarks.run_benchmarks(dataset):
+        print(result)
+"""
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+import random
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import checkin, datasynch, refcache, summaries
+from .models import (
+    AcademicSession,
+    AttendanceRecord,
+    AttendanceSession,
+    Course,
+    CourseRegistration,
+    Department,
+    EventTypeChoices,
+    Faculty,
+    NodeDevice,
+    RecordTypesChoices,
+    SemesterChoices,
+    SexChoices,
+    Student,
+    SyncState,
+)
+from .sessionids import new_session_id
+
+DatasetSize = namedtuple(
+    "DatasetSize",
+    [
+        "faculties",
+        "departments_per_faculty",
+        "courses_per_department",
+        "students_per_department",
+        "attendance_sessions_per_course",
+        "attendance_rate",
+    ],
+    defaults=[2, 3, 8, 40, 4, 0.8],
+)
+
+Dataset = namedtuple(
+    "Dataset",
+    [
+        "size",
+        "faculties",
+        "departments",
+        "courses",
+        "students",
+        "acad_session",
+        "next_acad_session",
+        "node",
+    ],
+)
+
+BenchmarkResult = namedtuple(
+    "BenchmarkResult", ["name", "queries", "seconds", "budget"]
+)
+
+# most queries each scenario may run, whatever the size of the dataset.
+# Reference tables are read cold (refcache is invalidated first).
+QUERY_BUDGETS = {
+    "faculty.get_all_faculties": 1,
+    "department.get_departments": 2,
+    "course.get_courses": 3,
+    "course.catalogue": 3,
+    "course_registration.save": 5,
+    # the save and the summary refresh run when its transaction commits
+    "attendance_record.save": 6,
+    "attendance_record.sign_out": 6,
+    # the record and the summary counts, written in one transaction
+    "checkin.check_in": 3,
+    "checkin.sign_out": 2,
+    "datasynch.dump": 9,
+    "datasynch.load": 14,
+}
+# rows per model loaded by the datasynch.load scenario
+LOAD_SAMPLE_SIZE = 50
+
+
+def generate_dataset(size=DatasetSize(), seed=0, prefix="B"):
+    """Write a synthetic dataset of the given size. prefix keeps the names
+    of datasets generated into the same database apart.
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        revision = SyncState.next_revision()
+        faculties = Faculty.objects.bulk_create(
+            Faculty(name="%s Faculty %d" % (prefix, idx), revision=revision)
+            for idx in range(size.faculties)
+        )
+        departments = Department.objects.bulk_create(
+            Department(
+                name="%s Department %d.%d" % (prefix, fac_idx, idx),
+                alias="%s%d.%d" % (prefix, fac_idx, idx),
+                faculty=faculty,
+                revision=revision,
+            )
+            for fac_idx, faculty in enumerate(faculties)
+            for idx in range(size.departments_per_faculty)
+        )
+        courses = Course.objects.bulk_create(
+            Course(
+                code="%s%03d" % (prefix, dept_idx),
+                title="Course %d" % idx,
+                level_of_study=idx % 5 + 1,
+                department=department,
+                unit_load=3,
+                semester=SemesterChoices.values[idx % 2],
+                revision=revision,
+            )
+            for dept_idx, department in enumerate(departments)
+            for idx in range(size.courses_per_department)
+        )
+        first_student = Student.objects.count()
+        students = Student.objects.bulk_create(
+            Student(
+                reg_number="2000/%06d"
+                % (
+                    first_student
+                    + dept_idx * size.students_per_department
+                    + idx
+                ),
+                first_name="Student",
+                last_name="%d" % idx,
+                department=department,
+                possible_grad_yr=2025,
+                level_of_study=idx % 5 + 1,
+                sex=SexChoices.values[idx % 2],
+                revision=revision,
+            )
+            for dept_idx, department in enumerate(departments)
+            for idx in range(size.students_per_department)
+        )
+        acad_session, _ = AcademicSession.objects.get_or_create(
+            session="2030/2031", defaults={"is_current_session": True}
+        )
+        next_acad_session, _ = AcademicSession.objects.get_or_create(
+            session="2031/2032"
+        )
+
+        students_of = {}
+        for student in students:
+            students_of.setdefault(student.department_id, []).append(student)
+        CourseRegistration.objects.bulk_create(
+            (
+                CourseRegistration(
+                    session=acad_session,
+                    semester=course.semester,
+                    course=course,
+                    student=student,
+                    revision=revision,
+                )
+                for course in courses
+                for student in students_of[course.department_id]
+            ),
+            batch_size=datasynch.LOAD_BATCH_SIZE,
+        )
+
+        node = NodeDevice.objects.create(name="%s benchmark node" % prefix)
+        start_time = timezone.now() - timedelta(
+            weeks=size.attendance_sessions_per_course
+        )
+        att_sessions = AttendanceSession.objects.bulk_create(
+            AttendanceSession(
+                id=new_session_id(node.pk),
+                node_device=node,
+                course=course,
+                session=acad_session,
+                event_type=EventTypeChoices.LECTURE,
+                start_time=start_time + timedelta(weeks=idx),
+                duration=timedelta(hours=2),
+            )
+            for course in courses
+            for idx in range(size.attendance_sessions_per_course)
+        )
+        AttendanceRecord.objects.bulk_create(
+            (
+                AttendanceRecord(
+                    attendance_session=att_session,
+                    student=student,
+                    record_type=RecordTypesChoices.SIGN_IN,
+                )
+                for att_session in att_sessions
+                for student in students_of[att_session.course.department_id]
+                if rng.random() < size.attendance_rate
+            ),
+            batch_size=datasynch.LOAD_BATCH_SIZE,
+        )
+        # bulk writes send no signals
+        summaries.rebuild()
+    refcache.written()
+    return Dataset(
+        size,
+        faculties,
+        departments,
+        courses,
+        students,
+        acad_session,
+        next_acad_session,
+        node,
+    )
+
+
+def _get_all_faculties(dataset, measure):
+    with measure():
+        Faculty.get_all_faculties()
+
+
+def _get_departments(dataset, measure):
+    with measure():
+        Department.get_departments(faculty=dataset.faculties[0].name)
+
+
+def _get_courses(dataset, measure):
+    with measure():
+        Course.get_courses(
+            faculty=dataset.faculties[0].name,
+            semester=SemesterChoices.FIRST.label,
+        )
+
+
+def _catalogue(dataset, measure):
+    with measure():
+        list(
+            Course.catalogue(
+                faculty=dataset.faculties[0].name,
+                semester=SemesterChoices.FIRST.label,
+            )
+        )
+
+
+def _save_course_registration(dataset, measure):
+    course = dataset.courses[0]
+    student = next(
+        student
+        for student in dataset.students
+        if student.department_id == course.department_id
+    )
+    registration = CourseRegistration(
+        session=dataset.next_acad_session,
+        semester=course.semester,
+        course=course,
+        student=student,
+    )
+    with measure():
+        registration.save()
+
+
+def _absent_student(dataset):
+    """An attendance session of the first course and a student registered
+    for the course without a record in it
+    """
+    course = dataset.courses[0]
+    att_session = AttendanceSession.objects.filter(course=course).first()
+    present = set(
+        AttendanceRecord.objects.filter(
+            attendance_session=att_session
+        ).values_list("student_id", flat=True)
+    )
+    student = next(
+        student
+        for student in dataset.students
+        if student.department_id == course.department_id
+        and student.reg_number not in present
+    )
+    return att_session, student
+
+
+def _signed_in_record(dataset):
+    return AttendanceRecord.objects.filter(
+        attendance_session__course=dataset.courses[0],
+        record_type=RecordTypesChoices.SIGN_IN,
+        is_valid=True,
+    ).first()
+
+
+def _save_attendance_record(dataset, measure):
+    att_session, student = _absent_student(dataset)
+    record = AttendanceRecord(
+        attendance_session=att_session,
+        student=student,
+        record_type=RecordTypesChoices.SIGN_IN,
+    )
+    with measure():
+        record.save()
+        # the summary refresh the save's commit runs; the scenario's
+        # transaction is rolled back, so it wouldn't be measured otherwise
+        summaries.refresh([(att_session.pk, student.reg_number)])
+
+
+def _sign_out_attendance_record(dataset, measure):
+    record = _signed_in_record(dataset)
+    record.record_type = RecordTypesChoices.SIGN_OUT
+    with measure():
+        record.save()
+        summaries.refresh([(record.attendance_session_id, record.student_id)])
+
+
+def _check_in(dataset, measure):
+    # a student who attended the course before, the common case: the
+    # first attendance of a student in a course creates their summary row
+    record = _signed_in_record(dataset)
+    AttendanceRecord.objects.filter(pk=record.pk).delete()
+    with measure():
+        checkin.check_in(
+            record.attendance_session_id,
+            record.student_id,
+            RecordTypesChoices.SIGN_IN,
+        )
+
+
+def _check_out(dataset, measure):
+    record = _signed_in_record(dataset)
+    with measure():
+        checkin.check_in(
+            record.attendance_session_id,
+            record.student_id,
+            RecordTypesChoices.SIGN_OUT,
+        )
+
+
+def _dump(dataset, measure):
+    with measure():
+        for _ in datasynch.iter_model_records(
+            datasynch.SERVER_DUMP, chunk_size=len(dataset.students) + 1
+        ):
+            pass
+
+
+def _load(dataset, measure):
+    # a delta of fixed size, so that the budget doesn't depend on how many
+    # rows the database splits a bulk write into
+    loaded = Counter()
+    records = []
+    for record in datasynch.iter_model_records(datasynch.SERVER_DUMP):
+        if loaded[record["model"]] < LOAD_SAMPLE_SIZE:
+            loaded[record["model"]] += 1
+            records.append(record)
+    with measure():
+        datasynch.bulk_load(records, ordered=True)
+
+
+SCENARIOS = {
+    "faculty.get_all_faculties": _get_all_faculties,
+    "department.get_departments": _get_departments,
+    "course.get_courses": _get_courses,
+    "course.catalogue": _catalogue,
+    "course_registration.save": _save_course_registration,
+    "attendance_record.save": _save_attendance_record,
+    "attendance_record.sign_out": _sign_out_attendance_record,
+    "checkin.check_in": _check_in,
+    "checkin.sign_out": _check_out,
+    "datasynch.dump": _dump,
+    "datasynch.load": _load,
+}
+
+
+def run_scenario(name, dataset):
+    """Run one scenario in a transaction that is rolled back and return
+    its BenchmarkResult
+    """
+    measured = {}
+
+    @contextmanager
+    def measure():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            yield
+            measured["seconds"] = time.perf_counter() - started
+        measured["queries"] = len(queries)
+
+    refcache.invalidate()
+    with transaction.atomic():
+        SCENARIOS[name](dataset, measure)
+        transaction.set_rollback(True)
+    refcache.invalidate()
+    return BenchmarkResult(
+        name,
+        measured["queries"],
+        measured["seconds"],
+        QUERY_BUDGETS.get(name),
+    )
+
+
+def run_benchmarks(dataset, names=None):
+    """Run the named scenarios (all by default) against dataset"""
+    return [run_scenario(name, dataset) for name in names or SCENARIOS]
+
+
+def check_budgets(results):
+    """Raise AssertionError listing the scenarios over their query
+    budget
+    """
+    over = [
+        "%s: %d queries, budget %d" % (name, queries, budget)
+        for name, queries, _, budget in results
+        if budget is not None and queries > budget
+    ]
+    if over:
+        raise AssertionError("Query budgets exceeded:\n" + "\n".join(over))
@@ -0,0 +1,383 @@
+"""
+Attendance check-in service.
+
+A student has a single AttendanceRecord per attendance session. Signing
+in inserts it as SIGN_IN and signing out moves it to SIGN_OUT and sets
+check_out_by. check_in does that for one scan without loading or saving
+model instances:
+    = sign in: one INSERT ... SELECT that only inserts the record if the
+      student and the session exist and the student has no record in
+      the session yet, ignoring a conflicting concurrent sign in
+    = sign out: one conditional UPDATE of the SIGN_IN row
+The record (and, failing that, the student and session) is only read
+when the statement changed nothing, to tell the caller why. The counts
+of the attendance summaries are incremented in the same transaction.
+
+check_in_many applies a queue of scans with a fixed number of queries.
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from . import summaries
+from .instrumentation import instrumented
+from .models import (
+    AttendanceRecord,
+    AttendanceSession,
+    RecordTypesChoices,
+    Student,
+)
+
+SIGNED_IN = "signed_in"
+SIGNED_OUT = "signed_out"
+ALREADY_SIGNED_IN = "already_signed_in"
+ALREADY_SIGNED_OUT = "already_signed_out"
+NOT_SIGNED_IN = "not_signed_in"
+UNKNOWN_STUDENT = "unknown_student"
+UNKNOWN_SESSION = "unknown_session"
+
+Scan = namedtuple(
+    "Scan",
+    ["attendance_session", "reg_number", "action", "time"],
+    defaults=(None,),
+)
+# record_type is None when the student has no record in the session
+CheckInResult = namedtuple(
+    "CheckInResult", ["reg_number", "status", "record_type", "check_out_by"]
+)
+
+
+def _pk(attendance_session):
+    return getattr(attendance_session, "pk", attendance_session)
+
+
+def parse_action(action):
+    if isinstance(action, str):
+        try:
+            return RecordTypesChoices.str_to_value(action.replace(" ", "_"))
+        except KeyError:
+            pass
+    if action not in RecordTypesChoices.values:
+        raise ValueError("Invalid check-in action: %s" % action)
+    return action
+
+
+def _transition(reg_number, state, action, now):
+    """Result of applying action to a record in state (record_type,
+    check_out_by), or to no record if state is None
+    """
+    if state is None:
+        if action == RecordTypesChoices.SIGN_IN:
+            return CheckInResult(
+                reg_number, SIGNED_IN, RecordTypesChoices.SIGN_IN, None
+            )
+        return CheckInResult(reg_number, NOT_SIGNED_IN, None, None)
+
+    record_type, check_out_by = state
+    if record_type == RecordTypesChoices.SIGN_OUT:
+        return CheckInResult(
+            reg_number, ALREADY_SIGNED_OUT, record_type, check_out_by
+        )
+    if action == RecordTypesChoices.SIGN_OUT:
+        return CheckInResult(
+            reg_number, SIGNED_OUT, RecordTypesChoices.SIGN_OUT, now
+        )
+    return CheckInResult(reg_number, ALREADY_SIGNED_IN, record_type, None)
+
+
+def _record_state(session_id, reg_number):
+    return (
+        AttendanceRecord.objects.filter(
+            attendance_session_id=session_id, student_id=reg_number
+        )
+        .order_by("-record_type")
+        .values_list("record_type", "check_out_by")
+        .first()
+    )
+
+
+def _unknown_status(session_id, reg_number):
+    """UNKNOWN_STUDENT or UNKNOWN_SESSION if either doesn't exist"""
+    if not Student.objects.filter(pk=reg_number).exists():
+        return UNKNOWN_STUDENT
+    if not AttendanceSession.objects.filter(pk=session_id).exists():
+        return UNKNOWN_SESSION
+    return None
+
+
+def _insert_ignore_sql():
+    """The INSERT statement and suffix that ignore conflicting rows"""
+    ops = connection.ops
+    if hasattr(ops, "on_conflict_suffix_sql"):
+        # Django 4.1+
+        from django.db.models.constants import OnConflict
+
+        return (
+            ops.insert_statement(on_conflict=OnConflict.IGNORE),
+            ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], []),
+        )
+    return (
+        ops.insert_statement(ignore_conflicts=True),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+
+
+def _insert_sign_in(session_id, reg_number, now):
+    """Insert the student's SIGN_IN record, provided the student and the
+    session exist and the student has no record in the session. Returns
+    whether the record was inserted.
+    """
+    qn = connection.ops.quote_name
+    opts = AttendanceRecord._meta
+    fields = [
+        opts.get_field(name)
+        for name in (
+            "attendance_session",
+            "student",
+            "record_type",
+            "check_in_by",
+            "is_valid",
+        )
+    ]
+    values = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(
+            fields[2:], (RecordTypesChoices.SIGN_IN, now, True)
+        )
+    ]
+    student_pk = qn(Student._meta.pk.column)
+    insert, suffix = _insert_ignore_sql()
+    sql = (
+        "%s %s (%s) SELECT %%s, %s, %%s, %%s, %%s FROM %s WHERE %s = %%s"
+        " AND EXISTS (SELECT 1 FROM %s WHERE %s = %%s)"
+        " AND NOT EXISTS (SELECT 1 FROM %s WHERE %s = %%s AND %s = %%s) %s"
+    ) % (
+        insert,
+        qn(opts.db_table),
+        ", ".join(qn(field.column) for field in fields),
+        student_pk,
+        qn(Student._meta.db_table),
+        student_pk,
+        qn(AttendanceSession._meta.db_table),
+        qn(AttendanceSession._meta.pk.column),
+        qn(opts.db_table),
+        qn(fields[0].column),
+        qn(fields[1].column),
+        suffix,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            [session_id, *values]
+            + [reg_number, session_id, session_id, reg_number],
+        )
+        return cursor.rowcount == 1
+
+
+@instrumented("checkin.check_in")
+def check_in(attendance_session, reg_number, action):
+    """Sign a student in to or out of an attendance session (an instance
+    or its id). action is a RecordTypesChoices value or name.
+
+    Returns a CheckInResult with the status of the scan (SIGNED_IN,
+    SIGNED_OUT, ALREADY_SIGNED_IN, ALREADY_SIGNED_OUT, NOT_SIGNED_IN,
+    UNKNOWN_STUDENT or UNKNOWN_SESSION) and the resulting state of the
+    student's record.
+    """
+    session_id = _pk(attendance_session)
+    action = parse_action(action)
+    now = timezone.now()
+
+    # the record and its summaries are written in one transaction
+    with transaction.atomic(savepoint=False):
+        if action == RecordTypesChoices.SIGN_OUT:
+            return _sign_out(session_id, reg_number, now)
+        return _sign_in(session_id, reg_number, now)
+
+
+def _sign_in(session_id, reg_number, now):
+    while True:
+        if _insert_sign_in(session_id, reg_number, now):
+            summaries.record_sign_in(session_id, reg_number)
+            return CheckInResult(
+                reg_number, SIGNED_IN, RecordTypesChoices.SIGN_IN, None
+            )
+        state = _record_state(session_id, reg_number)
+        if state is not None:
+            return _transition(
+                reg_number, state, RecordTypesChoices.SIGN_IN, now
+            )
+        unknown = _unknown_status(session_id, reg_number)
+        if unknown is not None:
+            return CheckInResult(reg_number, unknown, None, None)
+        # the record that blocked the insert was deleted since; try again
+
+
+def _sign_out(session_id, reg_number, now):
+    signed_in = AttendanceRecord.objects.filter(
+        attendance_session_id=session_id,
+        student_id=reg_number,
+        record_type=RecordTypesChoices.SIGN_IN,
+    )
+    sign_out = {
+        "record_type": RecordTypesChoices.SIGN_OUT,
+        "check_out_by": now,
+    }
+    if signed_in.filter(is_valid=True).update(**sign_out):
+        summaries.record_sign_out(session_id, reg_number)
+        return CheckInResult(
+            reg_number, SIGNED_OUT, RecordTypesChoices.SIGN_OUT, now
+        )
+    # an invalid record, which the summaries don't count
+    if signed_in.update(**sign_out):
+        return CheckInResult(
+            reg_number, SIGNED_OUT, RecordTypesChoices.SIGN_OUT, now
+        )
+    state = _record_state(session_id, reg_number)
+    if state is None:
+        unknown = _unknown_status(session_id, reg_number)
+        if unknown is not None:
+            return CheckInResult(reg_number, unknown, None, None)
+    return _transition(reg_number, state, RecordTypesChoices.SIGN_OUT, now)
+
+
+@instrumented("checkin.check_in_many")
+def check_in_many(scans):
+    """Apply queued scans, (attendance_session, reg_number, action) or
+    (attendance_session, reg_number, action, time) tuples, in order. A
+    student can be signed in and out by the same batch. time is when the
+    scan was taken and defaults to now; it becomes the record's
+    check_in_by or check_out_by.
+
+    Returns one CheckInResult per scan; scans of students or attendance
+    sessions that don't exist get UNKNOWN_STUDENT or UNKNOWN_SESSION.
+    """
+    scans = [Scan(*scan) for scan in scans]
+    if not scans:
+        return []
+    now = timezone.now()
+    scans = [
+        scan._replace(
+            attendance_session=_pk(scan.attendance_session),
+            action=parse_action(scan.action),
+            time=scan.time or now,
+        )
+        for scan in scans
+    ]
+    reg_numbers = {scan.reg_number for scan in scans}
+    session_ids = {scan.attendance_session for scan in scans}
+
+    with transaction.atomic():
+        known_students = set(
+            Student.objects.filter(pk__in=reg_numbers).values_list(
+                "pk", flat=True
+            )
+        )
+        known_sessions = set(
+            AttendanceSession.objects.filter(pk__in=session_ids).values_list(
+                "pk", flat=True
+            )
+        )
+        states = {}
+        for session_id, reg_number, record_type, check_out_by in (
+            AttendanceRecord.objects.filter(
+                attendance_session_id__in=session_ids,
+                student_id__in=known_students,
+            )
+            .order_by("record_type")
+            .values_list(
+                "attendance_session_id",
+                "student_id",
+                "record_type",
+                "check_out_by",
+            )
+        ):
+            # a signed out row supersedes a signed in row
+            states[(session_id, reg_number)] = (record_type, check_out_by)
+        saved = set(states)
+
+        results = []
+        changed = set()
+        check_in_times = {}
+        for scan in scans:
+            if scan.reg_number not in known_students:
+                results.append(
+                    CheckInResult(scan.reg_number, UNKNOWN_STUDENT, None, None)
+                )
+                continue
+            if scan.attendance_session not in known_sessions:
+                results.append(
+                    CheckInResult(scan.reg_number, UNKNOWN_SESSION, None, None)
+                )
+                continue
+            key = (scan.attendance_session, scan.reg_number)
+            result = _transition(
+                scan.reg_number, states.get(key), scan.action, scan.time
+            )
+            if result.status in (SIGNED_IN, SIGNED_OUT):
+                states[key] = (result.record_type, result.check_out_by)
+                changed.add(key)
+            if result.status == SIGNED_IN:
+                check_in_times[key] = scan.time
+            results.append(result)
+
+        new_keys = changed - saved
+        AttendanceRecord.objects.bulk_create(
+            [
+                AttendanceRecord(
+                    attendance_session_id=key[0],
+                    student_id=key[1],
+                    record_type=states[key][0],
+                    check_out_by=states[key][1],
+                )
+                for key in new_keys
+            ],
+            ignore_conflicts=True,
+        )
+        if any(check_in_times[key] != now for key in new_keys):
+            # bulk_create stamps check_in_by with the current time
+            _restore_check_in_times(
+                {key: check_in_times[key] for key in new_keys}
+            )
+
+        signed_out = {}
+        for key in changed & saved:
+            signed_out.setdefault(key[0], {})[key[1]] = states[key][1]
+        for session_id, check_out_times in signed_out.items():
+            AttendanceRecord.objects.filter(
+                attendance_session_id=session_id,
+                student_id__in=check_out_times,
+                record_type=RecordTypesChoices.SIGN_IN,
+            ).update(
+                record_type=RecordTypesChoices.SIGN_OUT,
+                check_out_by=_value_per_student(check_out_times),
+            )
+        summaries.refresh(changed)
+    return results
+
+
+def _value_per_student(values):
+    """An expression that evaluates to values[student] in an UPDATE"""
+    if len(set(values.values())) == 1:
+        return next(iter(values.values()))
+    return Case(
+        *[
+            When(student_id=reg_number, then=Value(value))
+            for reg_number, value in values.items()
+        ],
+        output_field=AttendanceRecord._meta.get_field("check_out_by"),
+    )
+
+
+def _restore_check_in_times(check_in_times):
+    records = []
+    for pk, session_id, reg_number in AttendanceRecord.objects.filter(
+        attendance_session_id__in={key[0] for key in check_in_times},
+        student_id__in={key[1] for key in check_in_times},
+    ).values_list("pk", "attendance_session_id", "student_id"):
+        check_in_by = check_in_times.get((session_id, reg_number))
+        if check_in_by is not None:
+            records.append(AttendanceRecord(pk=pk, check_in_by=check_in_by))
+    AttendanceRecord.objects.bulk_update(records, ["check_in_by"])
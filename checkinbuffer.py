@@ -0,0 +1,353 @@
+"""
+Write-behind buffer for node check-ins.
+
+Committing every scan to SQLite serializes the sign-in rush on the
+database's write lock. A CheckInBuffer acknowledges a scan as soon as it
+is appended to a local journal (one JSON line per scan) and a background
+thread applies the buffered scans with checkin.check_in_many, one
+transaction per batch. The journal is forced to disk once per flush
+rather than once per scan.
+
+Applied scans are dropped from the journal, in one rewrite, when the
+flush that applied them ends. A journal left behind by a crash is
+replayed by start(); scans that were already committed are reported as
+ALREADY_SIGNED_IN/OUT, as a student has a single record per session
+(unique_attendance_record), so a replay never duplicates rows.
+
+Scans that can never be applied (an unknown student or session, or data
+the database rejects) are moved to the dead letter journal next to the
+journal instead of blocking the scans queued behind them.
+"""
+import atexit
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import checkin
+
+JOURNAL_FILE_NAME = "checkin_journal.jsonl"
+DEFAULT_BATCH_SIZE = 500
+# seconds between flushes of a partially filled batch
+DEFAULT_FLUSH_INTERVAL = 1.0
+# status of a scan that failed on its own
+REJECTED = "rejected"
+DEAD_LETTER_STATUSES = {checkin.UNKNOWN_STUDENT, checkin.UNKNOWN_SESSION}
+# errors caused by the scans themselves; any other error (a locked
+# database, a full disk...) leaves the batch buffered for the next try
+SCAN_ERRORS = (DataError, IntegrityError, TypeError, ValueError)
+
+
+def get_journal_path():
+    """The journal is kept next to the default database unless
+    settings.TAMS_CHECKIN_JOURNAL_PATH says otherwise
+    """
+    path = getattr(settings, "TAMS_CHECKIN_JOURNAL_PATH", None)
+    if path:
+        return str(path)
+    db_name = str(settings.DATABASES["default"].get("NAME") or "")
+    if not db_name or db_name == ":memory:" or "mode=memory" in db_name:
+        return None
+    return os.path.join(os.path.dirname(db_name), JOURNAL_FILE_NAME)
+
+
+def _dump_scan(scan):
+    return json.dumps(scan._asdict(), cls=DjangoJSONEncoder) + "\n"
+
+
+def _load_scan(line):
+    scan = checkin.Scan(**json.loads(line))
+    return scan._replace(time=parse_datetime(scan.time))
+
+
+def _dump_dead_letter(scan, reason):
+    return (
+        json.dumps(dict(scan._asdict(), reason=reason), cls=DjangoJSONEncoder)
+        + "\n"
+    )
+
+
+class CheckInBuffer:
+    """Buffer scans in memory and in the journal at journal_path (no
+    journal if None) and apply them batch_size at a time, at least every
+    flush_interval seconds once started. on_flush(scans, results) is
+    called after every applied batch. With fsync the journal is forced to
+    disk at the start of every flush, so a power cut loses at most the
+    scans of the last flush_interval.
+
+    Rejected scans are kept in dead_letters as (scan, reason) pairs and
+    appended to the dead letter journal.
+    """
+
+    def __init__(
+        self,
+        journal_path=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        fsync=True,
+        on_flush=None,
+    ):
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.on_flush = on_flush
+        self.last_error = None
+        self.dead_letters = []
+        self._pending = []
+        self._journal = None
+        self._unsynced = False
+        self._lock = threading.Lock()
+        # only one batch is applied at a time
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _open_journal(self):
+        if self.journal_path is not None and self._journal is None:
+            self._journal = open(self.journal_path, "a")
+
+    @property
+    def dead_letter_path(self):
+        if self.journal_path is None:
+            return None
+        return "%s.rejected" % self.journal_path
+
+    def _write_journal(self, scans):
+        self._journal.write("".join(_dump_scan(scan) for scan in scans))
+        self._journal.flush()
+        self._unsynced = True
+
+    def _sync_journal(self):
+        """Force the scans journaled since the last flush to disk. The
+        lock is only held to pick the journal, so record() isn't blocked
+        by the fsync.
+        """
+        with self._lock:
+            if self._journal is None or not self._unsynced:
+                return
+            self._unsynced = False
+            fileno = self._journal.fileno()
+        if self.fsync:
+            os.fsync(fileno)
+
+    def _rewrite_journal(self):
+        """Replace the journal with the scans still pending. Only the
+        flushing thread removes scans from the pending list, so the scans
+        recorded while the new journal is written are the ones past the
+        copied prefix and are carried over before the swap.
+        """
+        with self._lock:
+            if self._journal is None:
+                return
+            scans = list(self._pending)
+        tmp_path = "%s.tmp" % self.journal_path
+        with open(tmp_path, "w") as journal:
+            journal.write("".join(_dump_scan(scan) for scan in scans))
+            journal.flush()
+            if self.fsync:
+                os.fsync(journal.fileno())
+        with self._lock:
+            recorded = self._pending[len(scans) :]
+            if recorded:
+                with open(tmp_path, "a") as journal:
+                    journal.write(
+                        "".join(_dump_scan(scan) for scan in recorded)
+                    )
+            self._journal.close()
+            os.replace(tmp_path, self.journal_path)
+            self._journal = open(self.journal_path, "a")
+            self._unsynced = bool(recorded)
+
+    def _dead_letter(self, rejected):
+        """Keep the (scan, reason) pairs that can never be applied"""
+        self.dead_letters.extend(rejected)
+        if self.dead_letter_path is None:
+            return
+        with open(self.dead_letter_path, "a") as dead_letters:
+            dead_letters.write(
+                "".join(
+                    _dump_dead_letter(scan, reason)
+                    for scan, reason in rejected
+                )
+            )
+            dead_letters.flush()
+            if self.fsync:
+                os.fsync(dead_letters.fileno())
+
+    def _apply(self, scans):
+        """Apply scans with check_in_many, bisecting a batch that fails
+        on its data down to the scans that can't be applied. Returns their
+        results and the rejected (scan, reason) pairs.
+        """
+        try:
+            results = checkin.check_in_many(scans)
+        except SCAN_ERRORS as e:
+            if len(scans) == 1:
+                (scan,) = scans
+                result = checkin.CheckInResult(
+                    scan.reg_number, REJECTED, None, None
+                )
+                return [result], [(scan, repr(e))]
+            middle = len(scans) // 2
+            results, rejected = self._apply(scans[:middle])
+            more_results, more_rejected = self._apply(scans[middle:])
+            return results + more_results, rejected + more_rejected
+        rejected = [
+            (scan, result.status)
+            for scan, result in zip(scans, results)
+            if result.status in DEAD_LETTER_STATUSES
+        ]
+        return results, rejected
+
+    def replay(self):
+        """Queue the scans of a journal left by a previous run"""
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path) as journal:
+            scans = []
+            for line in journal:
+                try:
+                    scans.append(_load_scan(line))
+                except (ValueError, TypeError):
+                    # a line cut short by the crash
+                    continue
+        with self._lock:
+            self._pending[:0] = scans
+        return len(scans)
+
+    def record(self, attendance_session, reg_number, action, time=None):
+        """Buffer a scan and return it once it is journaled"""
+        scan = checkin.Scan(
+            getattr(attendance_session, "pk", attendance_session),
+            reg_number,
+            checkin.parse_action(action),
+            time or timezone.now(),
+        )
+        with self._lock:
+            self._open_journal()
+            if self._journal is not None:
+                self._write_journal([scan])
+            self._pending.append(scan)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+        return scan
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Apply the buffered scans (batch_size at a time) and return
+        their results. The applied scans are dropped from the journal in
+        one rewrite once the flush ends.
+        """
+        results = []
+        with self._flush_lock:
+            self._sync_journal()
+            applied = 0
+            try:
+                while True:
+                    with self._lock:
+                        scans = self._pending[: self.batch_size]
+                    if not scans:
+                        break
+                    batch_results, rejected = self._apply(scans)
+                    if rejected:
+                        self._dead_letter(rejected)
+                    with self._lock:
+                        del self._pending[: len(scans)]
+                    applied += len(scans)
+                    if self.on_flush is not None:
+                        self.on_flush(scans, batch_results)
+                    results.extend(batch_results)
+            finally:
+                if applied:
+                    self._rewrite_journal()
+        return results
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                    self.last_error = None
+                except Exception as e:
+                    # scans stay buffered and journaled for the next try
+                    self.last_error = e
+        finally:
+            connections.close_all()
+
+    def start(self):
+        """Replay any journal left behind and start the background writer"""
+        self.replay()
+        with self._flush_lock:
+            with self._lock:
+                self._open_journal()
+            self._rewrite_journal()
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="tams-checkin-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background writer after applying the buffered scans"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+_checkin_buffer = None
+_checkin_buffer_lock = threading.Lock()
+
+
+def get_checkin_buffer():
+    """The process wide buffer, started on first use. Its batch size and
+    flush interval come from settings.TAMS_CHECKIN_BATCH_SIZE and
+    settings.TAMS_CHECKIN_FLUSH_INTERVAL.
+    """
+    global _checkin_buffer
+    with _checkin_buffer_lock:
+        if _checkin_buffer is None:
+            _checkin_buffer = CheckInBuffer(
+                get_journal_path(),
+                batch_size=getattr(
+                    settings, "TAMS_CHECKIN_BATCH_SIZE", DEFAULT_BATCH_SIZE
+                ),
+                flush_interval=getattr(
+                    settings,
+                    "TAMS_CHECKIN_FLUSH_INTERVAL",
+                    DEFAULT_FLUSH_INTERVAL,
+                ),
+            )
+            _checkin_buffer.start()
+        return _checkin_buffer
+
+
+def stop_checkin_buffer():
+    """Apply the buffered scans and stop the process wide buffer"""
+    global _checkin_buffer
+    with _checkin_buffer_lock:
+        checkin_buffer, _checkin_buffer = _checkin_buffer, None
+    if checkin_buffer is not None:
+        checkin_buffer.stop()
+
+
+atexit.register(stop_checkin_buffer)
@@ -19,13 +19,28 @@ Data transferred from server to node device includes:
 Data transferred from node device to server
     = AttendanceSession
     = AtendanceRecord
+
+After the initial transfer, nodes are kept up to date with deltas: every
+save of a server model stamps the row with a new revision and every
+delete leaves a SyncTombstone, so export_delta only ships the rows
+changed since the revision a node last acknowledged.
 """
+from collections import defaultdict
 import os
-import subprocess
 from pathlib import Path
 import json
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 
-import pandas as pd
+from . import refcache, syncformat
+from .instrumentation import instrumented
+from .models import NodeDevice, SyncState, SyncTombstone
 
 EXCLUDED_TABLES = (
     "db.appadmin",
@@ -47,87 +62,483 @@ SERVER_DUMP = (
 )
 NODE_DUMP = ("AttendanceSession", "AttendanceRecord")
 
+# number of rows inserted/updated per query by bulk_load
+LOAD_BATCH_SIZE = 1000
+# number of rows fetched and serialized at a time by dump_data
+DUMP_CHUNK_SIZE = 2000
+
+# dump formats, see syncformat.py for the compact one
+JSON_FORMAT = "json"
+COMPACT_FORMAT = "compact"
+DUMP_FILE_EXTENSIONS = {JSON_FORMAT: ".json", COMPACT_FORMAT: ".tams"}
+
 CURRENT_DIR = Path(os.path.abspath(__file__)).parent
+# created when the first dump is written
 DUMP_DIR = os.path.join(CURRENT_DIR.parent, "dumps")
-os.makedirs(DUMP_DIR, exist_ok=True)
 
 
 def csv_to_json(csv_file):
-    try:
-        df = pd.read_csv(csv_file, skipinitialspace=True)
-    except Exception as e:
-        print(e)
-
-    json_file_path = csv_file.split(".csv")[0] + ".json"
-    content = [el for idx, el in df.iterrows()]
-    with open(json_file_path) as json_file:
-        json_file.write(json.dumps(content, indent=4))
-    return
-
-
-def dump_data(from_server: bool = True):
+    """Write the rows of csv_file to a JSON file next to it, returning the
+    JSON file's path
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_file, skipinitialspace=True)
+    json_file_path = os.path.splitext(csv_file)[0] + ".json"
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    with open(json_file_path, "w") as json_file:
+        json_file.write(json.dumps(records, indent=4, cls=DjangoJSONEncoder))
+    return json_file_path
+
+
+def get_dump_format():
+    """Format new dumps are written in (settings.TAMS_SYNC_FORMAT), JSON
+    unless the compact format is configured
+    """
+    return getattr(settings, "TAMS_SYNC_FORMAT", JSON_FORMAT)
+
+
+def get_dump_path(from_server: bool = True, dump_format: str = None):
+    dump_file_name = "server_dump" if from_server else "node_dump"
+    extension = DUMP_FILE_EXTENSIONS[dump_format or get_dump_format()]
+    return os.path.join(DUMP_DIR, dump_file_name + extension)
+
+
+def iter_model_records(model_names, chunk_size: int = DUMP_CHUNK_SIZE):
+    """Serialize every row of the given models, in foreign key order,
+    fetching and serializing chunk_size rows at a time
+    """
+    for model in sort_models(
+        apps.get_model("db", name) for name in model_names
+    ):
+        m2m_fields = [field.name for field in model._meta.many_to_many]
+        queryset = model._default_manager.order_by("pk")
+        chunk = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                prefetch_related_objects(chunk, *m2m_fields)
+                yield from serializers.serialize("python", chunk)
+                chunk = []
+        if chunk:
+            prefetch_related_objects(chunk, *m2m_fields)
+            yield from serializers.serialize("python", chunk)
+
+
+def write_records(records, file_path, dump_format: str = JSON_FORMAT):
+    """Write records to file_path. JSON dumps are written as an array with
+    one record per line, so they can be read back record by record (see
+    iter_dump_file).
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_file_path = "%s.tmp" % file_path
+    if dump_format == COMPACT_FORMAT:
+        with open(tmp_file_path, "wb") as dump_file:
+            syncformat.write_compact(records, dump_file)
+    else:
+        with open(tmp_file_path, "w") as dump_file:
+            dump_file.write("[")
+            separator = "\n"
+            for record in records:
+                dump_file.write(separator)
+                dump_file.write(json.dumps(record, cls=DjangoJSONEncoder))
+                separator = ",\n"
+            dump_file.write("\n]\n")
+    os.replace(tmp_file_path, file_path)
+
+
+def iter_dump_file(file_path):
+    """Read the records of a dump file one at a time. The format is
+    detected from the file content. JSON files that are not one record per
+    line (e.g. written by manage.py dumpdata) are parsed whole.
+    """
+    if syncformat.is_compact_dump(file_path):
+        with open(file_path, "rb") as dump_file:
+            yield from syncformat.iter_compact(dump_file)
+        return
+
+    with open(file_path, "r") as dump_file:
+        if dump_file.readline().strip() == "[":
+            line = dump_file.readline().strip().rstrip(",")
+            if line == "]":
+                return
+            if line.startswith("{") and line.endswith("}"):
+                yield json.loads(line)
+                for line in dump_file:
+                    line = line.strip().rstrip(",")
+                    if line and line != "]":
+                        yield json.loads(line)
+                return
+
+        dump_file.seek(0)
+        yield from json.load(dump_file)
+
+
+@instrumented("datasynch.dump_data")
+def dump_data(from_server: bool = True, chunk_size: int = DUMP_CHUNK_SIZE):
+    """Serialize the server (or node) models to a JSON string, as
+    manage.py dumpdata would. See write_dump to stream them to the dump
+    file instead of holding them in memory.
+    """
     model_list = SERVER_DUMP if from_server else NODE_DUMP
+    return json.dumps(
+        list(iter_model_records(model_list, chunk_size)), cls=DjangoJSONEncoder
+    )
+
+
+@instrumented("datasynch.write_dump")
+def write_dump(
+    from_server: bool = True,
+    chunk_size: int = DUMP_CHUNK_SIZE,
+    dump_format: str = None,
+):
+    """Stream the server (or node) models straight into the dump file and
+    return the file's path
+    """
+    model_list = SERVER_DUMP if from_server else NODE_DUMP
+    return save_dump(
+        iter_model_records(model_list, chunk_size), from_server, dump_format
+    )
+
+
+def save_dump(data, from_server: bool = True, dump_format: str = None):
+    """Save serialized data (a JSON string or an iterable of records) as
+    the server (or node) dump and return the file's path
+    """
+    if isinstance(data, (str, bytes)):
+        data = json.loads(data)
+    dump_format = dump_format or get_dump_format()
+    dump_file = get_dump_path(from_server, dump_format)
+    write_records(data, dump_file, dump_format)
+
+    # a dump in the other format would now be stale
+    for other_format in DUMP_FILE_EXTENSIONS:
+        if other_format != dump_format:
+            stale_file = get_dump_path(from_server, other_format)
+            if os.path.exists(stale_file):
+                os.remove(stale_file)
+    return dump_file
 
-    command_str = "python manage.py dumpdata "
-    for model in model_list:
-        command_str += "db.%s " % model
-
-    cmd_run = subprocess.run(command_str, shell=True, capture_output=True)
-
-    return cmd_run.stdout.decode("utf-8")
-
-
-def save_dump(data: str, from_server: bool = True):
-    dump_file_name = "server_dump.json" if from_server else "node_dump.json"
-    dump_file = os.path.join(DUMP_DIR, dump_file_name)
 
-    with open(dump_file, "w") as dump_file:
-        json.dump(json.loads(data), dump_file)
-    return True
+def get_dump(from_server: bool = True):
+    """Return the records of the most recent server (or node) dump"""
+    return list(iter_dump(from_server))
 
 
-def get_dump(from_server: bool = True):
-    dump_file_name = "server_dump.json" if from_server else "node_dump.json"
-    dump_file = os.path.join(DUMP_DIR, dump_file_name)
+def iter_dump(from_server: bool = True):
+    """Return an iterator over the records of the most recent server (or
+    node) dump, whatever its format
+    """
+    dump_files = [
+        get_dump_path(from_server, dump_format)
+        for dump_format in DUMP_FILE_EXTENSIONS
+    ]
+    dump_files = [path for path in dump_files if os.path.exists(path)]
 
-    if not os.path.exists(dump_file):
+    if not dump_files:
         raise FileNotFoundError(
-            "%s dump file not found" % dump_file_name.split("_")[0]
+            "%s dump file not found" % ("server" if from_server else "node")
         )
 
-    with open(dump_file, "r") as dump_file:
-        data = json.load(dump_file)
-
-    return data
-
-
-def load_data(to_server: bool = True):
-    dump_file_name = "node_dump.json" if to_server else "server_dump.json"
-    dump_file = os.path.join(DUMP_DIR, dump_file_name)
-
-    if not os.path.exists(dump_file):
-        raise FileNotFoundError(
-            "%s dump file not found" % dump_file_name.split("_")[0]
+    return iter_dump_file(max(dump_files, key=os.path.getmtime))
+
+
+def sort_models(model_list):
+    """Order models so that every model comes after the models its foreign
+    keys (and multi-table inheritance parents) point to. Models that do
+    not depend on each other keep their SERVER_DUMP/NODE_DUMP order.
+    """
+    dump_order = [
+        apps.get_model("db", model) for model in SERVER_DUMP + NODE_DUMP
+    ]
+    model_list = sorted(
+        set(model_list),
+        key=lambda model: (
+            dump_order.index(model) if model in dump_order else len(dump_order)
+        ),
+    )
+    dependencies = {
+        model: {
+            field.related_model
+            for field in model._meta.concrete_fields
+            if field.is_relation
+            and field.related_model in model_list
+            and field.related_model is not model
+        }
+        for model in model_list
+    }
+
+    ordered = []
+    while dependencies:
+        ready = [
+            model
+            for model in model_list
+            if model in dependencies and not dependencies[model] - set(ordered)
+        ]
+        if not ready:
+            raise ValueError(
+                "Circular foreign key dependency between %s"
+                % ", ".join(model._meta.label for model in dependencies)
+            )
+        for model in ready:
+            ordered.append(model)
+            del dependencies[model]
+    return ordered
+
+
+def bulk_insert(model, objs, batch_size: int = LOAD_BATCH_SIZE):
+    """bulk_create objs, keeping the values of their auto_now/auto_now_add
+    fields (e.g. a record's check_in_by on the node) instead of letting
+    bulk_create overwrite them with the current time
+    """
+    auto_fields = [
+        field
+        for field in model._meta.local_concrete_fields
+        if getattr(field, "auto_now", False)
+        or getattr(field, "auto_now_add", False)
+    ]
+    auto_values = [
+        [getattr(obj, field.attname) for field in auto_fields] for obj in objs
+    ]
+    created = model._base_manager.bulk_create(objs, batch_size=batch_size)
+
+    restore = []
+    for obj, values in zip(created, auto_values):
+        changed = False
+        for field, value in zip(auto_fields, values):
+            if value is not None and getattr(obj, field.attname) != value:
+                setattr(obj, field.attname, value)
+                changed = True
+        if changed and obj.pk is not None:
+            restore.append(obj)
+    if restore:
+        model._base_manager.bulk_update(
+            restore,
+            [field.name for field in auto_fields],
+            batch_size=batch_size,
+        )
+    return created
+
+
+def _bulk_save(model, deserialized_objects, batch_size):
+    """Insert or update one batch of deserialized objects of model.
+    Returns the number of (created, updated) rows.
+    """
+    objs = [item.object for item in deserialized_objects]
+    existing = set(
+        model._base_manager.filter(
+            pk__in=[obj.pk for obj in objs]
+        ).values_list("pk", flat=True)
+    )
+
+    if model._meta.parents:
+        # bulk_create can't insert into multi-table inherited models; a raw
+        # save only writes the model's own table, parents are loaded first
+        for obj in objs:
+            models.Model.save_base(obj, raw=True)
+    else:
+        new_objs = [obj for obj in objs if obj.pk not in existing]
+        old_objs = [obj for obj in objs if obj.pk in existing]
+        bulk_insert(model, new_objs, batch_size)
+        update_fields = [
+            field.name
+            for field in model._meta.local_concrete_fields
+            if not field.primary_key
+        ]
+        if old_objs and update_fields:
+            model._base_manager.bulk_update(
+                old_objs, update_fields, batch_size=batch_size
+            )
+
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        m2m_objs = [
+            item
+            for item in deserialized_objects
+            if field.name in item.m2m_data
+        ]
+        through._base_manager.filter(
+            **{"%s__in" % source: [item.object.pk for item in m2m_objs]}
+        ).delete()
+        through._base_manager.bulk_create(
+            [
+                through(
+                    **{
+                        "%s_id" % source: item.object.pk,
+                        "%s_id" % target: related_pk,
+                    }
+                )
+                for item in m2m_objs
+                for related_pk in item.m2m_data[field.name]
+            ],
+            batch_size=batch_size,
         )
 
-    command_str = "python manage.py loaddata %s" % dump_file
+    created = len(objs) - len(existing)
+    return created, len(existing)
+
+
+@instrumented("datasynch.bulk_load")
+def bulk_load(
+    records, batch_size: int = LOAD_BATCH_SIZE, ordered: bool = False
+):
+    """Load serialized records (the dumpdata format) into the database in
+    one transaction, model by model in foreign key order, with
+    bulk_create/bulk_update in batches of batch_size.
+
+    If ordered is True the records are trusted to already be in foreign
+    key order (as written by dump_data) and are streamed batch by batch
+    instead of being grouped by model in memory first.
+
+    Returns a report of per-model counts and timings:
+        {"db.student": {"created": 10, "updated": 2, "seconds": 0.01}, ...}
+    """
+    if not ordered:
+        by_model = defaultdict(list)
+        for record in records:
+            by_model[apps.get_model(record["model"])].append(record)
+        records = (
+            record
+            for model in sort_models(by_model)
+            for record in by_model.pop(model)
+        )
 
-    try:
-        cmd_run = subprocess.run(command_str, shell=True, capture_output=True)
-    except Exception as e:
-        e.args = ("Something went wrong. Contact admin. (%s)" % e,)
-        raise
+    report = {}
 
-    return cmd_run
+    def flush(batch):
+        started = time.perf_counter()
+        deserialized = list(serializers.deserialize("python", batch))
+        model = deserialized[0].object.__class__
+        created, updated = _bulk_save(model, deserialized, batch_size)
+        model_report = report.setdefault(
+            model._meta.label_lower,
+            {"created": 0, "updated": 0, "seconds": 0.0},
+        )
+        model_report["created"] += created
+        model_report["updated"] += updated
+        model_report["seconds"] += time.perf_counter() - started
+
+    with transaction.atomic():
+        batch = []
+        for record in records:
+            if batch and (
+                len(batch) == batch_size
+                or record["model"] != batch[0]["model"]
+            ):
+                flush(batch)
+                batch = []
+            batch.append(record)
+        if batch:
+            flush(batch)
+
+    # numpy backed, so only imported when data is actually loaded
+    from . import face_index, faces, fingerprints
+
+    # bulk writes don't send model signals
+    faces.clear_gallery_cache()
+    fingerprints.clear_gallery_cache()
+    refcache.written()
+    if face_index.is_face_index_enabled() and "db.student" in report:
+        face_index.rebuild_institution_index()
+    return report
+
+
+def load_data(
+    to_server: bool = True,
+    batch_size: int = LOAD_BATCH_SIZE,
+    node_device: NodeDevice = None,
+):
+    """Load the dump received from a node device (to_server) or from the
+    server. Node dumps are merged with ingest.ingest_node_dump, server
+    dumps are loaded with bulk_load. Returns the load report.
+    """
+    if to_server:
+        from .ingest import ingest_node_dump
+
+        return ingest_node_dump(
+            iter_dump(from_server=False), node_device, batch_size
+        )
+    return bulk_load(iter_dump(from_server=True), batch_size, ordered=True)
+
+
+@instrumented("datasynch.export_delta")
+def export_delta(since_revision: int = 0):
+    """Serialize the server models changed after since_revision.
+    A since_revision of 0 exports every row.
+    """
+    with transaction.atomic():
+        revision = SyncState.get_value(SyncState.REVISION)
+        records = []
+        exported_pks = set()
+        for model_name in SERVER_DUMP:
+            model = apps.get_model("db", model_name)
+            queryset = model._default_manager.filter(revision__lte=revision)
+            if since_revision:
+                queryset = queryset.filter(revision__gt=since_revision)
+            for record in serializers.serialize(
+                "python", queryset.order_by("pk").iterator()
+            ):
+                records.append(record)
+                exported_pks.add((record["model"], str(record["pk"])))
+
+        # rows deleted and then re-created are shipped as records only
+        deleted = [
+            {"model": model, "pk": object_pk}
+            for model, object_pk in SyncTombstone.objects.filter(
+                revision__gt=since_revision, revision__lte=revision
+            )
+            .order_by("revision")
+            .values_list("model", "object_pk")
+            if (model, object_pk) not in exported_pks
+        ]
+    return {"revision": revision, "records": records, "deleted": deleted}
+
+
+def export_node_delta(node_device: NodeDevice):
+    """Delta of the changes node_device has not acknowledged yet"""
+    return export_delta(node_device.synced_revision)
+
+
+def acknowledge_delta(node_device: NodeDevice, revision: int):
+    """Record that node_device has applied the delta up to revision"""
+    NodeDevice.objects.filter(
+        pk=node_device.pk, synced_revision__lt=revision
+    ).update(synced_revision=revision)
+    node_device.synced_revision = max(node_device.synced_revision, revision)
+
+
+def delta_to_json(delta):
+    return json.dumps(delta, cls=DjangoJSONEncoder)
+
+
+@instrumented("datasynch.import_delta")
+def import_delta(delta):
+    """Apply a delta produced by export_delta on a node device and
+    return the revision the node should acknowledge
+    """
+    if isinstance(delta, (str, bytes)):
+        delta = json.loads(delta)
+
+    with transaction.atomic():
+        # dependent rows are deleted first
+        for item in reversed(delta["deleted"]):
+            model = apps.get_model(item["model"])
+            model._default_manager.filter(pk=item["pk"]).delete()
+
+        for obj in serializers.deserialize("python", delta["records"]):
+            obj.save()
+
+        SyncState.set_value(SyncState.SYNCED_REVISION, delta["revision"])
+    return delta["revision"]
 
 
 """
 Issue of verification of node device before synching begins.
-Loading data to server will require different logic.
 
 Since attendance sessions and records are coming from multiple sources,
-rows from different dbs cannot maintain their pk's.
-    = check if a row already exists with exact field values as the row about to be saved
-        before the save operation.
-
+rows from different dbs cannot maintain their pk's. Loading data to the
+server is handled by ingest.py, which matches incoming rows against
+existing ones on their unique constraints in bulk.
 """
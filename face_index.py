@@ -0,0 +1,384 @@
+"""
+Approximate nearest-neighbour lookup of face encodings across every
+Student.
+
+Course galleries (see faces.py) are small enough for an exact scan, but
+events without a CourseRegistration filter (e.g. examinations with
+external candidates) have to search the whole institution. This module
+provides an inverted-file (IVF) index: encodings are clustered around
+n_lists k-means centroids and a probe is only compared with the
+encodings of its n_probe closest clusters. Raising n_probe improves
+recall at the cost of latency; n_probe == n_lists is an exact search.
+
+The institution index is optional (settings.TAMS_FACE_INDEX_ENABLED),
+persisted next to the database and kept current by the Student signal
+handlers.
+"""
+import atexit
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .faces import DEFAULT_FACE_TOLERANCE, FaceMatch
+from .models import FACE_ENCODING_DTYPE, FACE_ENCODING_LENGTH, Student
+
+FACE_INDEX_FILE_NAME = "face_index.npz"
+DEFAULT_N_PROBE = 4
+# number of pending incremental updates after which the index is saved
+DEFAULT_FLUSH_EVERY = 100
+
+
+def _kmeans(matrix, n_clusters, n_iter=10, seed=0):
+    """Plain Lloyd's k-means, returns the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[
+        rng.choice(matrix.shape[0], n_clusters, replace=False)
+    ].copy()
+    for _ in range(n_iter):
+        assignments = _nearest_centroids(matrix, centroids)
+        for idx in range(n_clusters):
+            members = matrix[assignments == idx]
+            if len(members):
+                centroids[idx] = members.mean(axis=0)
+    return centroids
+
+
+def _nearest_centroids(matrix, centroids, chunk_size=4096):
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    c_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, matrix.shape[0], chunk_size):
+        chunk = matrix[start : start + chunk_size]
+        # |c|^2 - 2 x.c is enough to rank centroids for each x
+        scores = c_sq_norms - 2 * (chunk @ centroids.T)
+        assignments[start : start + chunk_size] = np.argmin(scores, axis=1)
+    return assignments
+
+
+class IVFFaceIndex:
+    """An inverted-file index over labelled face encodings that supports
+    incremental add, update and remove
+    """
+
+    def __init__(self, centroids, labels=(), matrix=None):
+        self.centroids = np.ascontiguousarray(
+            centroids, dtype=FACE_ENCODING_DTYPE
+        )
+        self._lock = threading.RLock()
+        self._labels = []
+        self._rows = {}
+        self._vectors = np.empty(
+            (max(len(labels), 16), FACE_ENCODING_LENGTH),
+            dtype=FACE_ENCODING_DTYPE,
+        )
+        self._assignments = np.empty(len(self._vectors), dtype=np.int32)
+        self._size = 0
+        self._inverted_lists = None
+        if len(labels):
+            self._append(labels, matrix)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, label):
+        return label in self._rows
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, labels, matrix, n_lists=None, n_iter=10, seed=0):
+        """Train the centroids on matrix and index every row of it"""
+        matrix = np.asarray(matrix, dtype=FACE_ENCODING_DTYPE)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(matrix)))
+        n_lists = max(1, min(n_lists, len(matrix)))
+        if len(matrix):
+            centroids = _kmeans(matrix, n_lists, n_iter=n_iter, seed=seed)
+        else:
+            centroids = np.zeros(
+                (1, FACE_ENCODING_LENGTH), dtype=FACE_ENCODING_DTYPE
+            )
+        return cls(centroids, labels, matrix)
+
+    def _append(self, labels, matrix):
+        matrix = np.asarray(matrix, dtype=FACE_ENCODING_DTYPE).reshape(
+            -1, FACE_ENCODING_LENGTH
+        )
+        needed = self._size + len(labels)
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors))
+            vectors = np.empty(
+                (capacity, FACE_ENCODING_LENGTH), dtype=FACE_ENCODING_DTYPE
+            )
+            vectors[: self._size] = self._vectors[: self._size]
+            assignments = np.empty(capacity, dtype=np.int32)
+            assignments[: self._size] = self._assignments[: self._size]
+            self._vectors, self._assignments = vectors, assignments
+
+        rows = slice(self._size, needed)
+        self._vectors[rows] = matrix
+        self._assignments[rows] = _nearest_centroids(matrix, self.centroids)
+        for offset, label in enumerate(labels):
+            self._rows[label] = self._size + offset
+            self._labels.append(label)
+        self._size = needed
+        self._inverted_lists = None
+
+    def add(self, label, encoding):
+        """Index encoding under label, replacing any previous encoding"""
+        return self.add_many([label], encoding)
+
+    def add_many(self, labels, matrix):
+        """Index the rows of matrix under labels, replacing any previous
+        encodings. Labels already indexed with the same encoding are left
+        alone; returns the number of labels (re)indexed.
+        """
+        matrix = np.asarray(matrix, dtype=FACE_ENCODING_DTYPE).reshape(
+            -1, FACE_ENCODING_LENGTH
+        )
+        with self._lock:
+            changed = [
+                idx
+                for idx, label in enumerate(labels)
+                if label not in self._rows
+                or not np.array_equal(
+                    self._vectors[self._rows[label]], matrix[idx]
+                )
+            ]
+            if len(changed) < len(labels):
+                labels = [labels[idx] for idx in changed]
+                matrix = matrix[changed]
+            for label in labels:
+                self.remove(label)
+            if labels:
+                self._append(labels, matrix)
+            return len(labels)
+
+    def remove(self, label):
+        """Remove label from the index; unknown labels are ignored"""
+        with self._lock:
+            row = self._rows.pop(label, None)
+            if row is not None:
+                self._assignments[row] = -1
+                self._labels[row] = None
+                self._inverted_lists = None
+                if self._size - len(self._rows) > len(self._rows):
+                    self._compact()
+
+    def _compact(self):
+        """Drop the rows of removed labels, keeping the capacity"""
+        live = sorted(self._rows.values())
+        size = len(live)
+        self._vectors[:size] = self._vectors[live]
+        self._assignments[:size] = self._assignments[live]
+        self._labels = [self._labels[row] for row in live]
+        self._rows = {label: row for row, label in enumerate(self._labels)}
+        self._size = size
+        self._inverted_lists = None
+
+    def _get_inverted_lists(self):
+        if self._inverted_lists is None:
+            assignments = self._assignments[: self._size]
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(
+                assignments[order], np.arange(self.n_lists + 1)
+            )
+            self._inverted_lists = [
+                order[bounds[idx] : bounds[idx + 1]]
+                for idx in range(self.n_lists)
+            ]
+        return self._inverted_lists
+
+    def search(self, probe, k=1, n_probe=DEFAULT_N_PROBE):
+        """Return up to k FaceMatch results for probe, closest first,
+        scanning the n_probe clusters closest to probe
+        """
+        probe = np.asarray(probe, dtype=FACE_ENCODING_DTYPE)
+        with self._lock:
+            inverted_lists = self._get_inverted_lists()
+            centroid_dist = np.einsum(
+                "ij,ij->i", self.centroids - probe, self.centroids - probe
+            )
+            n_probe = max(1, min(n_probe, self.n_lists))
+            nearest_lists = np.argpartition(centroid_dist, n_probe - 1)[
+                :n_probe
+            ]
+            rows = np.concatenate([inverted_lists[i] for i in nearest_lists])
+            if not len(rows):
+                return []
+            candidates = self._vectors[rows]
+            labels = [self._labels[row] for row in rows]
+
+        distances = np.linalg.norm(candidates - probe, axis=1)
+        k = min(k, len(rows))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return [FaceMatch(labels[i], float(distances[i])) for i in best]
+
+    def best_match(
+        self, probe, tolerance=DEFAULT_FACE_TOLERANCE, n_probe=DEFAULT_N_PROBE
+    ):
+        """Return the closest FaceMatch within tolerance, or None"""
+        matches = self.search(probe, k=1, n_probe=n_probe)
+        if not matches or (
+            tolerance is not None and matches[0].distance > tolerance
+        ):
+            return None
+        return matches[0]
+
+    def save(self, path):
+        """Write the index to path (.npz), compacting removed rows"""
+        with self._lock:
+            live = [
+                row
+                for row in range(self._size)
+                if self._labels[row] is not None
+            ]
+            labels = np.array([self._labels[row] for row in live], dtype=str)
+            vectors = self._vectors[live]
+        tmp_path = "%s.tmp.npz" % path
+        np.savez(
+            tmp_path, centroids=self.centroids, labels=labels, vectors=vectors
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()"""
+        with np.load(path) as data:
+            return cls(
+                data["centroids"], data["labels"].tolist(), data["vectors"]
+            )
+
+
+def get_face_index_path():
+    """The institution index is stored next to the default database unless
+    settings.TAMS_FACE_INDEX_PATH says otherwise
+    """
+    path = getattr(settings, "TAMS_FACE_INDEX_PATH", None)
+    if path:
+        return str(path)
+    db_name = str(settings.DATABASES["default"].get("NAME") or "")
+    if not db_name or db_name == ":memory:" or "mode=memory" in db_name:
+        return None
+    return os.path.join(os.path.dirname(db_name), FACE_INDEX_FILE_NAME)
+
+
+def is_face_index_enabled():
+    return getattr(settings, "TAMS_FACE_INDEX_ENABLED", False)
+
+
+_institution_index = None
+_pending_updates = 0
+_institution_index_lock = threading.Lock()
+
+
+def build_institution_index(n_lists=None):
+    """Build the index over every active Student with a face encoding"""
+    from .faces import FaceGallery
+
+    gallery = FaceGallery.from_queryset(Student.objects.filter(is_active=True))
+    return IVFFaceIndex.build(gallery.labels, gallery.matrix, n_lists=n_lists)
+
+
+def get_institution_index():
+    """Return the institution index, loading it from disk or building it
+    on first use
+    """
+    global _institution_index
+    with _institution_index_lock:
+        if _institution_index is None:
+            path = get_face_index_path()
+            if path and os.path.exists(path):
+                _institution_index = IVFFaceIndex.load(path)
+            else:
+                _institution_index = build_institution_index()
+                if path:
+                    _institution_index.save(path)
+        return _institution_index
+
+
+def rebuild_institution_index(n_lists=None):
+    """Retrain the institution index from the database and save it"""
+    global _institution_index, _pending_updates
+    index = build_institution_index(n_lists=n_lists)
+    path = get_face_index_path()
+    if path:
+        index.save(path)
+    with _institution_index_lock:
+        _institution_index = index
+        _pending_updates = 0
+    return index
+
+
+def flush_institution_index():
+    """Save pending incremental updates of the institution index"""
+    global _pending_updates
+    with _institution_index_lock:
+        index, pending = _institution_index, _pending_updates
+        _pending_updates = 0
+    path = get_face_index_path()
+    if index is not None and pending and path:
+        index.save(path)
+
+
+def update_student(student):
+    """Apply a Student's current encoding to the loaded institution index"""
+    update_students([student])
+
+
+def update_students(students):
+    """Apply the current encodings of Students to the loaded institution
+    index, e.g. after a bulk write that sent no signals
+    """
+    global _pending_updates
+    with _institution_index_lock:
+        index = _institution_index
+    if index is None or not students:
+        return
+
+    enrolled = [
+        student
+        for student in students
+        if student.is_active and student.face_encodings_bin is not None
+    ]
+    enrolled_labels = {student.reg_number for student in enrolled}
+    changed = 0
+    for student in students:
+        if student.reg_number not in enrolled_labels:
+            changed += student.reg_number in index
+            index.remove(student.reg_number)
+    if enrolled:
+        changed += index.add_many(
+            [student.reg_number for student in enrolled],
+            np.frombuffer(
+                b"".join(bytes(s.face_encodings_bin) for s in enrolled),
+                FACE_ENCODING_DTYPE,
+            ),
+        )
+    if not changed:
+        return
+
+    flush_every = getattr(
+        settings, "TAMS_FACE_INDEX_FLUSH_EVERY", DEFAULT_FLUSH_EVERY
+    )
+    with _institution_index_lock:
+        _pending_updates += changed
+        flush = _pending_updates >= flush_every
+    if flush:
+        flush_institution_index()
+
+
+def find_student(probe, tolerance=DEFAULT_FACE_TOLERANCE, n_probe=None):
+    """Match probe against every enrolled Student"""
+    if n_probe is None:
+        n_probe = getattr(settings, "TAMS_FACE_INDEX_N_PROBE", DEFAULT_N_PROBE)
+    return get_institution_index().best_match(
+        probe, tolerance=tolerance, n_probe=n_probe
+    )
+
+
+atexit.register(flush_institution_index)
@@ -0,0 +1,109 @@
+"""
+Face matching against galleries of enrolled face encodings.
+
+A gallery holds every usable encoding for a group of students (the
+students registered for a course, a department, ...) in one contiguous
+float32 matrix so that a probe is matched with a single vectorized
+distance computation instead of decoding and comparing encodings one
+student at a time.
+
+Galleries of registered students are cached per (course, session) and
+dropped by the signal handlers in signals.py whenever an encoding or a
+course registration changes (see galleries.py).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from .galleries import GalleryCache, StudentGallery
+from .models import FACE_ENCODING_DTYPE, FACE_ENCODING_LENGTH
+
+# distance at or below which two encodings are considered the same face
+DEFAULT_FACE_TOLERANCE = 0.6
+
+FaceMatch = namedtuple("FaceMatch", ["label", "distance"])
+
+
+class FaceGallery(StudentGallery):
+    """An immutable set of labelled face encodings."""
+
+    template_field = "face_encodings_bin"
+
+    def __init__(self, labels, matrix):
+        matrix = np.ascontiguousarray(matrix, dtype=FACE_ENCODING_DTYPE)
+        if matrix.ndim != 2 or matrix.shape[1] != FACE_ENCODING_LENGTH:
+            raise ValueError(
+                "Gallery matrix must have shape (n, %d)" % FACE_ENCODING_LENGTH
+            )
+        if len(labels) != matrix.shape[0]:
+            raise ValueError("Number of labels does not match the matrix")
+
+        self.labels = tuple(labels)
+        self.matrix = matrix
+        self.matrix.flags.writeable = False
+        # squared norms are reused by every distance computation
+        self._sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self._index = {label: idx for idx, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self._index
+
+    def encoding(self, label):
+        """Return the encoding stored for label"""
+        return self.matrix[self._index[label]]
+
+    def template_bytes(self, label):
+        return self.encoding(label).tobytes()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a gallery from (label, float32 bytes) pairs.
+        Rows without a usable encoding are skipped.
+        """
+        row_size = (
+            FACE_ENCODING_LENGTH * np.dtype(FACE_ENCODING_DTYPE).itemsize
+        )
+        labels = []
+        blobs = []
+        for label, enc_bytes in rows:
+            if enc_bytes is None or len(enc_bytes) != row_size:
+                continue
+            labels.append(label)
+            blobs.append(bytes(enc_bytes))
+
+        matrix = np.frombuffer(b"".join(blobs), dtype=FACE_ENCODING_DTYPE)
+        return cls(labels, matrix.reshape(len(labels), FACE_ENCODING_LENGTH))
+
+    def distances(self, probe):
+        """Euclidean distance between probe and every gallery encoding"""
+        probe = np.asarray(probe, dtype=FACE_ENCODING_DTYPE)
+        if probe.shape != (FACE_ENCODING_LENGTH,):
+            raise ValueError(
+                "Probe must be a %d-d encoding" % FACE_ENCODING_LENGTH
+            )
+        sq_dist = self._sq_norms - 2 * (self.matrix @ probe) + probe @ probe
+        return np.sqrt(np.maximum(sq_dist, 0))
+
+    def best_match(self, probe, tolerance=DEFAULT_FACE_TOLERANCE):
+        """Return the closest FaceMatch for probe, or None if the gallery is
+        empty or no encoding is within tolerance
+        """
+        if not self.labels:
+            return None
+        distances = self.distances(probe)
+        idx = int(np.argmin(distances))
+        distance = float(distances[idx])
+        if tolerance is not None and distance > tolerance:
+            return None
+        return FaceMatch(self.labels[idx], distance)
+
+
+_galleries = GalleryCache(FaceGallery)
+get_course_gallery = _galleries.get_course_gallery
+get_attendance_session_gallery = _galleries.get_attendance_session_gallery
+clear_gallery_cache = _galleries.clear
+invalidate_course_gallery = _galleries.invalidate_course
+invalidate_student_galleries = _galleries.invalidate_student
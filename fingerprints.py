@@ -0,0 +1,195 @@
+"""
+Fingerprint identification against galleries of enrolled templates.
+
+Templates are decoded once, when a Student is saved, from the encoding
+named by fingerprint_template_encoding into fingerprint_template_bin. A
+gallery packs the templates of a group of students (those registered for
+a course, a department, ...) into one uint8 matrix, zero padded to the
+longest template, so that a scanner reading is identified (1:N) with a
+few vectorized calls instead of fetching and decoding templates one
+student at a time.
+
+Scoring is delegated to a FingerprintMatcher, which scores a probe
+against a block of gallery rows in one call. The matcher is the
+scanner vendor's and must be named by settings.TAMS_FINGERPRINT_MATCHER
+(a dotted path to a FingerprintMatcher subclass). BitwiseMatcher, which
+scores the share of equal bits, is only meant for tests and demos: raw
+template bytes of two readings of one finger don't line up bit for bit.
+identify scores the gallery block by block and stops at the first block
+holding a score at or above early_exit.
+
+Galleries of registered students are cached per (course, session) and
+dropped by the signal handlers in signals.py whenever a template or a
+course registration changes (see galleries.py).
+"""
+import abc
+from collections import namedtuple
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .galleries import GalleryCache, StudentGallery
+
+# score at or above which a template is taken to be the probe's finger
+DEFAULT_FINGERPRINT_THRESHOLD = 0.8
+# gallery rows scored per matcher call
+DEFAULT_MATCH_BATCH_SIZE = 256
+
+FingerprintMatch = namedtuple("FingerprintMatch", ["label", "score"])
+
+# number of set bits of every byte value
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], np.uint8)
+
+
+class FingerprintMatcher(abc.ABC):
+    """Scores a probe template against gallery templates."""
+
+    @abc.abstractmethod
+    def score(self, probe, templates, lengths):
+        """Score the probe, a 1-d uint8 array, against gallery rows, a 2-d
+        uint8 array of the same width, given the length of every template
+        before padding. Returns one score per row, higher meaning more
+        similar.
+        """
+
+
+class BitwiseMatcher(FingerprintMatcher):
+    """Share of equal bits over the length of the shorter template. Not a
+    fingerprint matcher, see the module docstring.
+    """
+
+    def score(self, probe, templates, lengths):
+        # bits past either template's length don't count
+        compared = np.arange(templates.shape[1]) < lengths[:, None]
+        differing = _POPCOUNT[np.bitwise_xor(templates, probe)] * compared
+        bits = np.maximum(lengths, 1) * 8
+        return 1 - differing.sum(axis=1) / bits
+
+
+_matcher = None
+_matcher_path = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """The matcher named by settings.TAMS_FINGERPRINT_MATCHER. Raises
+    ImproperlyConfigured if the setting is missing.
+    """
+    global _matcher, _matcher_path
+    path = getattr(settings, "TAMS_FINGERPRINT_MATCHER", None)
+    if not path:
+        raise ImproperlyConfigured(
+            "TAMS_FINGERPRINT_MATCHER must name the FingerprintMatcher "
+            "used to identify fingerprints"
+        )
+    with _matcher_lock:
+        if _matcher is None or _matcher_path != path:
+            _matcher, _matcher_path = import_string(path)(), path
+        return _matcher
+
+
+class FingerprintGallery(StudentGallery):
+    """An immutable set of labelled fingerprint templates."""
+
+    template_field = "fingerprint_template_bin"
+
+    def __init__(self, labels, templates):
+        if len(labels) != len(templates):
+            raise ValueError("Number of labels does not match the templates")
+        self.labels = tuple(labels)
+        self.lengths = np.array([len(t) for t in templates], dtype=np.int64)
+        width = int(self.lengths.max()) if len(templates) else 0
+        self.matrix = np.zeros((len(templates), width), dtype=np.uint8)
+        for idx, template in enumerate(templates):
+            self.matrix[idx, : len(template)] = np.frombuffer(
+                template, dtype=np.uint8
+            )
+        self.matrix.flags.writeable = False
+        self._index = {label: idx for idx, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self._index
+
+    def template(self, label):
+        """Return the template bytes stored for label"""
+        idx = self._index[label]
+        return self.matrix[idx, : self.lengths[idx]].tobytes()
+
+    def template_bytes(self, label):
+        return self.template(label)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a gallery from (label, template bytes) pairs.
+        Rows without a template are skipped.
+        """
+        labels = []
+        templates = []
+        for label, template in rows:
+            if not template:
+                continue
+            labels.append(label)
+            templates.append(bytes(template))
+        return cls(labels, templates)
+
+    def _probe(self, probe):
+        probe = np.frombuffer(bytes(probe), dtype=np.uint8)
+        width = self.matrix.shape[1]
+        padded = np.zeros(width, dtype=np.uint8)
+        padded[: min(len(probe), width)] = probe[:width]
+        return padded, len(probe)
+
+    def scores(self, probe, matcher=None):
+        """Score of probe (template bytes) against every template"""
+        matcher = matcher or get_matcher()
+        probe, length = self._probe(probe)
+        return matcher.score(
+            probe, self.matrix, np.minimum(self.lengths, length)
+        )
+
+    def identify(
+        self,
+        probe,
+        threshold=DEFAULT_FINGERPRINT_THRESHOLD,
+        early_exit=None,
+        matcher=None,
+        batch_size=DEFAULT_MATCH_BATCH_SIZE,
+    ):
+        """Return the best FingerprintMatch for probe, or None if no
+        template scores at least threshold. With early_exit the remaining
+        templates aren't scored once a block holds a score at or above it.
+        """
+        if not self.labels:
+            return None
+        matcher = matcher or get_matcher()
+        probe, length = self._probe(probe)
+        lengths = np.minimum(self.lengths, length)
+        best_idx = None
+        best_score = -np.inf
+        for start in range(0, len(self.labels), batch_size):
+            stop = start + batch_size
+            scores = matcher.score(
+                probe, self.matrix[start:stop], lengths[start:stop]
+            )
+            idx = int(np.argmax(scores))
+            if scores[idx] > best_score:
+                best_idx, best_score = start + idx, float(scores[idx])
+            if early_exit is not None and best_score >= early_exit:
+                break
+        if threshold is not None and best_score < threshold:
+            return None
+        return FingerprintMatch(self.labels[best_idx], best_score)
+
+
+_galleries = GalleryCache(FingerprintGallery)
+get_course_gallery = _galleries.get_course_gallery
+get_attendance_session_gallery = _galleries.get_attendance_session_gallery
+clear_gallery_cache = _galleries.clear
+invalidate_course_gallery = _galleries.invalidate_course
+invalidate_student_galleries = _galleries.invalidate_student
@@ -0,0 +1,153 @@
+"""
+Galleries of students' biometric templates and their cache.
+
+StudentGallery is the base of FaceGallery (faces.py) and
+FingerprintGallery (fingerprints.py): a gallery built from a binary
+template column of Student (template_field), keyed by reg_number.
+
+GalleryCache caches the galleries of the students registered for a
+course per (course, session) and drops the galleries a student's
+template, a student's active state or a course registration makes stale
+(see the signal handlers in signals.py).
+"""
+import abc
+import threading
+
+from .models import CourseRegistration, Student
+
+
+class StudentGallery(abc.ABC):
+    """A gallery of the templates stored in Student.<template_field>"""
+
+    template_field = None
+
+    @classmethod
+    @abc.abstractmethod
+    def from_rows(cls, rows):
+        """Build a gallery from (label, template bytes) pairs"""
+
+    @abc.abstractmethod
+    def template_bytes(self, label):
+        """Return the template bytes stored for label"""
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """Build a gallery of Student templates keyed by reg_number"""
+        return cls.from_rows(
+            queryset.filter(**{"%s__isnull" % cls.template_field: False})
+            .order_by("reg_number")
+            .values_list("reg_number", cls.template_field)
+        )
+
+    @classmethod
+    def for_course(cls, course, session=None):
+        """Gallery of the students registered for a course, optionally
+        restricted to one academic session
+        """
+        registrations = {"courseregistration__course": course}
+        if session is not None:
+            registrations["courseregistration__session"] = session
+        return cls.from_queryset(
+            Student.objects.filter(is_active=True, **registrations).distinct()
+        )
+
+    @classmethod
+    def for_department(cls, department):
+        """Gallery of the active students of a department"""
+        return cls.from_queryset(
+            Student.objects.filter(is_active=True, department=department)
+        )
+
+
+class GalleryCache:
+    """Galleries of gallery_class (a StudentGallery subclass) cached per
+    (course id, session id)
+    """
+
+    def __init__(self, gallery_class):
+        self.gallery_class = gallery_class
+        self._galleries = {}
+        self._lock = threading.Lock()
+        # bumped on every invalidation so that a gallery built from data
+        # read before an invalidation is never stored in the cache
+        self._generation = 0
+
+    def get_course_gallery(self, course_id, session_id=None):
+        """Return the (cached) gallery of students registered for a
+        course
+        """
+        key = (course_id, session_id)
+        with self._lock:
+            gallery = self._galleries.get(key)
+            generation = self._generation
+        if gallery is not None:
+            return gallery
+
+        gallery = self.gallery_class.for_course(course_id, session_id)
+        with self._lock:
+            if generation == self._generation:
+                self._galleries[key] = gallery
+        return gallery
+
+    def get_attendance_session_gallery(self, attendance_session):
+        """Return the (cached) gallery for an AttendanceSession"""
+        return self.get_course_gallery(
+            attendance_session.course_id, attendance_session.session_id
+        )
+
+    def _drop(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._galleries.pop(key, None)
+
+    def clear(self):
+        """Drop every cached gallery"""
+        with self._lock:
+            self._generation += 1
+            self._galleries.clear()
+
+    def invalidate_course(self, course_id, session_id=None):
+        """Drop the cached galleries of a course"""
+        with self._lock:
+            keys = [
+                key
+                for key in self._galleries
+                if key[0] == course_id and key[1] in (None, session_id)
+            ]
+        self._drop(keys)
+
+    def invalidate_student(self, student):
+        """Drop every cached gallery that no longer reflects student's
+        current template or active state
+        """
+        with self._lock:
+            cached = list(self._galleries.items())
+        if not cached:
+            return
+
+        template = getattr(student, self.gallery_class.template_field)
+        template = bytes(template) if template and student.is_active else None
+        stale = []
+        unlisted = []
+        for key, gallery in cached:
+            if student.reg_number in gallery:
+                if template != gallery.template_bytes(student.reg_number):
+                    stale.append(key)
+            elif template is not None:
+                unlisted.append(key)
+
+        if unlisted:
+            registered = set(
+                CourseRegistration.objects.filter(
+                    student_id=student.reg_number
+                ).values_list("course_id", "session_id")
+            )
+            registered_courses = {course_id for course_id, _ in registered}
+            stale.extend(
+                key
+                for key in unlisted
+                if (key[1] is None and key[0] in registered_courses)
+                or key in registered
+            )
+        self._drop(stale)
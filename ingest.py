@@ -0,0 +1,264 @@
+"""
+Server side ingestion of the attendance data uploaded by node devices.
+
+Attendance sessions and records come from many node databases, so their
+primary keys can't be trusted on the server:
+    = an AttendanceSession that already exists on the server (same
+      course, session, start_time and duration, i.e. the
+      unique_attendance_session constraint) is reused and the node's id
+      is mapped to the server's id. Session ids are unique across nodes
+      (see sessionids.py); an id that is taken anyway (e.g. generated
+      before that scheme) is replaced by a new one
+    = AttendanceRecord ids are always dropped. A student has a single
+      record per session whose record_type moves from SIGN_IN to
+      SIGN_OUT, so records are matched on (attendance_session, student)
+      and an incoming sign out updates the existing sign in row instead
+      of tripping the unique_attendance_record constraint
+
+Every batch is checked against the database with a handful of set based
+queries and written with bulk_create/bulk_update.
+"""
+from collections import Counter
+
+from django.core import serializers
+from django.db import transaction
+
+from . import summaries
+from .instrumentation import instrumented
+from .datasynch import LOAD_BATCH_SIZE, bulk_insert
+from .sessionids import new_session_id
+from .models import (
+    AcademicSession,
+    AttendanceRecord,
+    AttendanceSession,
+    AttendanceSessionStatusChoices,
+    Course,
+    RecordTypesChoices,
+    Student,
+)
+
+SESSION_MODEL = "db.attendancesession"
+RECORD_MODEL = "db.attendancerecord"
+
+
+def _session_key(att_session):
+    return (
+        att_session.course_id,
+        att_session.session_id,
+        att_session.start_time,
+        att_session.duration,
+    )
+
+
+class NodeIngestor:
+    """Ingest the records of one node dump. Sessions must come before the
+    records that reference them, as they do in NODE_DUMP order.
+    """
+
+    def __init__(self, node_device=None, batch_size=LOAD_BATCH_SIZE):
+        self.node_device = node_device
+        self.batch_size = batch_size
+        # node session id -> server session id
+        self.session_ids = {}
+        # node session ids rejected by this ingest
+        self.rejected_session_ids = set()
+        self.report = {"sessions": Counter(), "records": Counter()}
+
+    def ingest(self, records):
+        with transaction.atomic():
+            batch = []
+            for record in records:
+                if record["model"] not in (SESSION_MODEL, RECORD_MODEL):
+                    raise ValueError(
+                        "Unexpected model in node dump: %s" % record["model"]
+                    )
+                if batch and (
+                    len(batch) == self.batch_size
+                    or record["model"] != batch[0]["model"]
+                ):
+                    self._flush(batch)
+                    batch = []
+                batch.append(record)
+            if batch:
+                self._flush(batch)
+        return {
+            name: {key: count for key, count in counts.items() if count}
+            for name, counts in self.report.items()
+        }
+
+    def _flush(self, batch):
+        objs = [
+            item.object for item in serializers.deserialize("python", batch)
+        ]
+        if batch[0]["model"] == SESSION_MODEL:
+            self._ingest_sessions(objs)
+        else:
+            self._ingest_records(objs)
+
+    def _ingest_sessions(self, objs):
+        counts = self.report["sessions"]
+        valid_courses = set(
+            Course.objects.filter(
+                pk__in={obj.course_id for obj in objs}
+            ).values_list("pk", flat=True)
+        )
+        valid_sessions = set(
+            AcademicSession.objects.filter(
+                pk__in={obj.session_id for obj in objs}
+            ).values_list("pk", flat=True)
+        )
+        accepted = []
+        for obj in objs:
+            if (
+                obj.course_id not in valid_courses
+                or obj.session_id not in valid_sessions
+                or (
+                    self.node_device is not None
+                    and obj.node_device_id != self.node_device.pk
+                )
+            ):
+                counts["rejected"] += 1
+                self.rejected_session_ids.add(obj.pk)
+            else:
+                accepted.append(obj)
+
+        existing = {}
+        existing_ids = set()
+        candidates = AttendanceSession.objects.filter(
+            course_id__in={obj.course_id for obj in accepted},
+            start_time__in={obj.start_time for obj in accepted},
+        ).only("id", "course", "session", "start_time", "duration", "status")
+        for att_session in candidates:
+            existing[_session_key(att_session)] = att_session
+        existing_ids.update(
+            AttendanceSession.objects.filter(
+                pk__in=[obj.pk for obj in accepted]
+            ).values_list("pk", flat=True)
+        )
+
+        new_objs = []
+        ended = []
+        for obj in accepted:
+            node_id = obj.pk
+            match = existing.get(_session_key(obj))
+            if match is not None:
+                self.session_ids[node_id] = match.pk
+                counts["matched"] += 1
+                if (
+                    obj.status == AttendanceSessionStatusChoices.ENDED
+                    and match.status != AttendanceSessionStatusChoices.ENDED
+                ):
+                    match.status = obj.status
+                    ended.append(match)
+                continue
+
+            if obj.pk in existing_ids:
+                # id taken by a different session from another node
+                obj.pk = new_session_id(obj.node_device_id)
+            existing[_session_key(obj)] = obj
+            existing_ids.add(obj.pk)
+            self.session_ids[node_id] = obj.pk
+            new_objs.append(obj)
+
+        bulk_insert(AttendanceSession, new_objs, self.batch_size)
+        AttendanceSession.objects.bulk_update(ended, ["status"])
+        counts.update(created=len(new_objs), updated=len(ended))
+
+    def _ingest_records(self, objs):
+        counts = self.report["records"]
+        unmapped = {
+            obj.attendance_session_id
+            for obj in objs
+            if obj.attendance_session_id not in self.session_ids
+            and obj.attendance_session_id not in self.rejected_session_ids
+        }
+        if unmapped:
+            # sessions uploaded with an earlier dump
+            for pk in AttendanceSession.objects.filter(
+                pk__in=unmapped
+            ).values_list("pk", flat=True):
+                self.session_ids[pk] = pk
+        valid_students = set(
+            Student.objects.filter(
+                pk__in={obj.student_id for obj in objs}
+            ).values_list("pk", flat=True)
+        )
+
+        # the last upload of a (session, student) pair wins
+        incoming = {}
+        for obj in objs:
+            session_id = self.session_ids.get(obj.attendance_session_id)
+            if session_id is None or obj.student_id not in valid_students:
+                counts["rejected"] += 1
+                continue
+            obj.pk = None
+            obj.attendance_session_id = session_id
+            key = (session_id, obj.student_id)
+            if key in incoming:
+                counts["duplicate"] += 1
+            incoming[key] = obj
+
+        existing = {}
+        for record in AttendanceRecord.objects.filter(
+            attendance_session_id__in={key[0] for key in incoming},
+            student_id__in={key[1] for key in incoming},
+        ).only(
+            "id",
+            "attendance_session",
+            "student",
+            "record_type",
+            "check_out_by",
+            "is_valid",
+        ):
+            key = (record.attendance_session_id, record.student_id)
+            # a signed out row supersedes a signed in row
+            if (
+                key not in existing
+                or record.record_type == RecordTypesChoices.SIGN_OUT
+            ):
+                existing[key] = record
+
+        new_objs = []
+        changed = []
+        for key, obj in incoming.items():
+            record = existing.get(key)
+            if record is None:
+                new_objs.append(obj)
+            elif (
+                record.record_type == RecordTypesChoices.SIGN_OUT
+                and obj.record_type == RecordTypesChoices.SIGN_IN
+            ):
+                counts["skipped"] += 1
+            elif (
+                record.record_type,
+                record.check_out_by,
+                record.is_valid,
+            ) == (obj.record_type, obj.check_out_by, obj.is_valid):
+                counts["skipped"] += 1
+            else:
+                record.record_type = obj.record_type
+                record.check_out_by = obj.check_out_by
+                record.is_valid = obj.is_valid
+                changed.append(record)
+
+        bulk_insert(AttendanceRecord, new_objs, self.batch_size)
+        AttendanceRecord.objects.bulk_update(
+            changed, ["record_type", "check_out_by", "is_valid"]
+        )
+        summaries.refresh(
+            (obj.attendance_session_id, obj.student_id)
+            for obj in new_objs + changed
+        )
+        counts.update(created=len(new_objs), updated=len(changed))
+
+
+@instrumented("ingest.ingest_node_dump")
+def ingest_node_dump(records, node_device=None, batch_size=LOAD_BATCH_SIZE):
+    """Merge the attendance sessions and records uploaded by a node device
+    into the server database. If node_device is given, sessions that
+    belong to any other device are rejected.
+
+    Returns counts of created, matched/updated, skipped and rejected rows:
+        {"sessions": {"created": 2, ...}, "records": {"created": 80, ...}}
+    """
+    return NodeIngestor(node_device, batch_size).ingest(records)
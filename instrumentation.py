@@ -0,0 +1,215 @@
+"""
+Instrumentation of the app's hot operations.
+
+When settings.TAMS_INSTRUMENTATION is true, every instrumented operation
+(check-ins, registration, reference table loads, sync dump/load and
+ingest) records how many queries it ran, the time spent in the database,
+the time spent in Python and the number of rows its queries touched.
+Samples are kept in a fixed size in-memory ring buffer (the last
+settings.TAMS_INSTRUMENTATION_BUFFER_SIZE operations) and totals per
+operation are accumulated alongside; both can be exported as JSON or in
+the Prometheus text format.
+
+Queries are timed by a database execute wrapper installed for the
+duration of the operation, so nested operations each count the queries
+run inside them. With instrumentation off an operation costs a settings
+lookup.
+"""
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+DEFAULT_BUFFER_SIZE = 1024
+
+SAMPLE_FIELDS = (
+    "operation",
+    "started",
+    "queries",
+    "db_seconds",
+    "python_seconds",
+    "rows",
+    "failed",
+)
+# name, help text and total (a sample field or count) of every exported
+# counter
+PROMETHEUS_COUNTERS = (
+    ("tams_operations_total", "Instrumented operations run", "count"),
+    ("tams_operation_failures_total", "Operations that raised", "failed"),
+    ("tams_operation_queries_total", "Queries run", "queries"),
+    ("tams_operation_db_seconds_total", "Time spent in queries", "db_seconds"),
+    (
+        "tams_operation_python_seconds_total",
+        "Time spent outside queries",
+        "python_seconds",
+    ),
+    ("tams_operation_rows_total", "Rows touched by queries", "rows"),
+)
+
+_lock = threading.Lock()
+_samples = deque(maxlen=DEFAULT_BUFFER_SIZE)
+# operation -> {total: value}
+_totals = {}
+
+
+def is_enabled():
+    return getattr(settings, "TAMS_INSTRUMENTATION", False)
+
+
+class _Recorder:
+    """Execute wrapper counting and timing the queries of one operation"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            rowcount = getattr(context.get("cursor"), "rowcount", -1)
+            if rowcount is not None and rowcount > 0:
+                self.rows += rowcount
+
+    def add_rows(self, count):
+        """Count rows the database driver doesn't report, e.g. those read
+        by a SELECT
+        """
+        self.rows += count
+
+
+class _NullRecorder:
+    def add_rows(self, count):
+        pass
+
+
+@contextmanager
+def instrument(operation):
+    """Record a sample of the block as operation. Yields a recorder whose
+    add_rows(count) adds rows read by the block.
+    """
+    if not is_enabled():
+        yield _NullRecorder()
+        return
+    recorder = _Recorder()
+    started_at = time.time()
+    started = time.perf_counter()
+    failed = True
+    try:
+        with connection.execute_wrapper(recorder):
+            yield recorder
+        failed = False
+    finally:
+        seconds = time.perf_counter() - started
+        _record(
+            dict(
+                operation=operation,
+                started=started_at,
+                queries=recorder.queries,
+                db_seconds=recorder.db_seconds,
+                python_seconds=max(seconds - recorder.db_seconds, 0.0),
+                rows=recorder.rows,
+                failed=failed,
+            )
+        )
+
+
+def instrumented(operation):
+    """Decorator recording every call of a function as operation"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with instrument(operation):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _record(sample):
+    size = getattr(
+        settings, "TAMS_INSTRUMENTATION_BUFFER_SIZE", DEFAULT_BUFFER_SIZE
+    )
+    global _samples
+    with _lock:
+        if _samples.maxlen != size:
+            _samples = deque(_samples, maxlen=size)
+        _samples.append(sample)
+        totals = _totals.setdefault(
+            sample["operation"],
+            {field: 0 for _, _, field in PROMETHEUS_COUNTERS},
+        )
+        totals["count"] += 1
+        for field in SAMPLE_FIELDS[2:]:
+            totals[field] += sample[field]
+
+
+def samples(operation=None):
+    """The buffered samples, oldest first, optionally of one operation"""
+    with _lock:
+        return [
+            dict(sample)
+            for sample in _samples
+            if operation is None or sample["operation"] == operation
+        ]
+
+
+def totals():
+    """{operation: {"count": ..., "queries": ..., ...}} since the process
+    started or reset() was called
+    """
+    with _lock:
+        return {
+            operation: dict(operation_totals)
+            for operation, operation_totals in _totals.items()
+        }
+
+
+def reset():
+    """Drop every sample and total"""
+    with _lock:
+        _samples.clear()
+        _totals.clear()
+
+
+def to_json():
+    return json.dumps({"samples": samples(), "totals": totals()})
+
+
+def _label(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def to_prometheus():
+    """The totals in the Prometheus text exposition format"""
+    current = totals()
+    lines = []
+    for name, help_text, field in PROMETHEUS_COUNTERS:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s counter" % name)
+        for operation in sorted(current):
+            lines.append(
+                '%s{operation="%s"} %s'
+                % (
+                    name,
+                    _label(operation),
+                    repr(float(current[operation][field])),
+                )
+            )
+    return "\n".join(lines) + "\n"
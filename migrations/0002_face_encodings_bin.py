@@ -0,0 +1,52 @@
+# Generated by Django 4.0.10 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+def face_enc_str_to_bytes(enc_str):
+    # a frozen copy of models.face_enc_str_to_bytes as of this migration
+    if not enc_str:
+        return None
+    import numpy as np
+
+    try:
+        encodings = np.array(enc_str.split(","), dtype="float32")
+    except ValueError:
+        return None
+    if encodings.shape != (128,):
+        return None
+    return encodings.tobytes()
+
+
+def populate_face_encodings_bin(apps, schema_editor):
+    for model_name in ("AppUser", "Student"):
+        model = apps.get_model("db", model_name)
+        rows = model.objects.exclude(face_encodings__isnull=True).exclude(
+            face_encodings=""
+        )
+        for obj in rows.only("pk", "face_encodings").iterator():
+            obj.face_encodings_bin = face_enc_str_to_bytes(obj.face_encodings)
+            obj.save(update_fields=["face_encodings_bin"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='face_encodings_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='face_encodings_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(
+            populate_face_encodings_bin, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.10 on 2026-10-18 02:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0003_sync_revisions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancesession',
+            name='start_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['node_device', 'status', 'start_time'], name='att_session_node_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['status', 'start_time'], name='att_session_status_start_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.0.10 on 2026-10-18 02:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_attendance_summaries(apps, schema_editor):
+    from django.db.models import Count, F, Q
+
+    AttendanceRecord = apps.get_model("db", "AttendanceRecord")
+    AttendanceSessionSummary = apps.get_model("db", "AttendanceSessionSummary")
+    CourseAttendanceSummary = apps.get_model("db", "CourseAttendanceSummary")
+    records = AttendanceRecord.objects.filter(is_valid=True).order_by()
+
+    AttendanceSessionSummary.objects.bulk_create(
+        AttendanceSessionSummary(
+            attendance_session_id=session_id,
+            signed_in=signed_in,
+            signed_out=signed_out,
+        )
+        for session_id, signed_in, signed_out in records.values(
+            "attendance_session_id"
+        )
+        .annotate(
+            signed_in=Count("student", distinct=True),
+            signed_out=Count(
+                "student", distinct=True, filter=Q(record_type=2)
+            ),
+        )
+        .values_list("attendance_session_id", "signed_in", "signed_out")
+    )
+    CourseAttendanceSummary.objects.bulk_create(
+        CourseAttendanceSummary(
+            course_id=course_id,
+            session_id=acad_session_id,
+            student_id=reg_number,
+            attended=attended,
+        )
+        for course_id, acad_session_id, reg_number, attended in records.values(
+            course_id=F("attendance_session__course_id"),
+            acad_session_id=F("attendance_session__session_id"),
+            reg_number=F("student_id"),
+        )
+        .annotate(attended=Count("attendance_session", distinct=True))
+        .values_list("course_id", "acad_session_id", "reg_number", "attended")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0004_attendance_session_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSessionSummary',
+            fields=[
+                ('attendance_session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='db.attendancesession')),
+                ('signed_in', models.PositiveIntegerField(default=0)),
+                ('signed_out', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseAttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('attended', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='db.course')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='db.academicsession')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='db.student')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='courseattendancesummary',
+            constraint=models.UniqueConstraint(fields=('course', 'session', 'student'), name='unique_course_attendance_summary'),
+        ),
+        migrations.RunPython(
+            populate_attendance_summaries, migrations.RunPython.noop
+        ),
+    ]
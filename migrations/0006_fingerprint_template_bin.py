@@ -0,0 +1,60 @@
+# Generated by Django 4.0.10 on 2026-10-18 02:55
+
+from django.db import migrations, models
+
+
+def fingerprint_template_to_bytes(template):
+    # a frozen copy of models.fingerprint_template_to_bytes for the
+    # default (hex) encoding, which every existing template gets
+    if not template:
+        return None
+    try:
+        return bytes.fromhex(template.strip()) or None
+    except ValueError:
+        return None
+
+
+def populate_fingerprint_template_bin(apps, schema_editor):
+    for model_name in ("AppUser", "Student"):
+        model = apps.get_model("db", model_name)
+        rows = model.objects.exclude(
+            fingerprint_template__isnull=True
+        ).exclude(fingerprint_template="")
+        for obj in rows.only("pk", "fingerprint_template").iterator():
+            obj.fingerprint_template_bin = fingerprint_template_to_bytes(
+                obj.fingerprint_template
+            )
+            obj.save(update_fields=["fingerprint_template_bin"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0005_attendance_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='fingerprint_template_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='fingerprint_template_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='appuser',
+            name='fingerprint_template_encoding',
+            field=models.IntegerField(choices=[(1, 'Hex'), (2, 'Base64'), (3, 'Decimal')], default=1),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='fingerprint_template_encoding',
+            field=models.IntegerField(choices=[(1, 'Hex'), (2, 'Base64'), (3, 'Decimal')], default=1),
+        ),
+        migrations.RunPython(
+            populate_fingerprint_template_bin, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.10 on 2026-10-18 03:10
+
+import db.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0006_fingerprint_template_bin'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='appadmin',
+            managers=[
+                ('objects', db.models.SyncTrackedUserManager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name='appuser',
+            managers=[
+                ('objects', db.models.SyncTrackedUserManager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name='staff',
+            managers=[
+                ('objects', db.models.SyncTrackedUserManager()),
+            ],
+        ),
+    ]
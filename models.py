@@ -1,32 +1,39 @@
-import hashlib
-import json
-import os
-from pathlib import Path
-import re
+import base64
+import binascii
+from contextlib import contextmanager
 import secrets
+import threading
 
-import numpy as np
-from django.db.models import Value, Q, F
+from django.db.models import ExpressionWrapper, Value, Q, F
 from django.db.models.functions import Upper, Replace
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
-# configuring the staff_number and studnet reg number format
-config_file_path = os.path.join(
-    Path(os.path.abspath(__file__)).parent.parent, "config.json"
-)
+from . import refcache, validators
+from .instrumentation import instrument
+from .sessionids import new_session_id
 
-if not os.path.exists(config_file_path):
-    raise FileNotFoundError("File: config.json not found")
+# face encodings are 128-d vectors; they are stored as float32 bytes
+# alongside the text representation for fast matching. numpy is only
+# imported by the helpers that convert them, to keep it off the startup
+# path of processes that never touch an encoding.
+FACE_ENCODING_LENGTH = 128
+FACE_ENCODING_DTYPE = "float32"
 
-with open(config_file_path, "r") as data:
-    config_dict = json.loads(data.read())
+# columns of the rows returned by Course.catalogue and rows per page of
+# Course.catalogue_page
+CATALOGUE_FIELDS = ("id", "code", "title")
+CATALOGUE_PAGE_SIZE = 500
 
-STAFF_NO_FORMAT = r"{}".format(config_dict["STAFF_NO_FORMAT"])
-STUDENT_REG_NO_FORMAT = r"{}".format(config_dict["STUDENT_REG_NO_FORMAT"])
-SESSION_FORMAT = r"{}".format(config_dict["SESSION_FORMAT"])
+
+def __getattr__(name):
+    # the formats used to be defined here; they are read from config.json
+    # on first use, see validators.py
+    if name in validators.CONFIG_NAMES:
+        return getattr(validators, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def face_enc_to_str(encodings):
@@ -37,14 +44,121 @@ def face_enc_to_str(encodings):
 
 def str_to_face_enc(enc_str):
     """Convert encodings formatted as a string to numpy array"""
+    import numpy as np
+
     encodings = np.array([float(item) for item in enc_str.split(",")])
     return encodings
 
 
+def face_enc_to_bytes(encodings):
+    """Convert face encodings to compact float32 bytes"""
+    import numpy as np
+
+    return np.asarray(encodings, dtype=FACE_ENCODING_DTYPE).tobytes()
+
+
+def bytes_to_face_enc(enc_bytes):
+    """Convert float32 bytes back to a numpy array"""
+    import numpy as np
+
+    return np.frombuffer(enc_bytes, dtype=FACE_ENCODING_DTYPE)
+
+
+def face_enc_str_to_bytes(enc_str):
+    """Convert encodings formatted as a string to float32 bytes.
+    Returns None if the string is empty or is not a valid encoding.
+    """
+    if not enc_str:
+        return None
+    import numpy as np
+
+    try:
+        encodings = np.array(enc_str.split(","), dtype=FACE_ENCODING_DTYPE)
+    except ValueError:
+        return None
+    if encodings.shape != (FACE_ENCODING_LENGTH,):
+        return None
+    return encodings.tobytes()
+
+
+def fingerprint_template_to_bytes(template, encoding=None):
+    """Decode a fingerprint template stored in encoding (a
+    FingerprintEncodingChoices value, hex by default). Returns None if the
+    template is empty or can't be decoded.
+    """
+    if not template:
+        return None
+    encoding = encoding or FingerprintEncodingChoices.HEX
+    template = template.strip()
+    try:
+        if encoding == FingerprintEncodingChoices.DECIMAL:
+            return bytes(int(item) for item in template.split(",")) or None
+        if encoding == FingerprintEncodingChoices.BASE64:
+            return base64.b64decode(template, validate=True) or None
+        return bytes.fromhex(template) or None
+    except (binascii.Error, ValueError):
+        return None
+
+
+# binary field -> (converter, the fields it is converted from) of the
+# users' biometric data
+BINARY_FIELDS = {
+    "face_encodings_bin": (face_enc_str_to_bytes, ("face_encodings",)),
+    "fingerprint_template_bin": (
+        fingerprint_template_to_bytes,
+        ("fingerprint_template", "fingerprint_template_encoding"),
+    ),
+}
+
+
+def set_binary_fields(obj, save_kwargs):
+    """Convert obj's biometric text fields to their binary fields before a
+    save. A binary field is added to the save's update_fields along with
+    the fields it is converted from, so that it isn't left stale.
+    """
+    for bin_field, (convert, sources) in BINARY_FIELDS.items():
+        setattr(
+            obj, bin_field, convert(*(getattr(obj, name) for name in sources))
+        )
+    update_fields = save_kwargs.get("update_fields")
+    if update_fields is not None:
+        update_fields = set(update_fields)
+        save_kwargs["update_fields"] = update_fields | {
+            bin_field
+            for bin_field, (_, sources) in BINARY_FIELDS.items()
+            if update_fields.intersection(sources)
+        }
+
+
+def set_binary_update_kwargs(kwargs):
+    """Convert the biometric text fields set by a queryset update() to
+    their binary fields. Raises ValueError when a binary field can't be
+    converted from the update's values (a field it is converted from is
+    missing or is an expression) and isn't set by the update itself.
+    """
+    for bin_field, (convert, sources) in BINARY_FIELDS.items():
+        updated = [name for name in sources if name in kwargs]
+        if not updated or bin_field in kwargs:
+            continue
+        missing = [name for name in sources if name not in kwargs]
+        if missing or any(
+            hasattr(kwargs[name], "resolve_expression") for name in sources
+        ):
+            raise ValueError(
+                "update() can't convert %s to %s; set %s too"
+                % (
+                    ", ".join(updated),
+                    bin_field,
+                    " or ".join(missing + [bin_field]),
+                )
+            )
+        kwargs[bin_field] = convert(*(kwargs[name] for name in sources))
+
+
 class AppIntegerChoices(models.IntegerChoices):
     @classmethod
     def str_to_value(cls, string):
-        return eval(f"{cls.__name__}.{string.upper()}.value")
+        return cls[string.upper()].value
 
 
 class AdmissionStatusChoices(AppIntegerChoices):
@@ -83,7 +197,180 @@ class RecordTypesChoices(AppIntegerChoices):
     SIGN_OUT = 2, "Sign Out"
 
 
-class StaffTitle(models.Model):
+class FingerprintEncodingChoices(AppIntegerChoices):
+    HEX = 1, "Hex"
+    BASE64 = 2, "Base64"
+    DECIMAL = 3, "Decimal"
+
+
+class SyncState(models.Model):
+    """Key/value store for data synching bookkeeping, e.g. the current
+    revision on the server or the last revision received by a node.
+    """
+
+    REVISION = "revision"
+    SYNCED_REVISION = "synced_revision"
+
+    key = models.CharField(primary_key=True, max_length=50)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def get_value(cls, key, default=0):
+        value = (
+            cls.objects.filter(key=key).values_list("value", flat=True).first()
+        )
+        return default if value is None else value
+
+    @classmethod
+    def set_value(cls, key, value):
+        cls.objects.update_or_create(key=key, defaults={"value": value})
+
+    @classmethod
+    def next_revision(cls, count=1):
+        """Reserve count revisions and return the highest one. Call it in
+        the transaction writing the rows it stamps: the counter row stays
+        locked until that transaction ends, so revisions are committed in
+        order and export_delta never reads a revision whose rows are still
+        in flight.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(key=cls.REVISION).update(
+                value=F("value") + count
+            )
+            if not updated:
+                cls.objects.get_or_create(key=cls.REVISION)
+                cls.objects.filter(key=cls.REVISION).update(
+                    value=F("value") + count
+                )
+            return cls.objects.get(key=cls.REVISION).value
+
+
+# tombstones of the rows deleted so far by the delete() running in this
+# thread, cascades included
+_tombstones = threading.local()
+
+
+@contextmanager
+def _batched_tombstones(using=None):
+    """Collect the tombstones of a delete and write them together, in its
+    transaction, once every row is deleted
+    """
+    if getattr(_tombstones, "pending", None) is not None:
+        yield
+        return
+    _tombstones.pending = pending = []
+    try:
+        with transaction.atomic(using=using, savepoint=False):
+            yield
+            SyncTombstone.write(pending, using)
+    finally:
+        _tombstones.pending = None
+
+
+class SyncTrackedQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Stamp the updated rows with a new revision and convert their
+        biometric text fields to binary, as save() does
+        """
+        set_binary_update_kwargs(kwargs)
+        with transaction.atomic(using=self.db):
+            if "revision" not in kwargs:
+                kwargs["revision"] = SyncState.next_revision()
+            return super().update(**kwargs)
+
+    def delete(self):
+        """Delete the rows, tombstoning them and their cascades in bulk"""
+        with _batched_tombstones(self.db):
+            return super().delete()
+
+
+class SyncTrackedUserManager(UserManager.from_queryset(SyncTrackedQuerySet)):
+    pass
+
+
+class ReferenceQuerySet(SyncTrackedQuerySet):
+    """Queryset of the reference tables served by refcache: update() and
+    delete() report their writes to it, as the signal handlers do for
+    saves and deletes
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        refcache.written(self.db)
+        return rows
+
+    def delete(self):
+        deleted = super().delete()
+        refcache.written(self.db)
+        return deleted
+
+
+class SyncTrackedModel(models.Model):
+    """Models synched from server to node devices. Every save stamps the
+    row with a new revision so nodes only receive rows changed since the
+    last revision they acknowledged. Queryset update() stamps the rows it
+    updates too; bulk_create doesn't, so bulk writers reserve a revision
+    with SyncState.next_revision() in their transaction and set it on the
+    objects themselves.
+    """
+
+    revision = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    objects = SyncTrackedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # the revision is reserved by the pre_save signal, in the
+        # transaction writing the row, and written with it
+        update_fields = kwargs.get("update_fields")
+        if update_fields:
+            kwargs["update_fields"] = {*update_fields, "revision"}
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            return super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        """Delete the row, tombstoning it and its cascades in bulk"""
+        with _batched_tombstones(using):
+            return super().delete(using=using, keep_parents=keep_parents)
+
+
+class SyncTombstone(models.Model):
+    """Record of a deleted SyncTrackedModel row"""
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=100)
+    object_pk = models.TextField()
+    revision = models.BigIntegerField(db_index=True)
+
+    @classmethod
+    def record(cls, model, object_pk, using=None):
+        """Tombstone a deleted row of model. Within a SyncTrackedModel
+        delete() the tombstone is written with the others of that delete.
+        """
+        row = (model._meta.label_lower, str(object_pk))
+        pending = getattr(_tombstones, "pending", None)
+        if pending is None:
+            cls.write([row], using)
+        else:
+            pending.append(row)
+
+    @classmethod
+    def write(cls, rows, using=None):
+        """Insert the (model label, pk) tombstones with one revision"""
+        if not rows:
+            return
+        revision = SyncState.next_revision()
+        cls.objects.using(using).bulk_create(
+            [
+                cls(model=model, object_pk=object_pk, revision=revision)
+                for model, object_pk in rows
+            ]
+        )
+
+
+class StaffTitle(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     title_full = models.CharField(max_length=50)
     title = models.CharField(max_length=25)
@@ -102,10 +389,12 @@ class StaffTitle(models.Model):
         return f"{self.title}"
 
 
-class Faculty(models.Model):
+class Faculty(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=500)
 
+    objects = ReferenceQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(Upper("name"), name="unique_faculty_name")
@@ -113,19 +402,17 @@ class Faculty(models.Model):
 
     @staticmethod
     def get_all_faculties():
-        return list(
-            Faculty.objects.all()
-            .order_by("name")
-            .values_list("name", flat=True)
-        )
+        return [faculty.name for faculty in refcache.faculties()]
 
 
-class Department(models.Model):
+class Department(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=500)
     alias = models.CharField(max_length=20, null=True, blank=True)
     faculty = models.ForeignKey(to=Faculty, on_delete=models.CASCADE)
 
+    objects = ReferenceQuerySet.as_manager()
+
     # program_duration = models.IntegerField() :what program are you considering; there are many program types: new model may be necessary
 
     class Meta:
@@ -140,23 +427,47 @@ class Department(models.Model):
 
     @staticmethod
     def get_departments(faculty=None):
-        departments = Department.objects.all()
-        if faculty and Faculty.objects.filter(name__iexact=faculty).exists():
-            departments = departments.filter(faculty__name__iexact=faculty)
-        return list(departments.order_by("name").values_list("name", flat=True))
+        departments = refcache.departments()
+        faculty_id = refcache.faculty_id(faculty) if faculty else None
+        if faculty_id is not None:
+            departments = [
+                dept for dept in departments if dept.faculty_id == faculty_id
+            ]
+        return [dept.name for dept in departments]
 
     @staticmethod
     def get_id(department_name):
-        return Department.objects.get(name__iexact=department_name).id
+        department_id = refcache.department_id(department_name)
+        if department_id is None:
+            raise Department.DoesNotExist(
+                "Department matching query does not exist."
+            )
+        return department_id
 
 
-class AppUser(AbstractUser):
+class AppUser(AbstractUser, SyncTrackedModel):
     other_names = models.CharField(max_length=255, null=True, blank=True)
     fingerprint_template = models.TextField(null=True, blank=True)
+    fingerprint_template_encoding = models.IntegerField(
+        choices=FingerprintEncodingChoices.choices,
+        default=FingerprintEncodingChoices.HEX,
+    )
+    fingerprint_template_bin = models.BinaryField(
+        null=True, blank=True, editable=False
+    )
     face_encodings = models.TextField(null=True, blank=True)
+    face_encodings_bin = models.BinaryField(
+        null=True, blank=True, editable=False
+    )
     sex = models.IntegerField(choices=SexChoices.choices)
     is_active = models.BooleanField(default=True)
 
+    objects = SyncTrackedUserManager()
+
+    def save(self, *args, **kwargs):
+        set_binary_fields(self, kwargs)
+        return super().save(*args, **kwargs)
+
 
 class Staff(AppUser):
     staff_number = models.CharField(
@@ -179,14 +490,14 @@ class Staff(AppUser):
 
     @staticmethod
     def is_valid_staff_number(staff_no):
-        return bool(re.search(STAFF_NO_FORMAT, staff_no.upper()))
+        return validators.staff_number.is_valid(staff_no)
 
 
 class AppAdmin(AppUser):
     clearance_number = models.IntegerField(default=1)
 
 
-class Student(models.Model):
+class Student(SyncTrackedModel):
     reg_number = models.TextField(primary_key=True, unique=True)
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
@@ -199,7 +510,17 @@ class Student(models.Model):
     )
     level_of_study = models.IntegerField(null=True, blank=True)
     fingerprint_template = models.TextField(null=True, blank=True)
+    fingerprint_template_encoding = models.IntegerField(
+        choices=FingerprintEncodingChoices.choices,
+        default=FingerprintEncodingChoices.HEX,
+    )
+    fingerprint_template_bin = models.BinaryField(
+        null=True, blank=True, editable=False
+    )
     face_encodings = models.TextField(null=True, blank=True)
+    face_encodings_bin = models.BinaryField(
+        null=True, blank=True, editable=False
+    )
     sex = models.IntegerField(choices=SexChoices.choices)
     is_active = models.BooleanField(default=True)
 
@@ -215,14 +536,15 @@ class Student(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
+        set_binary_fields(self, kwargs)
         return super().save(*args, **kwargs)
 
     @staticmethod
     def is_valid_student_reg_number(reg_no):
-        return bool(re.search(STUDENT_REG_NO_FORMAT, reg_no))
+        return validators.student_reg_number.is_valid(reg_no)
 
 
-class Course(models.Model):
+class Course(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     code = models.CharField(max_length=8)
     title = models.CharField(max_length=255)
@@ -233,6 +555,8 @@ class Course(models.Model):
     elective = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
+    objects = ReferenceQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -245,52 +569,127 @@ class Course(models.Model):
             ),
         ]
 
+    @staticmethod
+    def _resolve_catalogue_filters(
+        semester, faculty, department, level_of_study
+    ):
+        """(semester value, department ids, level) of the catalogue
+        filters, None where a filter isn't applied. Names are resolved
+        from refcache; an unknown faculty or department is ignored.
+        """
+        if semester and semester in SemesterChoices.labels:
+            semester = SemesterChoices.values[
+                SemesterChoices.labels.index(semester)
+            ]
+        else:
+            semester = None
+
+        department_id = (
+            refcache.department_id(department) if department else None
+        )
+        faculty_id = refcache.faculty_id(faculty) if faculty else None
+        if department_id is not None:
+            department_ids = {department_id}
+        elif faculty_id is not None:
+            department_ids = {
+                dept.id
+                for dept in refcache.departments()
+                if dept.faculty_id == faculty_id
+            }
+        else:
+            department_ids = None
+
+        level_of_study = int(level_of_study) if level_of_study else None
+        return semester, department_ids, level_of_study
+
     @classmethod
-    def get_courses(
+    def catalogue(
         cls,
         *,
         semester=None,
         faculty=None,
         department=None,
         level_of_study=None,
+        fields=CATALOGUE_FIELDS,
     ):
-        course_list = cls.objects.all().exclude(is_active=False)
-        if semester and semester in SemesterChoices.labels:
-            course_list = course_list.filter(
-                semester=SemesterChoices.values[
-                    SemesterChoices.labels.index(semester)
-                ]
-            )
+        """Active courses matching the get_courses filters as a values_list
+        queryset of fields, in get_courses order. The filters are resolved
+        to ids first, so the queryset runs a single query on the course
+        table; slice it to paginate or call iterator() to stream it.
+        """
+        (
+            semester,
+            department_ids,
+            level_of_study,
+        ) = cls._resolve_catalogue_filters(
+            semester, faculty, department, level_of_study
+        )
+        queryset = cls.objects.filter(is_active=True)
+        if semester is not None:
+            queryset = queryset.filter(semester=semester)
+        if department_ids is not None:
+            queryset = queryset.filter(department_id__in=department_ids)
+        if level_of_study is not None:
+            queryset = queryset.filter(level_of_study=level_of_study)
+        return queryset.order_by("id").values_list(*fields)
 
-        if (
-            department
-            and Department.objects.filter(name__iexact=department).exists()
-        ):
-            course_list = course_list.filter(
-                department__name__iexact=department
-            )
-        elif faculty and Faculty.objects.filter(name__iexact=faculty).exists():
-            course_list = course_list.filter(
-                department__faculty__name__iexact=faculty
-            )
+    @classmethod
+    def catalogue_page(
+        cls, page=1, page_size=CATALOGUE_PAGE_SIZE, render=False, **filters
+    ):
+        """One page (numbered from 1) of the catalogue as a list of
+        (id, code, title) rows, or of course labels with render
+        """
+        if page < 1:
+            raise ValueError("Pages are numbered from 1")
+        start = (page - 1) * page_size
+        rows = cls.catalogue(**filters)[start : start + page_size]
+        if render:
+            return [cls.course_label(code, title) for _, code, title in rows]
+        return list(rows)
 
-        if level_of_study:
-            course_list = level_of_study.filter(level_of_study=level_of_study)
+    @staticmethod
+    def course_label(code, title):
+        """The "code : title" label str_to_course parses back"""
+        return f"{code} : {title}"
 
-        return [f"{item.code} : {item.title}" for item in course_list]
+    @classmethod
+    def get_courses(
+        cls,
+        *,
+        semester=None,
+        faculty=None,
+        department=None,
+        level_of_study=None,
+    ):
+        """Labels of the active courses matching the filters, served from
+        refcache. See catalogue for a queryset of rows.
+        """
+        (
+            semester,
+            department_ids,
+            level_of_study,
+        ) = cls._resolve_catalogue_filters(
+            semester, faculty, department, level_of_study
+        )
+        return [
+            cls.course_label(item.code, item.title)
+            for item in refcache.courses()
+            if (semester is None or item.semester == semester)
+            and (
+                department_ids is None or item.department_id in department_ids
+            )
+            and (
+                level_of_study is None or item.level_of_study == level_of_study
+            )
+        ]
 
     @classmethod
     def str_to_course(cls, course_str):
         split_course_str = course_str.split(" : ")
-        try:
-            course_obj = cls.objects.exclude(is_active=False).get(
-                code__iexact=split_course_str[0],
-                title__iexact=" : ".join(split_course_str[1:]),
-            )
-        except Exception:
-            return None
-        else:
-            return course_obj.id
+        return refcache.course_id(
+            split_course_str[0], " : ".join(split_course_str[1:])
+        )
 
 
 class NodeDevice(models.Model):
@@ -301,6 +700,8 @@ class NodeDevice(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, blank=True)
     token = models.TextField(blank=True)
+    # last server revision the node acknowledged receiving
+    synced_revision = models.BigIntegerField(default=0)
 
     def save(self, *args, **kwargs):
         if self.id is None:
@@ -322,11 +723,13 @@ class NodeDevice(models.Model):
         return f"TAMS {next_valid_id}"
 
 
-class AcademicSession(models.Model):
+class AcademicSession(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     session = models.CharField(max_length=10, unique=True)
     is_current_session = models.BooleanField(default=False)
 
+    objects = ReferenceQuerySet.as_manager()
+
     def clean(self):
         if not AcademicSession.is_valid_session(self.session):
             raise ValidationError({"session": "Invalid session value"})
@@ -344,19 +747,14 @@ class AcademicSession(models.Model):
 
     @staticmethod
     def get_all_academic_sessions():
-        return list(
-            AcademicSession.objects.all()
-            .order_by("-is_current_session")
-            .values_list("session", flat=True)
-        )
+        return [
+            acad_session.session
+            for acad_session in refcache.academic_sessions()
+        ]
 
     @staticmethod
     def is_valid_session(session):
-        if re.search(SESSION_FORMAT, session):
-            session_yrs = session.split("/")
-            if (int(session_yrs[1]) - int(session_yrs[0])) == 1:
-                return True
-        return False
+        return validators.academic_session.is_valid(session)
 
 
 class AttendanceSession(models.Model):
@@ -368,7 +766,7 @@ class AttendanceSession(models.Model):
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
     session = models.ForeignKey(to=AcademicSession, on_delete=models.CASCADE)
     event_type = models.IntegerField(choices=EventTypeChoices.choices)
-    start_time = models.DateTimeField(default=timezone.now())
+    start_time = models.DateTimeField(default=timezone.now)
     duration = models.DurationField()
     created_on = models.DateTimeField(auto_now_add=True)
     status = models.IntegerField(
@@ -379,12 +777,7 @@ class AttendanceSession(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:
-            self.id = (
-                str(self.node_device_id)
-                + str(self.created_on)
-                + str(self.duration)
-            )
-            self.id = hashlib.md5(self.id.encode()).hexdigest()
+            self.id = new_session_id(self.node_device_id)
 
         super().save(*args, **kwargs)
 
@@ -399,6 +792,56 @@ class AttendanceSession(models.Model):
                 name="check_valid_stop_time",
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["node_device", "status", "start_time"],
+                name="att_session_node_status_idx",
+            ),
+            models.Index(
+                fields=["status", "start_time"],
+                name="att_session_status_start_idx",
+            ),
+        ]
+
+    @staticmethod
+    def end_time_expression():
+        return ExpressionWrapper(
+            F("start_time") + F("duration"),
+            output_field=models.DateTimeField(),
+        )
+
+    @classmethod
+    def running_sessions(cls, node_device, at=None):
+        """ACTIVE sessions of node_device that are running at `at` (now by
+        default), the most recently started first
+        """
+        at = at or timezone.now()
+        return (
+            cls.objects.filter(
+                node_device=node_device,
+                status=AttendanceSessionStatusChoices.ACTIVE,
+                start_time__lte=at,
+            )
+            .alias(end_time=cls.end_time_expression())
+            .filter(end_time__gt=at)
+            .order_by("-start_time")
+        )
+
+    @classmethod
+    def end_expired_sessions(cls, at=None):
+        """Mark every ACTIVE session that is over at `at` (now by default)
+        as ENDED with a single UPDATE. Returns the number of sessions.
+        """
+        at = at or timezone.now()
+        return (
+            cls.objects.filter(
+                status=AttendanceSessionStatusChoices.ACTIVE,
+                start_time__lte=at,
+            )
+            .alias(end_time=cls.end_time_expression())
+            .filter(end_time__lte=at)
+            .update(status=AttendanceSessionStatusChoices.ENDED)
+        )
 
 
 class AttendanceRecord(models.Model):
@@ -424,18 +867,33 @@ class AttendanceRecord(models.Model):
             ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so that clean() can detect a sign out without a query
+        instance._saved_record_type = instance.__dict__.get("record_type")
+        return instance
+
     def clean(self):
         if self.record_type != RecordTypesChoices.SIGN_IN:
-            saved_record = AttendanceRecord.objects.get(pk=self.pk)
-            if self.record_type != saved_record.record_type:
+            saved_record_type = getattr(self, "_saved_record_type", None)
+            if saved_record_type is None and self.pk is not None:
+                saved_record_type = (
+                    AttendanceRecord.objects.filter(pk=self.pk)
+                    .values_list("record_type", flat=True)
+                    .first()
+                )
+            if self.record_type != saved_record_type:
                 self.check_out_by = timezone.now()
 
     def save(self, *args, **kwargs):
         self.clean()
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        self._saved_record_type = self.record_type
+        return result
 
 
-class CourseRegistration(models.Model):
+class CourseRegistration(SyncTrackedModel):
     id = models.BigAutoField(primary_key=True)
     session = models.ForeignKey(to=AcademicSession, on_delete=models.CASCADE)
     semester = models.IntegerField(choices=SemesterChoices.choices)
@@ -457,5 +915,43 @@ class CourseRegistration(models.Model):
             )
 
     def save(self, *args, **kwargs):
-        self.clean()
-        return super(CourseRegistration, self).save(*args, **kwargs)
+        with instrument("course_registration.save"):
+            self.clean()
+            return super(CourseRegistration, self).save(*args, **kwargs)
+
+
+class AttendanceSessionSummary(models.Model):
+    """Valid record counts of an attendance session, maintained by
+    summaries.py
+    """
+
+    attendance_session = models.OneToOneField(
+        to=AttendanceSession,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary",
+    )
+    signed_in = models.PositiveIntegerField(default=0)
+    signed_out = models.PositiveIntegerField(default=0)
+
+
+class CourseAttendanceSummary(models.Model):
+    """Number of a course's attendance sessions a student attended in an
+    academic session, maintained by summaries.py
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
+    session = models.ForeignKey(to=AcademicSession, on_delete=models.CASCADE)
+    student = models.ForeignKey(
+        to=Student, on_delete=models.CASCADE, to_field="reg_number"
+    )
+    attended = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["course", "session", "student"],
+                name="unique_course_attendance_summary",
+            )
+        ]
@@ -0,0 +1,509 @@
+"""
+Bulk onboarding of students and staff from CSV or Excel files.
+
+Student.save and Staff.save validate and insert one row at a time. The
+onboarding pipeline reads a file in chunks and validates whole columns
+at once: identifier formats with the batch validators of validators.py,
+departments, sexes and admission statuses with in-memory maps, and
+uniqueness with one IN query per chunk, and the lengths and emails that
+full_clean would check. Valid rows are inserted in bulk and every
+rejected row is reported with the reason. Bulk inserts send no signals,
+so imported students are added to the institution face index (when it
+is enabled) once the import commits.
+
+Expected columns (case-insensitive):
+    students: reg_number, first_name, last_name, department, sex,
+              possible_grad_yr, [other_names, level_of_study,
+              admission_status, face_encodings, fingerprint_template,
+              fingerprint_template_encoding]
+    staff:    staff_number, first_name, last_name, department, sex,
+              [username, email, other_names, is_exam_officer, titles]
+
+department may be a department's name or alias, titles a comma
+separated list of StaffTitle abbreviations and
+fingerprint_template_encoding hex (the default), base64 or decimal.
+"""
+import abc
+import os
+
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from . import face_index, validators
+from .models import (
+    AdmissionStatusChoices,
+    AppUser,
+    Department,
+    FingerprintEncodingChoices,
+    SexChoices,
+    Staff,
+    StaffTitle,
+    Student,
+    SyncState,
+    face_enc_str_to_bytes,
+    fingerprint_template_to_bytes,
+)
+
+ONBOARDING_CHUNK_SIZE = 5000
+
+STUDENT_COLUMNS = (
+    "reg_number",
+    "first_name",
+    "last_name",
+    "department",
+    "sex",
+    "possible_grad_yr",
+)
+STUDENT_OPTIONAL_COLUMNS = (
+    "other_names",
+    "level_of_study",
+    "admission_status",
+    "face_encodings",
+    "fingerprint_template",
+    "fingerprint_template_encoding",
+)
+STAFF_COLUMNS = (
+    "staff_number",
+    "first_name",
+    "last_name",
+    "department",
+    "sex",
+)
+STAFF_OPTIONAL_COLUMNS = (
+    "username",
+    "email",
+    "other_names",
+    "is_exam_officer",
+    "titles",
+)
+
+
+def read_table(source, chunk_size=ONBOARDING_CHUNK_SIZE):
+    """Yield DataFrames of up to chunk_size rows from a CSV or Excel file
+    (or from a DataFrame)
+    """
+    if isinstance(source, pd.DataFrame):
+        frame = source
+    elif os.path.splitext(str(source))[1].lower() in (".xls", ".xlsx"):
+        frame = pd.read_excel(source, dtype=str)
+    else:
+        yield from pd.read_csv(
+            source, dtype=str, skipinitialspace=True, chunksize=chunk_size
+        )
+        return
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start : start + chunk_size]
+
+
+def _prepare(frame, required_columns, optional_columns):
+    """Normalize column names and strip values; blank cells become NaN"""
+    frame = frame.rename(columns=lambda name: str(name).strip().lower())
+    missing = [name for name in required_columns if name not in frame]
+    if missing:
+        raise ValueError("Missing columns: %s" % ", ".join(missing))
+    frame = frame.astype(object)
+    for name in optional_columns:
+        if name not in frame:
+            frame[name] = None
+    for name in frame.columns:
+        frame[name] = frame[name].map(
+            lambda value: value.strip() if isinstance(value, str) else value
+        )
+    return frame.mask(frame == "")
+
+
+def _records(frame):
+    """Rows of frame as dicts, with None for missing values"""
+    for row in frame.to_dict("records"):
+        yield {
+            name: None if pd.isna(value) else value
+            for name, value in row.items()
+        }
+
+
+def _choice_map(choices):
+    return {
+        key.upper(): value
+        for value, label in choices.choices
+        for key in (label, choices(value).name, str(value))
+    }
+
+
+def _department_map():
+    departments = {}
+    for dept_id, name, alias in Department.objects.values_list(
+        "id", "name", "alias"
+    ):
+        departments[name.upper()] = dept_id
+        if alias:
+            departments[alias.upper()] = dept_id
+    return departments
+
+
+def _lookup(column, mapping):
+    return column.map(
+        lambda value: mapping.get(str(value).upper())
+        if pd.notna(value)
+        else None
+    )
+
+
+def _to_int(column):
+    return pd.to_numeric(column, errors="coerce")
+
+
+def _is_invalid_email(value):
+    if pd.isna(value):
+        return False
+    try:
+        validate_email(value)
+    except ValidationError:
+        return True
+    return False
+
+
+class _Onboarding(abc.ABC):
+    required_columns = ()
+    optional_columns = ()
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.departments = _department_map()
+        self.sexes = _choice_map(SexChoices)
+        self.created = 0
+        self.errors = []
+
+    def run(self, source):
+        offset = 0
+        with transaction.atomic():
+            revision = SyncState.next_revision()
+            for frame in read_table(source, self.chunk_size):
+                frame = _prepare(
+                    frame, self.required_columns, self.optional_columns
+                )
+                frame.index = range(offset, offset + len(frame))
+                offset += len(frame)
+                self.process(frame, revision)
+        self.errors.sort(key=lambda error: error["row"])
+        return {"created": self.created, "errors": self.errors}
+
+    def reject(self, frame, mask, message):
+        """Report the rows selected by mask and drop them from frame"""
+        for idx in frame.index[mask]:
+            self.errors.append({"row": int(idx), "error": message})
+        return frame[~mask]
+
+    def reject_too_long(self, frame, model, columns):
+        """Reject values longer than their model field's max_length"""
+        for column in columns:
+            max_length = model._meta.get_field(column).max_length
+            frame = self.reject(
+                frame,
+                (frame[column].str.len() > max_length).to_numpy(),
+                "%s longer than %d characters"
+                % (column.replace("_", " ").capitalize(), max_length),
+            )
+        return frame
+
+    def reject_common(self, frame, key):
+        """Checks shared by students and staff"""
+        frame = self.reject(
+            frame,
+            frame[["first_name", "last_name"]].isna().any(axis=1).to_numpy(),
+            "Missing name",
+        )
+        frame = frame.assign(
+            department_id=_lookup(frame["department"], self.departments),
+            sex_value=_lookup(frame["sex"], self.sexes),
+        )
+        frame = self.reject(
+            frame,
+            frame["department_id"].isna().to_numpy(),
+            "Unknown department",
+        )
+        frame = self.reject(
+            frame, frame["sex_value"].isna().to_numpy(), "Invalid sex"
+        )
+        return self.reject(
+            frame,
+            frame[key].duplicated(keep="first").to_numpy(),
+            "Duplicate %s in file" % key.replace("_", " "),
+        )
+
+    @abc.abstractmethod
+    def process(self, frame, revision):
+        """Validate one chunk of rows and insert the valid ones"""
+
+
+class _StudentOnboarding(_Onboarding):
+    required_columns = STUDENT_COLUMNS
+    optional_columns = STUDENT_OPTIONAL_COLUMNS
+
+    def __init__(self, chunk_size):
+        super().__init__(chunk_size)
+        self.admission_statuses = _choice_map(AdmissionStatusChoices)
+        self.fingerprint_encodings = _choice_map(FingerprintEncodingChoices)
+
+    def process(self, frame, revision):
+        frame = self.reject(
+            frame,
+            ~validators.student_reg_number.validate_many(
+                frame["reg_number"]
+            ).to_numpy(),
+            "Invalid student registration number provided",
+        )
+        frame = self.reject_common(frame, "reg_number")
+        frame = self.reject_too_long(
+            frame, Student, ("first_name", "last_name", "other_names")
+        )
+        frame = frame.assign(
+            grad_yr=_to_int(frame["possible_grad_yr"]),
+            level=_to_int(frame["level_of_study"]),
+            status=_lookup(frame["admission_status"], self.admission_statuses),
+            encoding=_lookup(
+                frame["fingerprint_template_encoding"],
+                self.fingerprint_encodings,
+            ),
+        )
+        frame = self.reject(
+            frame,
+            frame["grad_yr"].isna().to_numpy(),
+            "Invalid graduation year",
+        )
+        frame = self.reject(
+            frame,
+            (
+                frame["level"].isna() & frame["level_of_study"].notna()
+            ).to_numpy(),
+            "Invalid level of study",
+        )
+        frame = self.reject(
+            frame,
+            (
+                frame["status"].isna() & frame["admission_status"].notna()
+            ).to_numpy(),
+            "Invalid admission status",
+        )
+        frame = self.reject(
+            frame,
+            (
+                frame["encoding"].isna()
+                & frame["fingerprint_template_encoding"].notna()
+            ).to_numpy(),
+            "Invalid fingerprint template encoding",
+        )
+        existing = set(
+            Student.objects.filter(
+                pk__in=list(frame["reg_number"])
+            ).values_list("pk", flat=True)
+        )
+        frame = self.reject(
+            frame,
+            frame["reg_number"].isin(existing).to_numpy(),
+            "Student already exists",
+        )
+
+        students = []
+        for row in _records(frame):
+            encoding = (
+                FingerprintEncodingChoices.HEX
+                if row["encoding"] is None
+                else int(row["encoding"])
+            )
+            students.append(
+                Student(
+                    reg_number=row["reg_number"],
+                    first_name=row["first_name"],
+                    last_name=row["last_name"],
+                    other_names=row["other_names"],
+                    department_id=int(row["department_id"]),
+                    possible_grad_yr=int(row["grad_yr"]),
+                    admission_status=(
+                        AdmissionStatusChoices.REGULAR
+                        if row["status"] is None
+                        else int(row["status"])
+                    ),
+                    level_of_study=(
+                        None if row["level"] is None else int(row["level"])
+                    ),
+                    fingerprint_template=row["fingerprint_template"],
+                    fingerprint_template_encoding=encoding,
+                    fingerprint_template_bin=fingerprint_template_to_bytes(
+                        row["fingerprint_template"], encoding
+                    ),
+                    face_encodings=row["face_encodings"],
+                    face_encodings_bin=face_enc_str_to_bytes(
+                        row["face_encodings"]
+                    ),
+                    sex=int(row["sex_value"]),
+                    revision=revision,
+                )
+            )
+        Student.objects.bulk_create(students, batch_size=self.chunk_size)
+        self.created += len(students)
+        if face_index.is_face_index_enabled():
+            transaction.on_commit(lambda: face_index.update_students(students))
+
+
+class _StaffOnboarding(_Onboarding):
+    required_columns = STAFF_COLUMNS
+    optional_columns = STAFF_OPTIONAL_COLUMNS
+
+    def __init__(self, chunk_size):
+        super().__init__(chunk_size)
+        self.titles = {
+            title.replace(".", "").upper(): title_id
+            for title_id, title in StaffTitle.objects.values_list(
+                "id", "title"
+            )
+        }
+
+    def process(self, frame, revision):
+        frame = frame.assign(
+            staff_number=frame["staff_number"].astype(str).str.upper()
+        )
+        frame = frame.assign(
+            username=frame["username"].where(
+                frame["username"].notna(), frame["staff_number"]
+            )
+        )
+        frame = self.reject(
+            frame,
+            ~validators.staff_number.validate_many(
+                frame["staff_number"]
+            ).to_numpy(),
+            "Invalid staff number provided",
+        )
+        frame = self.reject_common(frame, "staff_number")
+        frame = self.reject_too_long(
+            frame,
+            Staff,
+            (
+                "staff_number",
+                "username",
+                "first_name",
+                "last_name",
+                "other_names",
+                "email",
+            ),
+        )
+        frame = self.reject(
+            frame,
+            frame["email"].map(_is_invalid_email).to_numpy(dtype=bool),
+            "Enter a valid email address.",
+        )
+        frame = self.reject(
+            frame,
+            frame["username"].duplicated(keep="first").to_numpy(),
+            "Duplicate username in file",
+        )
+        existing = set(
+            Staff.objects.filter(
+                pk__in=list(frame["staff_number"])
+            ).values_list("pk", flat=True)
+        )
+        frame = self.reject(
+            frame,
+            frame["staff_number"].isin(existing).to_numpy(),
+            "Staff already exists",
+        )
+        taken = set(
+            AppUser.objects.filter(
+                username__in=list(frame["username"])
+            ).values_list("username", flat=True)
+        )
+        frame = self.reject(
+            frame,
+            frame["username"].isin(taken).to_numpy(),
+            "A user with that username already exists.",
+        )
+
+        rows = list(_records(frame))
+        users = []
+        for row in rows:
+            user = AppUser(
+                username=row["username"],
+                first_name=row["first_name"],
+                last_name=row["last_name"],
+                other_names=row["other_names"],
+                email=row["email"] or "",
+                sex=int(row["sex_value"]),
+                revision=revision,
+            )
+            # hashing a password per user would dominate the import; staff
+            # set their passwords on first login
+            user.set_unusable_password()
+            users.append(user)
+        AppUser.objects.bulk_create(users, batch_size=self.chunk_size)
+
+        staff = [
+            Staff(
+                appuser_ptr_id=user.pk,
+                staff_number=row["staff_number"],
+                department_id=int(row["department_id"]),
+                is_exam_officer=str(row["is_exam_officer"]).upper()
+                in ("1", "TRUE", "YES"),
+            )
+            for user, row in zip(users, rows)
+        ]
+        self._insert_staff(staff)
+
+        through = Staff.staff_titles.through
+        through.objects.bulk_create(
+            [
+                through(staff_id=staff_obj.pk, stafftitle_id=title_id)
+                for staff_obj, row in zip(staff, rows)
+                for title_id in {
+                    self.titles.get(title.strip().replace(".", "").upper())
+                    for title in (row["titles"] or "").split(",")
+                }
+                if title_id is not None
+            ],
+            batch_size=self.chunk_size,
+        )
+        self.created += len(staff)
+
+    def _insert_staff(self, staff):
+        # bulk_create refuses multi-table inherited models; the parent rows
+        # are already inserted so only Staff's own table is written here
+        fields = Staff._meta.local_concrete_fields
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            connection.ops.quote_name(Staff._meta.db_table),
+            ", ".join(
+                connection.ops.quote_name(field.column) for field in fields
+            ),
+            ", ".join(["%s"] * len(fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql,
+                [
+                    [
+                        field.get_db_prep_save(
+                            getattr(obj, field.attname), connection
+                        )
+                        for field in fields
+                    ]
+                    for obj in staff
+                ],
+            )
+
+
+def onboard_students(source, chunk_size=ONBOARDING_CHUNK_SIZE):
+    """Create the students listed in a CSV/Excel file (or DataFrame).
+
+    Returns {"created": <number of students>, "errors": [...]} where each
+    error is {"row": <0-based data row>, "error": <message>}.
+    """
+    return _StudentOnboarding(chunk_size).run(source)
+
+
+def onboard_staff(source, chunk_size=ONBOARDING_CHUNK_SIZE):
+    """Create the staff listed in a CSV/Excel file (or DataFrame).
+
+    Returns {"created": <number of staff>, "errors": [...]} where each
+    error is {"row": <0-based data row>, "error": <message>}.
+    """
+    return _StaffOnboarding(chunk_size).run(source)
@@ -0,0 +1,178 @@
+"""
+Expansion of recurring attendance sessions.
+
+A recurring AttendanceSession (recurring=True) stands for a series of
+occurrences, by default one a week at the same local time. Occurrences
+belong to the same node, course, academic session and event type and
+have the same duration as the session they were expanded from.
+
+expand_recurring_session materializes every occurrence up to a given
+time (e.g. the end of the semester) with a single bulk_create, after
+checking the unique_attendance_session and check_valid_stop_time
+constraints in memory; occurrences that already exist are skipped, so
+expanding a series again is harmless. materialize_upcoming only creates
+the occurrences of the next few weeks and is meant to be run
+periodically.
+"""
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from . import activesessions
+from .models import AttendanceSession, AttendanceSessionStatusChoices
+from .sessionids import new_session_id
+
+DEFAULT_INTERVAL = timedelta(weeks=1)
+# how far ahead materialize_upcoming creates occurrences
+DEFAULT_HORIZON = timedelta(weeks=2)
+
+SERIES_FIELDS = (
+    "node_device",
+    "course",
+    "session",
+    "event_type",
+    "duration",
+)
+FOREIGN_KEYS = ("node_device", "course", "session")
+
+
+def occurrence_times(first_start, until, interval=DEFAULT_INTERVAL):
+    """Start times of the occurrences of a series starting at first_start,
+    up to and including until
+    """
+    if interval <= timedelta(0):
+        raise ValueError("Recurrence interval must be positive")
+    # stepping in local time keeps the wall clock time across DST changes
+    first_start = timezone.localtime(first_start)
+    start_time = first_start
+    step = 0
+    while start_time <= until:
+        yield start_time
+        step += 1
+        start_time = first_start + step * interval
+
+
+def expand_recurring_session(
+    att_session, until, interval=DEFAULT_INTERVAL, start_after=None
+):
+    """Create the occurrences of the recurring att_session that start after
+    start_after (att_session's own start by default) and no later than
+    until. Returns the created sessions.
+    """
+    if not att_session.recurring:
+        raise ValueError("Attendance session is not recurring")
+    if att_session.duration <= timedelta(0):
+        # check_valid_stop_time
+        raise ValidationError(
+            {"duration": "Attendance session must have a positive duration"}
+        )
+    start_after = start_after or att_session.start_time
+    start_times = [
+        start_time
+        for start_time in occurrence_times(
+            att_session.start_time, until, interval
+        )
+        if start_time > start_after
+    ]
+    if not start_times:
+        return []
+
+    with transaction.atomic():
+        # unique_attendance_session
+        taken = set(
+            AttendanceSession.objects.filter(
+                course_id=att_session.course_id,
+                session_id=att_session.session_id,
+                duration=att_session.duration,
+                start_time__gte=start_times[0],
+                start_time__lte=start_times[-1],
+            ).values_list("start_time", flat=True)
+        )
+        occurrences = [
+            AttendanceSession(
+                id=new_session_id(att_session.node_device_id),
+                node_device_id=att_session.node_device_id,
+                initiator_id=att_session.initiator_id,
+                course_id=att_session.course_id,
+                session_id=att_session.session_id,
+                event_type=att_session.event_type,
+                start_time=start_time,
+                duration=att_session.duration,
+                status=AttendanceSessionStatusChoices.ACTIVE,
+                recurring=True,
+            )
+            for start_time in start_times
+            if start_time not in taken
+        ]
+        AttendanceSession.objects.bulk_create(occurrences)
+        # bulk_create sends no post_save, so the node's cached "no active
+        # session" has to be dropped here
+        node_id = att_session.node_device_id
+        activesessions.invalidate_node(node_id)
+        transaction.on_commit(lambda: activesessions.invalidate_node(node_id))
+    return occurrences
+
+
+def series_sessions(att_session):
+    """The sessions of att_session's series"""
+    return AttendanceSession.objects.filter(
+        recurring=True,
+        node_device_id=att_session.node_device_id,
+        course_id=att_session.course_id,
+        session_id=att_session.session_id,
+        event_type=att_session.event_type,
+        duration=att_session.duration,
+    )
+
+
+def materialize_upcoming(
+    att_session, horizon=DEFAULT_HORIZON, interval=DEFAULT_INTERVAL, now=None
+):
+    """Create the occurrences of att_session's series that start within
+    horizon from now and don't exist yet
+    """
+    now = now or timezone.now()
+    last_start = series_sessions(att_session).aggregate(
+        last_start=Max("start_time")
+    )["last_start"]
+    return expand_recurring_session(
+        att_session,
+        now + horizon,
+        interval,
+        start_after=max(
+            last_start or att_session.start_time, att_session.start_time
+        ),
+    )
+
+
+def materialize_all_upcoming(
+    horizon=DEFAULT_HORIZON, interval=DEFAULT_INTERVAL, now=None
+):
+    """materialize_upcoming for every series of the current academic
+    session. Returns the created sessions.
+    """
+    now = now or timezone.now()
+    series = (
+        AttendanceSession.objects.filter(
+            recurring=True, session__is_current_session=True
+        )
+        .values(*SERIES_FIELDS)
+        .annotate(first_start=Min("start_time"))
+        .order_by()
+    )
+    created = []
+    for values in series:
+        first_start = values.pop("first_start")
+        template = AttendanceSession(
+            start_time=first_start,
+            recurring=True,
+            **{
+                field + ("_id" if field in FOREIGN_KEYS else ""): value
+                for field, value in values.items()
+            },
+        )
+        created.extend(materialize_upcoming(template, horizon, interval, now))
+    return created
@@ -0,0 +1,230 @@
+"""
+Process local cache of reference data.
+
+Faculties, departments, courses and academic sessions change rarely but
+feed every dropdown of the node UI. Each table is read once into memory,
+along with case-insensitive name -> id maps, and served from there until
+a post_save/post_delete signal (see signals.py) or a bulk load reports
+a write with written().
+
+Reads inside an atomic block are cached like any other, as they only see
+committed rows, unless the transaction itself has written reference data:
+its reads then go to the database, and bypass the cache, until it
+commits and the cache is dropped. A write rolled back (with its
+transaction or savepoint) leaves the cache alone.
+"""
+from collections import namedtuple
+import threading
+import weakref
+
+from django.db import transaction
+
+from .instrumentation import instrument
+
+FacultyRow = namedtuple("FacultyRow", ["id", "name"])
+DepartmentRow = namedtuple(
+    "DepartmentRow", ["id", "name", "alias", "faculty_id"]
+)
+CourseRow = namedtuple(
+    "CourseRow",
+    [
+        "id",
+        "code",
+        "title",
+        "level_of_study",
+        "department_id",
+        "semester",
+    ],
+)
+AcademicSessionRow = namedtuple(
+    "AcademicSessionRow", ["id", "session", "is_current_session"]
+)
+
+_cache = {}
+_cache_lock = threading.Lock()
+# bumped on every invalidation so that a table read before an
+# invalidation is never stored in the cache
+_cache_generation = 0
+
+
+class _WriteMarker:
+    """The on_commit callback registered by written(). Django holds it
+    until the transaction commits, when it runs, or is rolled back (with
+    its savepoint), when it is dropped; a marker that is alive and hasn't
+    run is a write in flight.
+    """
+
+    def __init__(self, using):
+        self.using = using
+
+    def __call__(self):
+        _write_markers(self.using).discard(self)
+        invalidate()
+
+
+# per thread, like connections: alias -> weak set of the pending markers
+_pending_writes = threading.local()
+
+
+def _write_markers(using):
+    markers = getattr(_pending_writes, "markers", None)
+    if markers is None:
+        markers = _pending_writes.markers = {}
+    return markers.setdefault(using, weakref.WeakSet())
+
+
+def _has_uncommitted_writes(using=None):
+    """Whether the current transaction wrote reference data"""
+    connection = transaction.get_connection(using)
+    return connection.in_atomic_block and bool(
+        _write_markers(connection.alias)
+    )
+
+
+def _cached(name, loader):
+    uncommitted = _has_uncommitted_writes()
+    with _cache_lock:
+        table = None if uncommitted else _cache.get(name)
+        generation = _cache_generation
+    if table is not None:
+        return table
+
+    with instrument("refcache.%s" % name) as recorder:
+        table = loader()
+        recorder.add_rows(len(table[0]))
+    if not uncommitted:
+        with _cache_lock:
+            if generation == _cache_generation:
+                _cache[name] = table
+    return table
+
+
+def _name_map(rows, *fields):
+    """{upper cased value: id} of the given fields, first row wins"""
+    names = {}
+    for row in rows:
+        for field in fields:
+            value = getattr(row, field)
+            if value:
+                names.setdefault(value.upper(), row.id)
+    return names
+
+
+def _load_faculties():
+    from .models import Faculty
+
+    rows = [
+        FacultyRow(*values)
+        for values in Faculty.objects.order_by("name").values_list(
+            "id", "name"
+        )
+    ]
+    return rows, _name_map(rows, "name")
+
+
+def _load_departments():
+    from .models import Department
+
+    rows = [
+        DepartmentRow(*values)
+        for values in Department.objects.order_by("name").values_list(
+            "id", "name", "alias", "faculty_id"
+        )
+    ]
+    return rows, _name_map(rows, "name")
+
+
+def _load_courses():
+    from .models import Course
+
+    rows = [
+        CourseRow(*values)
+        for values in Course.objects.exclude(is_active=False)
+        .order_by("id")
+        .values_list(*CourseRow._fields)
+    ]
+    course_ids = {}
+    for row in rows:
+        key = (row.code.upper(), row.title.upper())
+        # an ambiguous code and title maps to None
+        course_ids[key] = None if key in course_ids else row.id
+    return rows, course_ids
+
+
+def _load_academic_sessions():
+    from .models import AcademicSession
+
+    rows = [
+        AcademicSessionRow(*values)
+        for values in AcademicSession.objects.order_by(
+            "-is_current_session"
+        ).values_list(*AcademicSessionRow._fields)
+    ]
+    return rows, _name_map(rows, "session")
+
+
+def faculties():
+    """Faculties ordered by name"""
+    return _cached("faculties", _load_faculties)[0]
+
+
+def faculty_id(name):
+    """id of the faculty called name (case-insensitive) or None"""
+    return _cached("faculties", _load_faculties)[1].get(str(name).upper())
+
+
+def departments():
+    """Departments ordered by name"""
+    return _cached("departments", _load_departments)[0]
+
+
+def department_id(name):
+    """id of the department called name (case-insensitive) or None"""
+    return _cached("departments", _load_departments)[1].get(str(name).upper())
+
+
+def courses():
+    """Active courses"""
+    return _cached("courses", _load_courses)[0]
+
+
+def course_id(code, title):
+    """id of the active course with code and title (case-insensitive),
+    None if there is no such course or more than one
+    """
+    return _cached("courses", _load_courses)[1].get(
+        (str(code).upper(), str(title).upper())
+    )
+
+
+def academic_sessions():
+    """Academic sessions, the current session first"""
+    return _cached("academic_sessions", _load_academic_sessions)[0]
+
+
+def academic_session_id(session):
+    """id of the academic session called session or None"""
+    return _cached("academic_sessions", _load_academic_sessions)[1].get(
+        str(session).upper()
+    )
+
+
+def written(using=None):
+    """Report a write to a reference table: the cache is dropped once the
+    write commits, and until then the writing transaction doesn't use it
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        invalidate()
+        return
+    marker = _WriteMarker(connection.alias)
+    _write_markers(connection.alias).add(marker)
+    transaction.on_commit(marker, using)
+
+
+def invalidate():
+    """Drop every cached table"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache.clear()
@@ -0,0 +1,174 @@
+"""
+Bulk import of course registrations.
+
+CourseRegistration.save validates one row at a time and dereferences
+the course to do so. bulk_register instead resolves every student,
+course and academic session of an import with a few IN queries, applies
+the same rules in memory (the semester check of CourseRegistration.clean
+and the unique_course_registration constraint) and inserts the valid
+rows with bulk_create.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models.functions import Upper
+
+from . import faces, fingerprints
+from .instrumentation import instrumented
+from .models import (
+    AcademicSession,
+    Course,
+    CourseRegistration,
+    SemesterChoices,
+    Student,
+    SyncState,
+)
+
+# number of rows per IN query and per INSERT
+REGISTRATION_BATCH_SIZE = 500
+
+RegistrationRow = namedtuple(
+    "RegistrationRow", ["reg_number", "course_code", "session", "semester"]
+)
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _semester_value(semester):
+    if isinstance(semester, int):
+        return semester if semester in SemesterChoices.values else None
+    semester = str(semester).strip()
+    if semester.isdigit():
+        return _semester_value(int(semester))
+    for value, label in SemesterChoices.choices:
+        if semester.upper() in (label.upper(), SemesterChoices(value).name):
+            return value
+    return None
+
+
+def _normalize_code(code):
+    return " ".join(str(code).split()).upper()
+
+
+@instrumented("registration.bulk_register")
+def bulk_register(rows, batch_size=REGISTRATION_BATCH_SIZE):
+    """Register students for courses in bulk.
+
+    rows is an iterable of RegistrationRow or of
+    (reg_number, course code, session, semester) tuples, e.g.
+    ("2001/123456", "ECE 272", "2020/2021", "Second").
+
+    Returns {"created": <number of registrations>, "errors": [...]} where
+    each error is {"row": <index in rows>, "error": <message>}.
+    """
+    rows = [RegistrationRow(*row) for row in rows]
+    errors = []
+
+    reg_numbers = {row.reg_number for row in rows}
+    codes = {_normalize_code(row.course_code) for row in rows}
+    sessions = {row.session for row in rows}
+
+    known_students = set()
+    for chunk in _chunks(reg_numbers, batch_size):
+        known_students.update(
+            Student.objects.filter(pk__in=chunk).values_list("pk", flat=True)
+        )
+    courses_by_code = defaultdict(list)
+    for chunk in _chunks(codes, batch_size):
+        for course_id, code, semester in (
+            Course.objects.exclude(is_active=False)
+            .annotate(upper_code=Upper("code"))
+            .filter(upper_code__in=chunk)
+            .values_list("id", "upper_code", "semester")
+        ):
+            courses_by_code[code].append((course_id, semester))
+    session_ids = dict(
+        AcademicSession.objects.filter(session__in=sessions).values_list(
+            "session", "id"
+        )
+    )
+
+    candidates = []
+    for idx, row in enumerate(rows):
+        semester = _semester_value(row.semester)
+        offered = courses_by_code.get(_normalize_code(row.course_code), [])
+        in_semester = [
+            course_id
+            for course_id, course_semester in offered
+            if course_semester == semester
+        ]
+        if row.reg_number not in known_students:
+            errors.append({"row": idx, "error": "Unknown student"})
+        elif row.session not in session_ids:
+            errors.append({"row": idx, "error": "Unknown academic session"})
+        elif semester is None:
+            errors.append({"row": idx, "error": "Invalid semester"})
+        elif not offered:
+            errors.append({"row": idx, "error": "Unknown course"})
+        elif not in_semester:
+            errors.append(
+                {
+                    "row": idx,
+                    "error": "Course is not offered in selected semester",
+                }
+            )
+        elif len(in_semester) > 1:
+            errors.append({"row": idx, "error": "Ambiguous course code"})
+        else:
+            candidates.append(
+                (
+                    idx,
+                    CourseRegistration(
+                        student_id=row.reg_number,
+                        course_id=in_semester[0],
+                        session_id=session_ids[row.session],
+                        semester=semester,
+                    ),
+                )
+            )
+
+    existing = set()
+    course_ids = {obj.course_id for _, obj in candidates}
+    academic_session_ids = {obj.session_id for _, obj in candidates}
+    for chunk in _chunks(
+        {obj.student_id for _, obj in candidates}, batch_size
+    ):
+        existing.update(
+            CourseRegistration.objects.filter(
+                student_id__in=chunk,
+                course_id__in=course_ids,
+                session_id__in=academic_session_ids,
+            ).values_list("student_id", "course_id", "session_id")
+        )
+
+    new_objs = []
+    for idx, obj in candidates:
+        key = (obj.student_id, obj.course_id, obj.session_id)
+        if key in existing:
+            errors.append(
+                {"row": idx, "error": "Student is already registered"}
+            )
+            continue
+        existing.add(key)
+        new_objs.append(obj)
+
+    with transaction.atomic():
+        if new_objs:
+            # bulk_create doesn't send pre_save, stamp the revision here
+            revision = SyncState.next_revision()
+            for obj in new_objs:
+                obj.revision = revision
+        CourseRegistration.objects.bulk_create(new_objs, batch_size=batch_size)
+
+    for course_id, session_id in {
+        (obj.course_id, obj.session_id) for obj in new_objs
+    }:
+        faces.invalidate_course_gallery(course_id, session_id)
+        fingerprints.invalidate_course_gallery(course_id, session_id)
+
+    errors.sort(key=lambda error: error["row"])
+    return {"created": len(new_objs), "errors": errors}
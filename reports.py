@@ -0,0 +1,253 @@
+"""
+Attendance reports.
+
+attendance_matrix computes, for a set of courses of one academic
+session, how many of each course's attendance sessions every registered
+student attended. It runs three grouped queries (registrations, sessions
+held per course and valid records per course and student) and fills
+course x student numpy arrays, instead of counting records student by
+student. Attendance can also be read from the summary table maintained
+by summaries.py.
+
+A matrix can be turned into a DataFrame or streamed row by row to CSV
+or XLSX; only registered (course, student) pairs are written.
+"""
+import csv
+
+import numpy as np
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import refcache
+from .models import (
+    AttendanceRecord,
+    AttendanceSession,
+    CourseAttendanceSummary,
+    CourseRegistration,
+    SemesterChoices,
+)
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# share of the lectures a student must attend to sit for the exam
+DEFAULT_ELIGIBILITY_THRESHOLD = 75
+
+REPORT_COLUMNS = (
+    "course",
+    "reg_number",
+    "attended",
+    "held",
+    "percentage",
+    "eligible",
+)
+
+
+class AttendanceMatrix:
+    """Attendance of students (columns) in courses (rows).
+
+    registered[i, j] tells if students[j] is registered for courses[i],
+    attended[i, j] how many sessions of the course they attended and
+    held[i] how many sessions of the course were held.
+    """
+
+    def __init__(self, courses, students, registered, attended, held):
+        self.courses = courses
+        self.students = students
+        self.registered = registered
+        self.attended = attended
+        self.held = held
+
+    @property
+    def percentage(self):
+        """Attendance percentage, NaN where the student isn't registered
+        or the course held no session
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percentage = self.attended * 100.0 / self.held[:, None]
+        percentage[~self.registered | (self.held[:, None] == 0)] = np.nan
+        return percentage
+
+    def eligible(self, threshold=DEFAULT_ELIGIBILITY_THRESHOLD):
+        """Registered students who attended at least threshold percent of
+        the sessions held. Courses that held no session bar no one.
+        """
+        with np.errstate(invalid="ignore"):
+            meets = self.percentage >= threshold
+        return self.registered & (meets | (self.held[:, None] == 0))
+
+    def rows(self, threshold=DEFAULT_ELIGIBILITY_THRESHOLD):
+        """Yield a tuple of REPORT_COLUMNS per registration"""
+        codes = [course.code for course in self.courses]
+        percentage = self.percentage
+        eligible = self.eligible(threshold)
+        for i, j in zip(*np.nonzero(self.registered)):
+            yield (
+                codes[i],
+                self.students[j],
+                int(self.attended[i, j]),
+                int(self.held[i]),
+                None
+                if np.isnan(percentage[i, j])
+                else round(float(percentage[i, j]), 2),
+                bool(eligible[i, j]),
+            )
+
+    def to_dataframe(self, threshold=DEFAULT_ELIGIBILITY_THRESHOLD):
+        import pandas as pd
+
+        return pd.DataFrame(
+            list(self.rows(threshold)), columns=list(REPORT_COLUMNS)
+        )
+
+
+def course_ids_for(faculty=None, department=None, semester=None):
+    """ids of the active courses of a faculty or department (names or
+    ids), optionally of one semester (value or label)
+    """
+    courses = refcache.courses()
+    if department is not None:
+        if isinstance(department, str):
+            department = refcache.department_id(department)
+        courses = [c for c in courses if c.department_id == department]
+    elif faculty is not None:
+        if isinstance(faculty, str):
+            faculty = refcache.faculty_id(faculty)
+        department_ids = {
+            dept.id
+            for dept in refcache.departments()
+            if dept.faculty_id == faculty
+        }
+        courses = [c for c in courses if c.department_id in department_ids]
+    if semester is not None:
+        if isinstance(semester, str):
+            semester = SemesterChoices.str_to_value(semester)
+        courses = [c for c in courses if c.semester == semester]
+    return [course.id for course in courses]
+
+
+def attendance_matrix(course_ids, session_id, at=None, use_summary=False):
+    """Attendance in the given courses during the academic session with id
+    session_id, counting the attendance sessions started by `at` (now by
+    default) and the records marked valid.
+
+    With use_summary attendance is read from CourseAttendanceSummary, one
+    row per registration, instead of being counted from the records; the
+    summary covers every session recorded so far, whatever `at` is.
+    """
+    at = at or timezone.now()
+    courses_by_id = {course.id: course for course in refcache.courses()}
+    courses = [
+        courses_by_id[course_id]
+        for course_id in sorted(set(course_ids))
+        if course_id in courses_by_id
+    ]
+    course_index = {course.id: idx for idx, course in enumerate(courses)}
+
+    registrations = list(
+        CourseRegistration.objects.filter(
+            course_id__in=course_index, session_id=session_id
+        ).values_list("course_id", "student_id")
+    )
+    students = sorted({student_id for _, student_id in registrations})
+    student_index = {
+        reg_number: idx for idx, reg_number in enumerate(students)
+    }
+
+    registered = np.zeros((len(courses), len(students)), dtype=bool)
+    for course_id, student_id in registrations:
+        registered[course_index[course_id], student_index[student_id]] = True
+
+    held = np.zeros(len(courses), dtype=np.int32)
+    for course_id, count in (
+        AttendanceSession.objects.filter(
+            course_id__in=course_index,
+            session_id=session_id,
+            start_time__lte=at,
+        )
+        .values("course_id")
+        .annotate(count=Count("id"))
+        .values_list("course_id", "count")
+    ):
+        held[course_index[course_id]] = count
+
+    if use_summary:
+        attendance = CourseAttendanceSummary.objects.filter(
+            course_id__in=course_index, session_id=session_id
+        ).values_list("course_id", "student_id", "attended")
+    else:
+        attendance = (
+            AttendanceRecord.objects.filter(
+                attendance_session__course_id__in=course_index,
+                attendance_session__session_id=session_id,
+                attendance_session__start_time__lte=at,
+                is_valid=True,
+            )
+            .values(
+                course_id=F("attendance_session__course_id"),
+                reg_number=F("student_id"),
+            )
+            .annotate(count=Count("attendance_session", distinct=True))
+            .values_list("course_id", "reg_number", "count")
+        )
+    attended = np.zeros((len(courses), len(students)), dtype=np.int32)
+    for course_id, student_id, count in attendance:
+        j = student_index.get(student_id)
+        # attendance of students who aren't registered is not reported
+        if j is not None:
+            attended[course_index[course_id], j] = count
+
+    return AttendanceMatrix(courses, students, registered, attended, held)
+
+
+def exam_officer_report(
+    staff, session_id, semester=None, faculty=None, at=None, use_summary=None
+):
+    """Attendance matrix of a faculty (staff's own by default) for an exam
+    officer, read from the attendance summaries unless `at` is given (the
+    summaries count every session, whenever it started)
+    """
+    if not staff.is_exam_officer:
+        raise PermissionDenied("Only exam officers can run faculty reports")
+    if faculty is None:
+        faculty = next(
+            dept.faculty_id
+            for dept in refcache.departments()
+            if dept.id == staff.department_id
+        )
+    if use_summary is None:
+        use_summary = at is None
+    return attendance_matrix(
+        course_ids_for(faculty=faculty, semester=semester),
+        session_id,
+        at,
+        use_summary,
+    )
+
+
+def write_csv(
+    matrix, csv_file, threshold=DEFAULT_ELIGIBILITY_THRESHOLD, header=True
+):
+    """Write a matrix to the text file object csv_file one row at a time"""
+    writer = csv.writer(csv_file)
+    if header:
+        writer.writerow(REPORT_COLUMNS)
+    for row in matrix.rows(threshold):
+        writer.writerow(row)
+
+
+def write_xlsx(matrix, file_path, threshold=DEFAULT_ELIGIBILITY_THRESHOLD):
+    """Write a matrix to an Excel workbook. Rows are streamed to the file,
+    never held in memory as cells. Requires openpyxl.
+    """
+    if Workbook is None:
+        raise ImportError("XLSX export requires the openpyxl package")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Attendance")
+    sheet.append(REPORT_COLUMNS)
+    for row in matrix.rows(threshold):
+        sheet.append(row)
+    workbook.save(file_path)
@@ -0,0 +1,58 @@
+"""
+Primary keys of attendance sessions.
+
+Sessions are created on many node devices and merged on the server, so
+their ids must be unique across nodes without asking the database:
+
+    <node id>-<milliseconds since the epoch><process tag><counter>
+
+e.g. "12-0192f0c4a6b3e-5c1a-000001", all hexadecimal. The node prefix
+keeps ids of different nodes apart, the random process tag keeps apart
+ids generated by two processes of one node in the same millisecond and
+the counter orders ids generated within one millisecond. The time part
+is fixed width and never goes backwards, so each node's ids sort in
+creation order and are appended at the end of the primary key index.
+"""
+import secrets
+import threading
+import time
+
+_COUNTER_LIMIT = 0x1000000
+
+_lock = threading.Lock()
+_process_tag = secrets.randbits(16)
+_last_millis = 0
+_counter = 0
+
+
+def new_session_id(node_device_id):
+    """A new attendance session id for the node with id node_device_id"""
+    global _last_millis, _counter
+    with _lock:
+        millis = max(time.time_ns() // 1_000_000, _last_millis)
+        if millis == _last_millis:
+            _counter += 1
+            if _counter == _COUNTER_LIMIT:
+                # out of ids for this millisecond, borrow the next one
+                millis += 1
+                _counter = 0
+        else:
+            _counter = 0
+        _last_millis = millis
+        counter = _counter
+    return "%d-%013x-%04x-%06x" % (
+        node_device_id,
+        millis,
+        _process_tag,
+        counter,
+    )
+
+
+def node_of(session_id):
+    """id of the node that generated session_id, None for ids that don't
+    follow this scheme
+    """
+    prefix, _, rest = str(session_id).partition("-")
+    if not rest or not prefix.isdigit():
+        return None
+    return int(prefix)
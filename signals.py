@@ -0,0 +1,113 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import activesessions, refcache, summaries
+from .models import (
+    AcademicSession,
+    AttendanceRecord,
+    AttendanceSession,
+    Course,
+    CourseRegistration,
+    Department,
+    Faculty,
+    Student,
+    SyncState,
+    SyncTombstone,
+    SyncTrackedModel,
+)
+
+
+def stamp_revision(sender, instance, raw=False, **kwargs):
+    # rows loaded from a server dump keep the server's revision
+    if not raw:
+        instance.revision = SyncState.next_revision()
+
+
+def record_tombstone(sender, instance, using=None, **kwargs):
+    SyncTombstone.record(sender, instance.pk, using)
+
+
+# connected to the tracked models only, so that the others keep Django's
+# fast delete
+for model in apps.get_models():
+    if issubclass(model, SyncTrackedModel):
+        pre_save.connect(stamp_revision, sender=model)
+        post_delete.connect(record_tombstone, sender=model)
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, **kwargs):
+    # the galleries need numpy, so they're imported by the first save that
+    # touches them rather than when the app starts
+    from . import face_index, faces, fingerprints
+
+    transaction.on_commit(lambda: faces.invalidate_student_galleries(instance))
+    transaction.on_commit(
+        lambda: fingerprints.invalidate_student_galleries(instance)
+    )
+    if face_index.is_face_index_enabled():
+        transaction.on_commit(lambda: face_index.update_student(instance))
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    from . import face_index, faces, fingerprints
+
+    instance.face_encodings_bin = None
+    instance.fingerprint_template_bin = None
+    transaction.on_commit(lambda: faces.invalidate_student_galleries(instance))
+    transaction.on_commit(
+        lambda: fingerprints.invalidate_student_galleries(instance)
+    )
+    if face_index.is_face_index_enabled():
+        transaction.on_commit(lambda: face_index.update_student(instance))
+
+
+@receiver(post_save, sender=CourseRegistration)
+@receiver(post_delete, sender=CourseRegistration)
+def course_registration_changed(sender, instance, **kwargs):
+    from . import faces, fingerprints
+
+    transaction.on_commit(
+        lambda: faces.invalidate_course_gallery(
+            instance.course_id, instance.session_id
+        )
+    )
+    transaction.on_commit(
+        lambda: fingerprints.invalidate_course_gallery(
+            instance.course_id, instance.session_id
+        )
+    )
+
+
+@receiver(post_save, sender=Faculty)
+@receiver(post_delete, sender=Faculty)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=AcademicSession)
+@receiver(post_delete, sender=AcademicSession)
+def reference_data_changed(sender, using=None, **kwargs):
+    refcache.written(using)
+
+
+@receiver(post_save, sender=AttendanceSession)
+@receiver(post_delete, sender=AttendanceSession)
+def attendance_session_changed(sender, instance, **kwargs):
+    node_id = instance.node_device_id
+    activesessions.invalidate_node(node_id)
+    transaction.on_commit(lambda: activesessions.invalidate_node(node_id))
+
+
+@receiver(post_save, sender=AttendanceRecord)
+@receiver(post_delete, sender=AttendanceRecord)
+def attendance_record_changed(
+    sender, instance, raw=False, using=None, **kwargs
+):
+    if not raw:
+        summaries.refresh_on_commit(
+            [(instance.attendance_session_id, instance.student_id)], using
+        )
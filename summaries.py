@@ -0,0 +1,244 @@
+"""
+Attendance summary tables.
+
+AttendanceSessionSummary holds the number of students signed in to (and
+out of) every attendance session and CourseAttendanceSummary the number
+of a course's attendance sessions every student attended in an academic
+session. Only valid records (is_valid=True) are counted.
+
+The tables are kept up to date incrementally: refresh is given the
+(attendance session, student) pairs whose records were written and
+recounts only the summary rows those pairs fall into, with a fixed
+number of queries however many pairs there are. AttendanceRecord saves
+and deletes refresh through signals (see signals.py) with
+refresh_on_commit, once per transaction; the bulk write paths
+(checkin.check_in_many, ingest) call refresh themselves, as bulk_create
+and update() send no signals. checkin.check_in knows the transition it
+made and applies it with record_sign_in and record_sign_out, which
+increment the counts in place instead of recounting.
+"""
+from functools import reduce
+from operator import or_
+import threading
+import weakref
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import (
+    AttendanceRecord,
+    AttendanceSession,
+    AttendanceSessionSummary,
+    CourseAttendanceSummary,
+    RecordTypesChoices,
+)
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def _count(records, group_by, field):
+    """Subquery counting the distinct values of field in records"""
+    return Coalesce(
+        Subquery(
+            records.order_by()
+            .values(group_by)
+            .annotate(count=Count(field, distinct=True))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def _refresh_sessions(session_ids):
+    # rows are created empty and recounted in place, so concurrent
+    # refreshes of the same session never collide
+    AttendanceSessionSummary.objects.bulk_create(
+        [
+            AttendanceSessionSummary(attendance_session_id=session_id)
+            for session_id in session_ids
+        ],
+        ignore_conflicts=True,
+    )
+    records = AttendanceRecord.objects.filter(
+        attendance_session_id=OuterRef("pk"), is_valid=True
+    )
+    AttendanceSessionSummary.objects.filter(
+        attendance_session_id__in=session_ids
+    ).update(
+        signed_in=_count(records, "attendance_session", "student"),
+        signed_out=_count(
+            records.filter(record_type=RecordTypesChoices.SIGN_OUT),
+            "attendance_session",
+            "student",
+        ),
+    )
+
+
+def _refresh_courses(students):
+    """students maps (course id, academic session id) to reg numbers"""
+    CourseAttendanceSummary.objects.bulk_create(
+        [
+            CourseAttendanceSummary(
+                course_id=course_id,
+                session_id=acad_session_id,
+                student_id=reg_number,
+            )
+            for (course_id, acad_session_id), reg_numbers in students.items()
+            for reg_number in reg_numbers
+        ],
+        ignore_conflicts=True,
+    )
+    _recount_courses(
+        CourseAttendanceSummary.objects.filter(
+            reduce(
+                or_,
+                (
+                    Q(
+                        course_id=course_id,
+                        session_id=acad_session_id,
+                        student_id__in=reg_numbers,
+                    )
+                    for (course_id, acad_session_id), reg_numbers in (
+                        students.items()
+                    )
+                ),
+            )
+        )
+    )
+
+
+def _recount_courses(rows):
+    """Recount the CourseAttendanceSummary rows in the queryset rows"""
+    records = AttendanceRecord.objects.filter(
+        attendance_session__course_id=OuterRef("course_id"),
+        attendance_session__session_id=OuterRef("session_id"),
+        student_id=OuterRef("student_id"),
+        is_valid=True,
+    )
+    rows.update(attended=_count(records, "student", "attendance_session"))
+
+
+def refresh(keys):
+    """Recount the summaries of the (attendance session id, student reg
+    number) pairs in keys
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    session_ids = {session_id for session_id, _ in keys}
+    course_of = {
+        pk: (course_id, acad_session_id)
+        for pk, course_id, acad_session_id in AttendanceSession.objects.filter(
+            pk__in=session_ids
+        ).values_list("pk", "course_id", "session_id")
+    }
+    students = {}
+    orphans = set()
+    for session_id, reg_number in keys:
+        if session_id in course_of:
+            students.setdefault(course_of[session_id], set()).add(reg_number)
+        else:
+            orphans.add(reg_number)
+    if students:
+        _refresh_sessions(set(course_of))
+        _refresh_courses(students)
+    if orphans:
+        # the sessions are gone, and their session summaries with them,
+        # but not knowing their courses every course summary of their
+        # students is recounted
+        _recount_courses(
+            CourseAttendanceSummary.objects.filter(student_id__in=orphans)
+        )
+
+
+def record_sign_in(session_id, reg_number):
+    """Count a new valid SIGN_IN record of the student in the attendance
+    session. Call it in the transaction that inserted the record.
+    """
+    updated = AttendanceSessionSummary.objects.filter(
+        attendance_session_id=session_id
+    ).update(signed_in=F("signed_in") + 1)
+    if not updated:
+        # the session's first record: the summary rows are created
+        refresh([(session_id, reg_number)])
+        return
+    sessions = AttendanceSession.objects.filter(pk=session_id)
+    updated = CourseAttendanceSummary.objects.filter(
+        course_id=Subquery(sessions.values("course_id")),
+        session_id=Subquery(sessions.values("session_id")),
+        student_id=reg_number,
+    ).update(attended=F("attended") + 1)
+    if not updated:
+        # the student's first attendance in the course
+        (course,) = sessions.values_list("course_id", "session_id")
+        _refresh_courses({course: {reg_number}})
+
+
+def record_sign_out(session_id, reg_number):
+    """Count the sign out of the student's valid record in the attendance
+    session. Call it in the transaction that updated the record.
+    """
+    updated = AttendanceSessionSummary.objects.filter(
+        attendance_session_id=session_id
+    ).update(signed_out=F("signed_out") + 1)
+    if not updated:
+        refresh([(session_id, reg_number)])
+
+
+class _RefreshBatch:
+    """The keys a transaction wrote, refreshed when it commits"""
+
+    def __init__(self):
+        self.keys = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        refresh(self.keys)
+
+
+# per thread, like connections: alias -> weak reference to the batch of
+# the current transaction. Django holds the batch until the transaction
+# commits or is rolled back (with its savepoint), so a live batch that
+# hasn't run is still pending.
+_pending_batches = threading.local()
+
+
+def refresh_on_commit(keys, using=None):
+    """Refresh keys once the current transaction commits (right away
+    outside a transaction), with a single refresh for all the keys the
+    transaction passes
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        refresh(keys)
+        return
+    if not hasattr(_pending_batches, "refs"):
+        _pending_batches.refs = {}
+    ref = _pending_batches.refs.get(connection.alias)
+    batch = ref() if ref is not None else None
+    if batch is None or batch.done:
+        batch = _RefreshBatch()
+        _pending_batches.refs[connection.alias] = weakref.ref(batch)
+        transaction.on_commit(batch, using)
+    batch.keys.update(keys)
+
+
+def rebuild():
+    """Recount both tables from scratch, e.g. after records were written
+    by a path that doesn't refresh them
+    """
+    keys = AttendanceRecord.objects.values_list(
+        "attendance_session_id", "student_id"
+    ).distinct()
+    with transaction.atomic():
+        AttendanceSessionSummary.objects.all().delete()
+        CourseAttendanceSummary.objects.all().delete()
+        batch = []
+        for key in keys.iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == REBUILD_BATCH_SIZE:
+                refresh(batch)
+                batch = []
+        refresh(batch)
@@ -0,0 +1,181 @@
+"""
+Server side coordination of data synching with many node devices.
+
+A SyncCoordinator serves node requests concurrently from a thread pool:
+    = pull: the delta since the node's acknowledged revision. Deltas are
+      cached per (since revision, current revision) and generated once
+      no matter how many nodes ask for them at the same time.
+    = push: ingestion of a node dump (see ingest.py). Uploads that touch
+      the same attendance session are serialized; uploads of unrelated
+      sessions run in parallel.
+
+stats() exposes the queue depth and the per node latencies.
+"""
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+from django.db import connections
+from django.utils.dateparse import parse_datetime, parse_duration
+
+from . import datasynch
+from .ingest import SESSION_MODEL, ingest_node_dump
+from .models import SyncState
+
+DEFAULT_MAX_WORKERS = 4
+# number of distinct deltas kept in memory
+DEFAULT_CACHE_SIZE = 8
+# number of latency samples kept per node
+LATENCY_SAMPLES = 50
+
+
+def _session_lock_key(record):
+    fields = record["fields"]
+    start_time = fields["start_time"]
+    duration = fields["duration"]
+    if isinstance(start_time, str):
+        start_time = parse_datetime(start_time)
+    if isinstance(duration, str):
+        duration = parse_duration(duration)
+    return (fields["course"], fields["session"], start_time, duration)
+
+
+class SyncCoordinator:
+    def __init__(
+        self, max_workers=DEFAULT_MAX_WORKERS, cache_size=DEFAULT_CACHE_SIZE
+    ):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tams-sync"
+        )
+        self._lock = threading.Lock()
+        self._cache_size = cache_size
+        self._deltas = OrderedDict()
+        # session key -> [lock, number of uploads using it]
+        self._session_locks = {}
+        self._queued = 0
+        self._running = 0
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def _submit(self, node_device, func, *args):
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            try:
+                return func(*args)
+            finally:
+                connections.close_all()
+                with self._lock:
+                    self._running -= 1
+                    self._latencies[node_device.pk].append(
+                        time.perf_counter() - submitted
+                    )
+
+        return self._executor.submit(run)
+
+    def get_delta(self, since_revision):
+        """Return the JSON delta since since_revision, generating it only
+        once per server revision
+        """
+        key = (since_revision, SyncState.get_value(SyncState.REVISION))
+        with self._lock:
+            future = self._deltas.get(key)
+            owner = future is None
+            if owner:
+                future = self._deltas[key] = Future()
+                while len(self._deltas) > self._cache_size:
+                    self._deltas.popitem(last=False)
+            else:
+                self._deltas.move_to_end(key)
+
+        if owner:
+            try:
+                future.set_result(
+                    datasynch.delta_to_json(
+                        datasynch.export_delta(since_revision)
+                    )
+                )
+            except Exception as e:
+                with self._lock:
+                    self._deltas.pop(key, None)
+                future.set_exception(e)
+        return future.result()
+
+    def pull(self, node_device):
+        """Queue a request for node_device's delta. The future's result
+        is the delta as JSON.
+        """
+        return self._submit(
+            node_device, self.get_delta, node_device.synced_revision
+        )
+
+    def acknowledge(self, node_device, revision):
+        datasynch.acknowledge_delta(node_device, revision)
+
+    def _ingest(self, node_device, records):
+        keys = sorted(
+            {
+                _session_lock_key(record)
+                for record in records
+                if record["model"] == SESSION_MODEL
+            },
+            key=repr,
+        )
+        with self._lock:
+            entries = []
+            for key in keys:
+                entry = self._session_locks.setdefault(
+                    key, [threading.Lock(), 0]
+                )
+                entry[1] += 1
+                entries.append(entry)
+        # locks are always taken in the same order, so uploads can't
+        # deadlock each other
+        for lock, _ in entries:
+            lock.acquire()
+        try:
+            return ingest_node_dump(records, node_device)
+        finally:
+            with self._lock:
+                for key, entry in zip(keys, entries):
+                    entry[0].release()
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._session_locks[key]
+
+    def push(self, node_device, records):
+        """Queue the ingestion of a node dump (a list of records). The
+        future's result is the ingest report.
+        """
+        return self._submit(
+            node_device, self._ingest, node_device, list(records)
+        )
+
+    def stats(self):
+        """Queue depth and latency (seconds, from submission to
+        completion) of the recent requests of every node
+        """
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "cached_deltas": len(self._deltas),
+                "nodes": {
+                    node_id: {
+                        "requests": len(samples),
+                        "last": samples[-1],
+                        "mean": sum(samples) / len(samples),
+                        "max": max(samples),
+                    }
+                    for node_id, samples in self._latencies.items()
+                    if samples
+                },
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
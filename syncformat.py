@@ -0,0 +1,178 @@
+"""
+Compact sync dump format.
+
+A compact dump is a header followed by compressed blocks:
+
+    header: MAGIC, format version (1 byte), codec (1 byte)
+    block:  compressed length (uint32), crc32 of compressed bytes (uint32),
+            compressed JSON payload
+
+Each payload holds up to BLOCK_SIZE records of one model in columnar
+form, so field names are written once per block instead of once per row:
+
+    {"model": "db.student", "pk": [...], "columns": {"first_name": [...]}}
+
+Binary fields derived from text fields of the same record (see
+models.BINARY_FIELDS: the float32 face_encodings_bin and the decoded
+fingerprint_template_bin) are left out and rebuilt from the text when
+the dump is read, so the text reaches nodes exactly as the server stores
+it. Blocks are compressed with zstd when the zstandard package is
+installed and with gzip otherwise.
+"""
+import base64
+import gzip
+import json
+import struct
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import BINARY_FIELDS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"TAMSDUMP"
+FORMAT_VERSION = 2
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+BLOCK_SIZE = 2000
+
+_HEADER = struct.Struct("!%dsBB" % len(MAGIC))
+_BLOCK_HEADER = struct.Struct("!II")
+
+
+class DumpFormatError(ValueError):
+    pass
+
+
+def default_codec():
+    return CODEC_ZSTD if zstandard is not None else CODEC_GZIP
+
+
+def _compress(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise DumpFormatError(
+                "Dump is zstd compressed but zstandard is not installed"
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def is_compact_dump(file_path):
+    with open(file_path, "rb") as dump_file:
+        return dump_file.read(len(MAGIC)) == MAGIC
+
+
+def _encode_block(records):
+    field_names = list(records[0]["fields"])
+    columns = {name: [] for name in field_names}
+    for record in records:
+        fields = record["fields"]
+        for name in field_names:
+            columns[name].append(fields.get(name))
+
+    for binary_field, (_, sources) in BINARY_FIELDS.items():
+        if binary_field in columns and all(
+            name in columns for name in sources
+        ):
+            del columns[binary_field]
+
+    return {
+        "model": records[0]["model"],
+        "pk": [record["pk"] for record in records],
+        "columns": columns,
+    }
+
+
+def _rebuild_binary(convert, *values):
+    binary_value = convert(*values)
+    if binary_value is None:
+        return None
+    # as the serializers write binary fields
+    return base64.b64encode(binary_value).decode("ascii")
+
+
+def _decode_block(block):
+    columns = block["columns"]
+    for binary_field, (convert, sources) in BINARY_FIELDS.items():
+        if binary_field not in columns and all(
+            name in columns for name in sources
+        ):
+            columns[binary_field] = [
+                _rebuild_binary(convert, *values)
+                for values in zip(*(columns[name] for name in sources))
+            ]
+
+    field_names = list(columns)
+    for idx, pk in enumerate(block["pk"]):
+        yield {
+            "model": block["model"],
+            "pk": pk,
+            "fields": {name: columns[name][idx] for name in field_names},
+        }
+
+
+def write_compact(records, dump_file, codec=None, block_size=BLOCK_SIZE):
+    """Write records to the binary file object dump_file"""
+    codec = codec or default_codec()
+    dump_file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, codec))
+
+    def write_block(block_records):
+        payload = json.dumps(
+            _encode_block(block_records),
+            cls=DjangoJSONEncoder,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        compressed = _compress(payload, codec)
+        dump_file.write(
+            _BLOCK_HEADER.pack(len(compressed), zlib.crc32(compressed))
+        )
+        dump_file.write(compressed)
+
+    block_records = []
+    for record in records:
+        if block_records and (
+            len(block_records) == block_size
+            or record["model"] != block_records[0]["model"]
+        ):
+            write_block(block_records)
+            block_records = []
+        block_records.append(record)
+    if block_records:
+        write_block(block_records)
+
+
+def iter_compact(dump_file):
+    """Read the records of a compact dump from the binary file object
+    dump_file one block at a time
+    """
+    header = dump_file.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise DumpFormatError("Truncated dump header")
+    magic, version, codec = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise DumpFormatError("Not a compact dump")
+    if version != FORMAT_VERSION:
+        raise DumpFormatError("Unsupported dump format version %d" % version)
+
+    while True:
+        block_header = dump_file.read(_BLOCK_HEADER.size)
+        if not block_header:
+            return
+        if len(block_header) != _BLOCK_HEADER.size:
+            raise DumpFormatError("Truncated block header")
+        length, checksum = _BLOCK_HEADER.unpack(block_header)
+        compressed = dump_file.read(length)
+        if len(compressed) != length or zlib.crc32(compressed) != checksum:
+            raise DumpFormatError("Corrupt dump block")
+        yield from _decode_block(json.loads(_decompress(compressed, codec)))
@@ -1,9 +1,26 @@
-from datetime import timedelta
+import base64
+from datetime import datetime, timedelta
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
 
-from django.test import TestCase
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_save
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.db.utils import IntegrityError
 from django.utils import timezone
-from django.core.exceptions import ValidationError
+from django.core.exceptions import (
+    ImproperlyConfigured,
+    PermissionDenied,
+    ValidationError,
+)
 
 # from manage import django_setup
 
@@ -20,11 +37,44 @@ from .models import (
     AcademicSession,
     AttendanceRecord,
     AttendanceSession,
+    AttendanceSessionSummary,
+    CourseAttendanceSummary,
     CourseRegistration,
     SexChoices,
     EventTypeChoices,
     RecordTypesChoices,
+    AttendanceSessionStatusChoices,
+    FingerprintEncodingChoices,
+    NodeDevice,
+    SyncState,
+    SyncTombstone,
+    face_enc_to_str,
+    bytes_to_face_enc,
+    fingerprint_template_to_bytes,
+)
+from . import (
+    activesessions,
+    benchmarks,
+    checkin,
+    checkinbuffer,
+    datasynch,
+    face_index,
+    faces,
+    fingerprints,
+    ingest,
+    instrumentation,
+    onboarding,
+    recurrence,
+    refcache,
+    registration,
+    reports,
+    sessionids,
+    summaries,
+    synccoordinator,
+    syncformat,
+    validators,
 )
+from .faces import FaceGallery
 
 
 class SemesterTestCase(TestCase):
@@ -236,6 +286,79 @@ class CourseTestCase(TestCase):
         )
 
 
+class CourseCatalogueTestCase(TestCase):
+    def setUp(self):
+        engineering = Faculty.objects.create(name="Engineering")
+        science = Faculty.objects.create(name="Science")
+        self.ece = Department.objects.create(
+            name="Electronic Engineering", alias="ECE", faculty=engineering
+        )
+        physics = Department.objects.create(name="Physics", faculty=science)
+        self.courses = Course.objects.bulk_create(
+            Course(
+                code="%s %d01" % (alias, level),
+                title="Course %d" % level,
+                level_of_study=level,
+                department=department,
+                unit_load=3,
+                semester=SemesterChoices.values[level % 2],
+            )
+            for alias, department in (("ECE", self.ece), ("PHY", physics))
+            for level in range(1, 5)
+        )
+        Course.objects.filter(code="ECE 401").update(is_active=False)
+
+    def test_single_query(self):
+        # names are resolved when the queryset is built
+        catalogue = Course.catalogue(
+            faculty="engineering", semester="Second", level_of_study="3"
+        )
+        self.assertNotIn("JOIN", str(catalogue.query))
+        with self.assertNumQueries(1):
+            rows = list(catalogue)
+        (course,) = [c for c in self.courses if c.code == "ECE 301"]
+        self.assertEqual(rows, [(course.id, "ECE 301", "Course 3")])
+
+    def test_matches_get_courses(self):
+        for filters in (
+            {},
+            {"department": "Physics"},
+            {"faculty": "Engineering", "semester": "Second"},
+            {"level_of_study": 2},
+        ):
+            self.assertEqual(
+                Course.get_courses(**filters),
+                [
+                    Course.course_label(code, title)
+                    for code, title in Course.catalogue(
+                        fields=("code", "title"), **filters
+                    )
+                ],
+            )
+
+    def test_pages(self):
+        self.assertEqual(
+            Course.catalogue_page(1, page_size=3, render=True),
+            ["ECE 101 : Course 1", "ECE 201 : Course 2", "ECE 301 : Course 3"],
+        )
+        self.assertEqual(
+            [code for _, code, _ in Course.catalogue_page(3, page_size=3)],
+            ["PHY 401"],
+        )
+        self.assertEqual(Course.catalogue_page(4, page_size=3), [])
+        with self.assertRaises(ValueError):
+            Course.catalogue_page(0)
+
+    def test_streaming(self):
+        streamed = Course.catalogue(department=self.ece.name).iterator(
+            chunk_size=2
+        )
+        self.assertEqual(
+            [code for _, code, _ in streamed],
+            ["ECE 101", "ECE 201", "ECE 301"],
+        )
+
+
 class AcademicSessionTestCase(TestCase):
     def setUp(self):
         AcademicSession.objects.create(
@@ -501,3 +624,2329 @@ class CourseRegistrationTestCase(TestCase):
         self.assertRaises(
             ValidationError, CourseRegistration.objects.create, **reg_details
         )
+
+
+class FaceEncodingDataMixin:
+    """Three students with random encodings, two of them registered
+    for one course
+    """
+
+    def setUp(self):
+        faculty_obj = Faculty.objects.create(name="Engineering")
+        self.dept_obj = Department.objects.create(
+            name="Electronic Engineering", alias="ECE", faculty=faculty_obj
+        )
+        self.acad_session = AcademicSession.objects.create(
+            session="2020/2021", is_current_session=True
+        )
+        self.course_obj = Course.objects.create(
+            code="ECE 272",
+            title="Introduction to Engineering Programming",
+            level_of_study=2,
+            department=self.dept_obj,
+            unit_load=3,
+            semester=SemesterChoices.SECOND,
+        )
+        rng = np.random.default_rng(0)
+        self.encodings = {}
+        for idx in range(3):
+            reg_number = "2001/12345%d" % idx
+            self.encodings[reg_number] = rng.uniform(-0.3, 0.3, 128)
+            student_obj = Student.objects.create(
+                reg_number=reg_number,
+                first_name="Chudi",
+                last_name="Gambo",
+                possible_grad_yr=2022,
+                level_of_study=2,
+                department=self.dept_obj,
+                sex=SexChoices.MALE,
+                face_encodings=face_enc_to_str(self.encodings[reg_number]),
+            )
+            if idx < 2:
+                CourseRegistration.objects.create(
+                    session=self.acad_session,
+                    semester=SemesterChoices.SECOND,
+                    course=self.course_obj,
+                    student=student_obj,
+                )
+
+
+class FaceGalleryTestCase(FaceEncodingDataMixin, TestCase):
+    def test_binary_encoding_saved(self):
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        np.testing.assert_allclose(
+            bytes_to_face_enc(student_obj.face_encodings_bin),
+            self.encodings["2001/123450"],
+            rtol=1e-6,
+        )
+
+    def test_invalid_encoding_not_stored(self):
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.face_encodings = "XXXXXXXXX"
+        student_obj.save()
+        self.assertIsNone(student_obj.face_encodings_bin)
+
+    def test_binary_encoding_saved_with_update_fields(self):
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.face_encodings = face_enc_to_str(
+            self.encodings["2001/123451"]
+        )
+        student_obj.save(update_fields=["face_encodings"])
+        student_obj.refresh_from_db()
+        np.testing.assert_allclose(
+            bytes_to_face_enc(student_obj.face_encodings_bin),
+            self.encodings["2001/123451"],
+            rtol=1e-6,
+        )
+
+    def test_binary_encoding_saved_with_queryset_update(self):
+        Student.objects.filter(reg_number="2001/123450").update(
+            face_encodings=face_enc_to_str(self.encodings["2001/123451"])
+        )
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        np.testing.assert_allclose(
+            bytes_to_face_enc(student_obj.face_encodings_bin),
+            self.encodings["2001/123451"],
+            rtol=1e-6,
+        )
+        with self.assertRaises(ValueError):
+            Student.objects.update(face_encodings=F("last_name"))
+
+    def test_course_gallery_best_match(self):
+        gallery = FaceGallery.for_course(self.course_obj, self.acad_session)
+        self.assertEqual(len(gallery), 2)
+        self.assertNotIn("2001/123452", gallery)
+
+        match = gallery.best_match(self.encodings["2001/123451"] + 0.01)
+        self.assertEqual(match.label, "2001/123451")
+        self.assertAlmostEqual(match.distance, np.sqrt(128) * 0.01, places=4)
+        self.assertIsNone(gallery.best_match(self.encodings["2001/123452"]))
+
+    def test_department_gallery_distances(self):
+        gallery = FaceGallery.for_department(self.dept_obj)
+        probe = self.encodings["2001/123452"]
+        expected = [
+            np.linalg.norm(self.encodings[label] - probe)
+            for label in gallery.labels
+        ]
+        np.testing.assert_allclose(
+            gallery.distances(probe), expected, atol=1e-4
+        )
+
+
+class FaceGalleryCacheTestCase(FaceEncodingDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        faces.clear_gallery_cache()
+        self.addCleanup(faces.clear_gallery_cache)
+
+    def test_cached_gallery_reused(self):
+        gallery = faces.get_course_gallery(
+            self.course_obj.id, self.acad_session.id
+        )
+        with self.assertNumQueries(0):
+            cached = faces.get_course_gallery(
+                self.course_obj.id, self.acad_session.id
+            )
+        self.assertIs(gallery, cached)
+
+    def test_encoding_change_invalidates(self):
+        gallery = faces.get_course_gallery(self.course_obj.id)
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.face_encodings = face_enc_to_str(np.zeros(128))
+        with self.captureOnCommitCallbacks(execute=True):
+            student_obj.save()
+        refreshed = faces.get_course_gallery(self.course_obj.id)
+        self.assertIsNot(gallery, refreshed)
+        self.assertFalse(refreshed.encoding("2001/123450").any())
+
+    def test_unrelated_save_keeps_cache(self):
+        gallery = faces.get_course_gallery(self.course_obj.id)
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.first_name = "Musa"
+        with self.captureOnCommitCallbacks(execute=True):
+            student_obj.save()
+        self.assertIs(gallery, faces.get_course_gallery(self.course_obj.id))
+
+    def test_registration_invalidates(self):
+        gallery = faces.get_course_gallery(
+            self.course_obj.id, self.acad_session.id
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            CourseRegistration.objects.create(
+                session=self.acad_session,
+                semester=SemesterChoices.SECOND,
+                course=self.course_obj,
+                student=Student.objects.get(reg_number="2001/123452"),
+            )
+        refreshed = faces.get_course_gallery(
+            self.course_obj.id, self.acad_session.id
+        )
+        self.assertEqual(len(gallery), 2)
+        self.assertIn("2001/123452", refreshed)
+
+
+class IVFFaceIndexTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.matrix = rng.normal(size=(400, 128)).astype(np.float32)
+        self.labels = ["2001/%06d" % idx for idx in range(400)]
+        self.index = face_index.IVFFaceIndex.build(
+            self.labels, self.matrix, n_lists=8
+        )
+
+    def test_exhaustive_search_is_exact(self):
+        probe = self.matrix[17] + 0.01
+        matches = self.index.search(probe, k=3, n_probe=8)
+        expected = np.argsort(np.linalg.norm(self.matrix - probe, axis=1))
+        self.assertEqual(
+            [match.label for match in matches],
+            [self.labels[idx] for idx in expected[:3]],
+        )
+
+    def test_incremental_update(self):
+        new_encoding = np.full(128, 5, dtype=np.float32)
+        self.index.add(self.labels[0], new_encoding)
+        self.assertEqual(len(self.index), 400)
+        match = self.index.best_match(new_encoding, n_probe=1)
+        self.assertEqual(match.label, self.labels[0])
+
+        self.index.remove(self.labels[0])
+        self.assertNotIn(self.labels[0], self.index)
+        self.assertIsNone(self.index.best_match(new_encoding, n_probe=8))
+
+    def test_unchanged_encoding_skipped(self):
+        self.assertEqual(self.index.add(self.labels[0], self.matrix[0]), 0)
+        self.assertEqual(self.index._size, 400)
+        self.assertEqual(
+            self.index.add_many(self.labels[:2], self.matrix[1::-1]), 2
+        )
+        self.assertEqual(self.index._size, 402)
+
+    def test_removed_rows_compacted(self):
+        rng = np.random.default_rng(2)
+        for idx in range(1000):
+            label = self.labels[idx % 100]
+            self.index.add(label, rng.normal(size=128))
+        self.assertEqual(len(self.index), 400)
+        self.assertLessEqual(self.index._size, 800)
+        self.assertEqual(
+            self.index.best_match(self.matrix[150], n_probe=8).label,
+            self.labels[150],
+        )
+        encoding = np.full(128, 5, dtype=np.float32)
+        self.index.add(self.labels[7], encoding)
+        self.assertEqual(
+            self.index.best_match(encoding, n_probe=8).label, self.labels[7]
+        )
+
+    def test_save_and_load(self):
+        self.index.remove(self.labels[1])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index.npz")
+            self.index.save(path)
+            loaded = face_index.IVFFaceIndex.load(path)
+        self.assertEqual(len(loaded), 399)
+        self.assertNotIn(self.labels[1], loaded)
+        self.assertEqual(
+            loaded.best_match(self.matrix[5], n_probe=2).label,
+            self.labels[5],
+        )
+
+
+@override_settings(TAMS_FACE_INDEX_ENABLED=True, TAMS_FACE_INDEX_PATH="")
+class InstitutionFaceIndexTestCase(FaceEncodingDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        face_index.rebuild_institution_index()
+        self.addCleanup(setattr, face_index, "_institution_index", None)
+
+    def test_find_student(self):
+        match = face_index.find_student(self.encodings["2001/123452"])
+        self.assertEqual(match.label, "2001/123452")
+
+    def test_encoding_change_updates_index(self):
+        student_obj = Student.objects.get(reg_number="2001/123452")
+        student_obj.face_encodings = face_enc_to_str(np.ones(128))
+        with self.captureOnCommitCallbacks(execute=True):
+            student_obj.save()
+        self.assertIsNone(
+            face_index.find_student(self.encodings["2001/123452"])
+        )
+        match = face_index.find_student(np.ones(128))
+        self.assertEqual(match.label, "2001/123452")
+
+    def test_unchanged_encoding_not_reindexed(self):
+        index = face_index.get_institution_index()
+        size = index._size
+        student_obj = Student.objects.get(reg_number="2001/123452")
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                student_obj.save()
+        self.assertEqual(index._size, size)
+        self.assertEqual(face_index._pending_updates, 0)
+
+
+class DeltaSyncTestCase(TestCase):
+    def setUp(self):
+        self.faculty_obj = Faculty.objects.create(name="Engineering")
+        self.dept_obj = Department.objects.create(
+            name="Electronic Engineering",
+            alias="ECE",
+            faculty=self.faculty_obj,
+        )
+        self.node = NodeDevice.objects.create()
+
+    def test_save_stamps_revision(self):
+        self.assertGreater(self.dept_obj.revision, self.faculty_obj.revision)
+        self.assertEqual(
+            SyncState.get_value(SyncState.REVISION), self.dept_obj.revision
+        )
+
+    def test_delta_only_contains_changes(self):
+        full = datasynch.export_node_delta(self.node)
+        self.assertEqual(
+            {record["model"] for record in full["records"]},
+            {"db.faculty", "db.department"},
+        )
+        datasynch.acknowledge_delta(self.node, full["revision"])
+
+        self.dept_obj.alias = "EEE"
+        self.dept_obj.save()
+        delta = datasynch.export_node_delta(self.node)
+        self.assertEqual(len(delta["records"]), 1)
+        self.assertEqual(delta["records"][0]["fields"]["alias"], "EEE")
+        self.assertEqual(delta["deleted"], [])
+
+        datasynch.acknowledge_delta(self.node, delta["revision"])
+        dept_pk = self.dept_obj.pk
+        self.dept_obj.delete()
+        delta = datasynch.export_node_delta(self.node)
+        self.assertEqual(delta["records"], [])
+        self.assertEqual(
+            delta["deleted"],
+            [{"model": "db.department", "pk": str(dept_pk)}],
+        )
+
+    def test_update_stamps_revision(self):
+        Department.objects.filter(pk=self.dept_obj.pk).update(alias="EEE")
+        self.dept_obj.refresh_from_db()
+        self.assertEqual(
+            SyncState.get_value(SyncState.REVISION), self.dept_obj.revision
+        )
+        self.assertGreater(self.dept_obj.revision, self.faculty_obj.revision)
+
+    def test_update_fields_stamps_revision(self):
+        self.dept_obj.alias = "EEE"
+        self.dept_obj.save(update_fields=["alias"])
+        revision = SyncState.get_value(SyncState.REVISION)
+        self.assertEqual(self.dept_obj.revision, revision)
+        self.dept_obj.refresh_from_db()
+        self.assertEqual(self.dept_obj.revision, revision)
+
+    def test_cascade_tombstones(self):
+        Department.objects.create(
+            name="Civil Engineering", alias="CVE", faculty=self.faculty_obj
+        )
+        revision = SyncState.get_value(SyncState.REVISION)
+        self.faculty_obj.delete()
+        self.assertEqual(
+            sorted(SyncTombstone.objects.values_list("model", "revision")),
+            [
+                ("db.department", revision + 1),
+                ("db.department", revision + 1),
+                ("db.faculty", revision + 1),
+            ],
+        )
+        # untracked models keep Django's fast delete
+        self.assertFalse(post_delete.has_listeners(NodeDevice))
+        self.assertFalse(pre_save.has_listeners(NodeDevice))
+
+    def test_import_delta(self):
+        delta = datasynch.delta_to_json(datasynch.export_delta())
+        Department.objects.all().delete()
+        Faculty.objects.all().delete()
+
+        revision = datasynch.import_delta(delta)
+        self.assertEqual(Department.objects.get().alias, "ECE")
+        self.assertEqual(
+            SyncState.get_value(SyncState.SYNCED_REVISION), revision
+        )
+
+
+class RevisionTransactionTestCase(TransactionTestCase):
+    def test_revision_reserved_with_the_row(self):
+        faculty_obj = Faculty.objects.create(name="Engineering")
+        revision = SyncState.get_value(SyncState.REVISION)
+        with self.assertRaises(IntegrityError):
+            Faculty.objects.create(name="Engineering")
+        # the failed write took its revision with it
+        self.assertEqual(SyncState.get_value(SyncState.REVISION), revision)
+        self.assertEqual(faculty_obj.revision, revision)
+
+
+class ServerDataMixin:
+    """A small but complete set of server models"""
+
+    def setUp(self):
+        self.title_obj = StaffTitle.objects.create(
+            title="Dr", title_full="Doctor"
+        )
+        self.faculty_obj = Faculty.objects.create(name="Engineering")
+        self.dept_obj = Department.objects.create(
+            name="Electronic Engineering",
+            alias="ECE",
+            faculty=self.faculty_obj,
+        )
+        self.staff_obj = Staff.objects.create_user(
+            username="Danladi",
+            first_name="John",
+            last_name="Doe",
+            email="example@example.com",
+            staff_number="SS.123654",
+            department=self.dept_obj,
+            sex=SexChoices.MALE,
+        )
+        self.staff_obj.staff_titles.add(self.title_obj)
+        self.acad_session = AcademicSession.objects.create(
+            session="2020/2021", is_current_session=True
+        )
+        self.course_obj = Course.objects.create(
+            code="ECE 272",
+            title="Introduction to Engineering Programming",
+            level_of_study=2,
+            department=self.dept_obj,
+            unit_load=3,
+            semester=SemesterChoices.SECOND,
+        )
+        for idx in range(5):
+            student_obj = Student.objects.create(
+                reg_number="2001/12345%d" % idx,
+                first_name="Chudi",
+                last_name="Gambo",
+                possible_grad_yr=2022,
+                level_of_study=2,
+                department=self.dept_obj,
+                sex=SexChoices.MALE,
+            )
+            CourseRegistration.objects.create(
+                session=self.acad_session,
+                semester=SemesterChoices.SECOND,
+                course=self.course_obj,
+                student=student_obj,
+            )
+
+
+class BulkLoadTestCase(ServerDataMixin, TestCase):
+    def test_sort_models(self):
+        ordered = datasynch.sort_models(
+            [CourseRegistration, Staff, Student, Faculty, Department]
+        )
+        self.assertEqual(
+            ordered, [Faculty, Department, Staff, Student, CourseRegistration]
+        )
+
+    def test_reload_dump(self):
+        records = datasynch.export_delta()["records"]
+        CourseRegistration.objects.all().delete()
+        Student.objects.all().delete()
+        Staff.objects.all().delete()
+        Course.objects.all().delete()
+
+        report = datasynch.bulk_load(reversed(records), batch_size=2)
+        self.assertEqual(report["db.student"]["created"], 5)
+        self.assertEqual(report["db.courseregistration"]["created"], 5)
+        self.assertEqual(report["db.faculty"]["updated"], 1)
+        self.assertEqual(list(datasynch.bulk_load(records)), list(report))
+
+        staff_obj = Staff.objects.get(staff_number="SS.123654")
+        self.assertEqual(staff_obj.department, self.dept_obj)
+        self.assertEqual(list(staff_obj.staff_titles.all()), [self.title_obj])
+        self.assertEqual(
+            CourseRegistration.objects.filter(course__code="ECE 272").count(),
+            5,
+        )
+
+
+class StreamingDumpTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = mock.patch.object(datasynch, "DUMP_DIR", tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dump_is_one_record_per_line(self):
+        dump_file = datasynch.write_dump(
+            chunk_size=2, dump_format=datasynch.JSON_FORMAT
+        )
+        with open(dump_file) as dump:
+            lines = dump.read().splitlines()
+        self.assertEqual(lines[0], "[")
+        self.assertEqual(lines[-1], "]")
+        # the whole file is still a valid JSON (loaddata) fixture
+        with open(dump_file) as dump:
+            self.assertEqual(len(json.load(dump)), len(lines) - 2)
+
+        records = list(datasynch.get_dump())
+        self.assertEqual(len(records), len(lines) - 2)
+        self.assertEqual(records[0]["model"], "db.stafftitle")
+        staff_record = next(
+            record for record in records if record["model"] == "db.staff"
+        )
+        self.assertEqual(
+            staff_record["fields"]["staff_titles"], [self.title_obj.pk]
+        )
+
+    def test_json_by_default(self):
+        self.assertTrue(datasynch.write_dump().endswith(".json"))
+
+    def test_save_dumped_data(self):
+        data = datasynch.dump_data()
+        self.assertIsInstance(data, str)
+        datasynch.save_dump(data, dump_format=datasynch.JSON_FORMAT)
+        self.assertEqual(datasynch.get_dump(), json.loads(data))
+
+    def test_dump_and_load(self):
+        datasynch.write_dump()
+        Student.objects.all().delete()
+
+        report = datasynch.load_data(to_server=False)
+        self.assertEqual(report["db.student"]["created"], 5)
+        self.assertEqual(Student.objects.count(), 5)
+
+    def test_read_indented_dump(self):
+        records = datasynch.export_delta()["records"]
+        with open(
+            datasynch.get_dump_path(dump_format=datasynch.JSON_FORMAT), "w"
+        ) as dump:
+            dump.write(datasynch.delta_to_json(records))
+        self.assertEqual(len(list(datasynch.get_dump())), len(records))
+
+        with open(
+            datasynch.get_dump_path(dump_format=datasynch.JSON_FORMAT), "w"
+        ) as dump:
+            json.dump(
+                json.loads(datasynch.delta_to_json(records)), dump, indent=4
+            )
+        self.assertEqual(len(list(datasynch.get_dump())), len(records))
+
+
+class CompactDumpTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = mock.patch.object(datasynch, "DUMP_DIR", tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.encoding = np.random.default_rng(2).uniform(-0.3, 0.3, 128)
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.face_encodings = face_enc_to_str(self.encoding)
+        student_obj.fingerprint_template = base64.b64encode(
+            bytes(range(64))
+        ).decode()
+        student_obj.fingerprint_template_encoding = (
+            FingerprintEncodingChoices.BASE64
+        )
+        student_obj.save()
+
+    def test_round_trip(self):
+        json_records = list(
+            datasynch.iter_model_records(datasynch.SERVER_DUMP)
+        )
+        dump_file = datasynch.write_dump(dump_format=datasynch.COMPACT_FORMAT)
+        self.assertTrue(dump_file.endswith(".tams"))
+        records = list(datasynch.get_dump())
+        self.assertEqual(
+            [(record["model"], record["pk"]) for record in records],
+            [(record["model"], record["pk"]) for record in json_records],
+        )
+
+        student_record = next(
+            record for record in records if record["pk"] == "2001/123450"
+        )
+        json_student_record = next(
+            record for record in json_records if record["pk"] == "2001/123450"
+        )
+        # the text is shipped as stored and the bytes rebuilt from it
+        self.assertEqual(student_record, json_student_record)
+
+    def test_derived_columns_left_out(self):
+        dump = io.BytesIO()
+        syncformat.write_compact(
+            datasynch.iter_model_records(["Student"]),
+            dump,
+            codec=syncformat.CODEC_GZIP,
+        )
+        block = dump.getvalue()[
+            syncformat._HEADER.size + syncformat._BLOCK_HEADER.size :
+        ]
+        columns = json.loads(gzip.decompress(block))["columns"]
+        self.assertIn("face_encodings", columns)
+        self.assertIn("fingerprint_template", columns)
+        self.assertNotIn("face_encodings_bin", columns)
+        self.assertNotIn("fingerprint_template_bin", columns)
+
+    def test_unsupported_version(self):
+        dump = io.BytesIO(
+            syncformat._HEADER.pack(syncformat.MAGIC, 1, syncformat.CODEC_GZIP)
+        )
+        with self.assertRaises(syncformat.DumpFormatError):
+            list(syncformat.iter_compact(dump))
+
+    def test_smaller_than_json(self):
+        compact_file = datasynch.write_dump(
+            dump_format=datasynch.COMPACT_FORMAT
+        )
+        compact_size = os.path.getsize(compact_file)
+        json_file = datasynch.write_dump(dump_format=datasynch.JSON_FORMAT)
+        self.assertLess(compact_size, os.path.getsize(json_file) / 2)
+        # saving in one format removes the stale dump in the other
+        self.assertFalse(os.path.exists(compact_file))
+
+    def test_load_compact_dump(self):
+        datasynch.write_dump(dump_format=datasynch.COMPACT_FORMAT)
+        Student.objects.all().delete()
+        report = datasynch.load_data(to_server=False)
+        self.assertEqual(report["db.student"]["created"], 5)
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        np.testing.assert_allclose(
+            bytes_to_face_enc(student_obj.face_encodings_bin),
+            self.encoding,
+            rtol=1e-6,
+        )
+
+    def test_corrupt_block_detected(self):
+        dump_file = datasynch.write_dump(dump_format=datasynch.COMPACT_FORMAT)
+        with open(dump_file, "r+b") as dump:
+            dump.seek(-5, os.SEEK_END)
+            dump.write(b"xxxxx")
+        with self.assertRaises(syncformat.DumpFormatError):
+            list(datasynch.get_dump())
+
+
+class AttendanceDataMixin(ServerDataMixin):
+    """Two attendance sessions of one node with sign-ins for every
+    registered student
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.node = NodeDevice.objects.create()
+        self.start_time = timezone.now().replace(microsecond=0)
+        self.att_sessions = [
+            AttendanceSession.objects.create(
+                id="node-session-%d" % idx,
+                node_device=self.node,
+                course=self.course_obj,
+                session=self.acad_session,
+                event_type=EventTypeChoices.LECTURE,
+                start_time=self.start_time + timedelta(days=7 * idx),
+                duration=timedelta(hours=2),
+            )
+            for idx in range(2)
+        ]
+        for att_session in self.att_sessions:
+            for student_obj in Student.objects.all():
+                AttendanceRecord.objects.create(
+                    attendance_session=att_session,
+                    student=student_obj,
+                    record_type=RecordTypesChoices.SIGN_IN,
+                )
+
+
+class NodeIngestTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.node_records = list(
+            datasynch.iter_model_records(datasynch.NODE_DUMP)
+        )
+
+    def test_ingest_into_empty_server(self):
+        check_in_by = AttendanceRecord.objects.order_by("pk")[0].check_in_by
+        AttendanceSession.objects.all().delete()
+
+        report = ingest.ingest_node_dump(self.node_records, self.node)
+        self.assertEqual(report["sessions"], {"created": 2})
+        self.assertEqual(report["records"], {"created": 10})
+        self.assertEqual(
+            AttendanceRecord.objects.order_by("pk")[0].check_in_by,
+            check_in_by,
+        )
+
+    def test_reingest_is_idempotent(self):
+        with self.assertNumQueries(8):
+            report = ingest.ingest_node_dump(self.node_records, batch_size=100)
+        self.assertEqual(report["sessions"], {"matched": 2})
+        self.assertEqual(report["records"], {"skipped": 10})
+        self.assertEqual(AttendanceRecord.objects.count(), 10)
+
+    def test_sign_out_updates_existing_row(self):
+        check_out_by = timezone.now().replace(microsecond=0)
+        for record in self.node_records:
+            if record["model"] == "db.attendancerecord":
+                record["pk"] += 1000
+                record["fields"]["record_type"] = RecordTypesChoices.SIGN_OUT
+                record["fields"]["check_out_by"] = check_out_by.isoformat()
+
+        report = ingest.ingest_node_dump(self.node_records)
+        self.assertEqual(report["records"], {"updated": 10})
+        self.assertEqual(
+            AttendanceRecord.objects.filter(
+                record_type=RecordTypesChoices.SIGN_OUT,
+                check_out_by=check_out_by,
+            ).count(),
+            10,
+        )
+
+    def test_colliding_session_id_is_remapped(self):
+        AttendanceRecord.objects.all().delete()
+        AttendanceSession.objects.filter(pk="node-session-0").update(
+            start_time=self.start_time - timedelta(days=1)
+        )
+
+        report = ingest.ingest_node_dump(self.node_records)
+        self.assertEqual(report["sessions"], {"created": 1, "matched": 1})
+        self.assertEqual(AttendanceSession.objects.count(), 3)
+        remapped = AttendanceSession.objects.get(start_time=self.start_time)
+        self.assertNotEqual(remapped.pk, "node-session-0")
+        self.assertEqual(remapped.attendancerecord_set.count(), 5)
+
+    def test_other_node_rejected(self):
+        AttendanceSession.objects.all().delete()
+        report = ingest.ingest_node_dump(
+            self.node_records, NodeDevice.objects.create()
+        )
+        self.assertEqual(report["sessions"], {"rejected": 2})
+        self.assertEqual(report["records"], {"rejected": 10})
+
+    def test_other_node_rejected_with_server_sessions(self):
+        # the server already holds the sessions under the same ids; the
+        # other node's records must not be mapped onto them
+        report = ingest.ingest_node_dump(
+            self.node_records, NodeDevice.objects.create()
+        )
+        self.assertEqual(report["sessions"], {"rejected": 2})
+        self.assertEqual(report["records"], {"rejected": 10})
+        self.assertEqual(AttendanceRecord.objects.count(), 10)
+
+
+class SyncCoordinatorTestCase(AttendanceDataMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.coordinator = synccoordinator.SyncCoordinator(max_workers=4)
+        self.addCleanup(self.coordinator.shutdown)
+
+    def test_delta_generated_once_per_revision(self):
+        nodes = [NodeDevice.objects.create() for _ in range(6)]
+        with mock.patch.object(
+            datasynch, "export_delta", wraps=datasynch.export_delta
+        ) as export_delta:
+            futures = [self.coordinator.pull(node) for node in nodes]
+            deltas = {future.result() for future in futures}
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(export_delta.call_count, 1)
+
+        stats = self.coordinator.stats()
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["cached_deltas"], 1)
+        self.assertEqual(
+            {node_id for node_id in stats["nodes"]},
+            {node.pk for node in nodes},
+        )
+
+        self.coordinator.acknowledge(
+            nodes[0], json.loads(deltas.pop())["revision"]
+        )
+        delta = json.loads(self.coordinator.pull(nodes[0]).result())
+        self.assertEqual(delta["records"], [])
+
+    def test_concurrent_uploads_of_same_session(self):
+        node_records = list(datasynch.iter_model_records(datasynch.NODE_DUMP))
+        AttendanceSession.objects.all().delete()
+        futures = [
+            self.coordinator.push(self.node, node_records) for _ in range(4)
+        ]
+        reports = [future.result() for future in futures]
+        self.assertEqual(
+            sum(report["sessions"].get("created", 0) for report in reports),
+            2,
+        )
+        self.assertEqual(AttendanceRecord.objects.count(), 10)
+        self.assertEqual(self.coordinator._session_locks, {})
+
+
+class BulkRegistrationTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        CourseRegistration.objects.all().delete()
+        Course.objects.create(
+            code="ECE 281",
+            title="Engineering Mathematics",
+            level_of_study=2,
+            department=self.dept_obj,
+            unit_load=3,
+            semester=SemesterChoices.FIRST,
+        )
+
+    def test_bulk_register(self):
+        rows = [
+            ("2001/123450", "ECE 272", "2020/2021", "Second"),
+            ("2001/123451", "ece 272", "2020/2021", 2),
+            ("2001/123451", "ECE 272", "2020/2021", "SECOND"),
+            ("2001/123452", "ECE 281", "2020/2021", "First"),
+            ("2001/123453", "ECE 281", "2020/2021", "Second"),
+            ("2001/999999", "ECE 272", "2020/2021", "Second"),
+            ("2001/123454", "ECE 999", "2020/2021", "Second"),
+            ("2001/123454", "ECE 272", "2021/2022", "Second"),
+        ]
+        # 4 lookups, 2 to stamp the revision, 1 insert and savepoints
+        with self.assertNumQueries(11):
+            report = registration.bulk_register(rows)
+
+        self.assertEqual(report["created"], 3)
+        self.assertEqual(
+            report["errors"],
+            [
+                {"row": 2, "error": "Student is already registered"},
+                {
+                    "row": 4,
+                    "error": "Course is not offered in selected semester",
+                },
+                {"row": 5, "error": "Unknown student"},
+                {"row": 6, "error": "Unknown course"},
+                {"row": 7, "error": "Unknown academic session"},
+            ],
+        )
+        registrations = CourseRegistration.objects.all()
+        self.assertEqual(registrations.count(), 3)
+        self.assertEqual(
+            {obj.revision for obj in registrations},
+            {SyncState.get_value(SyncState.REVISION)},
+        )
+
+    def test_existing_registration_rejected(self):
+        registration.bulk_register(
+            [("2001/123450", "ECE 272", "2020/2021", "Second")]
+        )
+        report = registration.bulk_register(
+            [("2001/123450", "ECE 272", "2020/2021", "Second")]
+        )
+        self.assertEqual(report["created"], 0)
+        self.assertEqual(
+            report["errors"],
+            [{"row": 0, "error": "Student is already registered"}],
+        )
+
+
+class OnboardingTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+    def write_csv(self, name, content):
+        file_path = os.path.join(self.tmp_dir, name)
+        with open(file_path, "w") as csv_file:
+            csv_file.write(content)
+        return file_path
+
+    def test_onboard_students(self):
+        encoding = np.random.default_rng(3).uniform(-0.3, 0.3, 128)
+        csv_file = self.write_csv(
+            "students.csv",
+            "Reg_Number,First_Name,Last_Name,Department,Sex,"
+            "Possible_Grad_Yr,Level_Of_Study,Face_Encodings\n"
+            '2021/000001,Ada,Obi,ECE,Female,2026,1,"%s"\n'
+            "2021/000002,Musa,Bello,electronic engineering,MALE,2026,,\n"
+            "2021-000003,Bad,Number,ECE,Male,2026,1,\n"
+            "2021/000004,Ngozi,Eze,Civil,Female,2026,1,\n"
+            "2021/000005,Tunde,Ade,ECE,Unknown,2026,1,\n"
+            "2021/000001,Ada,Obi,ECE,Female,2026,1,\n"
+            "2001/123450,Chudi,Gambo,ECE,Male,2022,2,\n"
+            "2021/000006,,Ade,ECE,Male,2026,1,\n"
+            "2021/000007,Sani,Ali,ECE,Male,soon,1,\n"
+            % face_enc_to_str(encoding),
+        )
+        report = onboarding.onboard_students(csv_file, chunk_size=4)
+
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(
+            report["errors"],
+            [
+                {
+                    "row": 2,
+                    "error": "Invalid student registration number provided",
+                },
+                {"row": 3, "error": "Unknown department"},
+                {"row": 4, "error": "Invalid sex"},
+                {"row": 5, "error": "Student already exists"},
+                {"row": 6, "error": "Student already exists"},
+                {"row": 7, "error": "Missing name"},
+                {"row": 8, "error": "Invalid graduation year"},
+            ],
+        )
+        student_obj = Student.objects.get(reg_number="2021/000001")
+        self.assertEqual(student_obj.department, self.dept_obj)
+        self.assertEqual(student_obj.sex, SexChoices.FEMALE)
+        self.assertEqual(student_obj.level_of_study, 1)
+        self.assertEqual(
+            student_obj.revision, SyncState.get_value(SyncState.REVISION)
+        )
+        np.testing.assert_array_almost_equal(
+            bytes_to_face_enc(student_obj.face_encodings_bin), encoding
+        )
+        student_obj = Student.objects.get(reg_number="2021/000002")
+        self.assertIsNone(student_obj.level_of_study)
+        self.assertIsNone(student_obj.face_encodings_bin)
+
+    def test_onboard_staff(self):
+        csv_file = self.write_csv(
+            "staff.csv",
+            "staff_number,first_name,last_name,department,sex,titles,"
+            "is_exam_officer\n"
+            "ss.000001,Ada,Obi,ECE,Female,Dr.,yes\n"
+            "SS.000002,Musa,Bello,ECE,Male,,\n"
+            "SS.123654,John,Doe,ECE,Male,,\n"
+            "XX.000003,Bad,Number,ECE,Male,,\n",
+        )
+        report = onboarding.onboard_staff(csv_file)
+
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(
+            report["errors"],
+            [
+                {"row": 2, "error": "Staff already exists"},
+                {"row": 3, "error": "Invalid staff number provided"},
+            ],
+        )
+        staff_obj = Staff.objects.get(staff_number="SS.000001")
+        self.assertEqual(staff_obj.username, "SS.000001")
+        self.assertEqual(staff_obj.first_name, "Ada")
+        self.assertTrue(staff_obj.is_exam_officer)
+        self.assertFalse(staff_obj.has_usable_password())
+        self.assertEqual(list(staff_obj.staff_titles.all()), [self.title_obj])
+        self.assertFalse(
+            Staff.objects.get(staff_number="SS.000002").is_exam_officer
+        )
+
+    def test_field_checks(self):
+        csv_file = self.write_csv(
+            "students.csv",
+            "reg_number,first_name,last_name,department,sex,"
+            "possible_grad_yr\n"
+            "2021/000001,%s,Obi,ECE,Female,2026\n"
+            "2021/000002,Musa,Bello,ECE,Male,2026\n" % ("A" * 256),
+        )
+        report = onboarding.onboard_students(csv_file)
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(
+            report["errors"],
+            [{"row": 0, "error": "First name longer than 255 characters"}],
+        )
+
+        csv_file = self.write_csv(
+            "staff.csv",
+            "staff_number,first_name,last_name,department,sex,email\n"
+            "SS.000001,Ada,Obi,ECE,Female,ada@example\n"
+            "SS.000002,Musa,Bello,ECE,Male,musa@example.com\n",
+        )
+        report = onboarding.onboard_staff(csv_file)
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(
+            report["errors"],
+            [{"row": 0, "error": "Enter a valid email address."}],
+        )
+
+    def test_fingerprint_template_encoding(self):
+        csv_file = self.write_csv(
+            "students.csv",
+            "reg_number,first_name,last_name,department,sex,"
+            "possible_grad_yr,fingerprint_template,"
+            "fingerprint_template_encoding\n"
+            "2021/000001,Ada,Obi,ECE,Female,2026,deadbeef,base64\n"
+            "2021/000002,Musa,Bello,ECE,Male,2026,deadbeef,\n"
+            "2021/000003,Ngozi,Eze,ECE,Female,2026,deadbeef,octal\n",
+        )
+        report = onboarding.onboard_students(csv_file)
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(
+            report["errors"],
+            [{"row": 2, "error": "Invalid fingerprint template encoding"}],
+        )
+        self.assertEqual(
+            {
+                reg_number: (encoding, bytes(template))
+                for reg_number, encoding, template in Student.objects.filter(
+                    reg_number__startswith="2021/"
+                ).values_list(
+                    "reg_number",
+                    "fingerprint_template_encoding",
+                    "fingerprint_template_bin",
+                )
+            },
+            {
+                "2021/000001": (
+                    FingerprintEncodingChoices.BASE64,
+                    base64.b64decode("deadbeef"),
+                ),
+                "2021/000002": (
+                    FingerprintEncodingChoices.HEX,
+                    bytes.fromhex("deadbeef"),
+                ),
+            },
+        )
+
+    @override_settings(TAMS_FACE_INDEX_ENABLED=True, TAMS_FACE_INDEX_PATH="")
+    def test_face_index_updated(self):
+        face_index.rebuild_institution_index()
+        self.addCleanup(setattr, face_index, "_institution_index", None)
+        encoding = np.random.default_rng(4).uniform(-0.3, 0.3, 128)
+        csv_file = self.write_csv(
+            "students.csv",
+            "reg_number,first_name,last_name,department,sex,"
+            "possible_grad_yr,face_encodings\n"
+            '2021/000001,Ada,Obi,ECE,Female,2026,"%s"\n'
+            % face_enc_to_str(encoding),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            onboarding.onboard_students(csv_file)
+        self.assertEqual(
+            face_index.find_student(encoding).label, "2021/000001"
+        )
+
+    def test_missing_column(self):
+        csv_file = self.write_csv(
+            "students.csv", "reg_number,first_name\n2021/000001,Ada\n"
+        )
+        with self.assertRaises(ValueError):
+            onboarding.onboard_students(csv_file)
+
+    def test_csv_to_json(self):
+        csv_file = self.write_csv(
+            "students.csv", "reg_number, first_name\n2021/000001, Ada\n"
+        )
+        json_file = datasynch.csv_to_json(csv_file)
+        with open(json_file) as records:
+            self.assertEqual(
+                json.load(records),
+                [{"reg_number": "2021/000001", "first_name": "Ada"}],
+            )
+
+
+class ReferenceCacheTestCase(ServerDataMixin, TransactionTestCase):
+    def setUp(self):
+        refcache.invalidate()
+        self.addCleanup(refcache.invalidate)
+        super().setUp()
+        self.science = Faculty.objects.create(name="Science")
+        Department.objects.create(name="Physics", faculty=self.science)
+        AcademicSession.objects.create(session="2019/2020")
+        Course.objects.create(
+            code="PHY 101",
+            title="General Physics",
+            level_of_study=1,
+            department=Department.objects.get(name="Physics"),
+            unit_load=3,
+            semester=SemesterChoices.FIRST,
+        )
+
+    def test_served_from_memory(self):
+        Faculty.get_all_faculties()
+        Department.get_departments()
+        Course.get_courses()
+        AcademicSession.get_all_academic_sessions()
+        course_id = Course.objects.get(code="PHY 101").id
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                Faculty.get_all_faculties(), ["Engineering", "Science"]
+            )
+            self.assertEqual(
+                Department.get_departments(),
+                ["Electronic Engineering", "Physics"],
+            )
+            self.assertEqual(
+                Department.get_departments(faculty="science"), ["Physics"]
+            )
+            self.assertEqual(
+                Department.get_id("electronic engineering"), self.dept_obj.id
+            )
+            self.assertEqual(
+                AcademicSession.get_all_academic_sessions(),
+                ["2020/2021", "2019/2020"],
+            )
+            self.assertEqual(
+                Course.get_courses(semester="First"),
+                ["PHY 101 : General Physics"],
+            )
+            self.assertEqual(
+                Course.get_courses(faculty="ENGINEERING"),
+                ["ECE 272 : Introduction to Engineering Programming"],
+            )
+            self.assertEqual(
+                Course.get_courses(level_of_study=1),
+                ["PHY 101 : General Physics"],
+            )
+            self.assertEqual(
+                Course.str_to_course("phy 101 : general physics"), course_id
+            )
+            self.assertIsNone(Course.str_to_course("PHY 999 : Unknown"))
+            with self.assertRaises(Department.DoesNotExist):
+                Department.get_id("Unknown")
+
+    def test_cached_inside_transactions(self):
+        with transaction.atomic():
+            Department.get_departments()
+            with self.assertNumQueries(0):
+                Department.get_departments()
+
+    def test_uncommitted_writes_bypass_cache(self):
+        Department.get_departments()
+        with transaction.atomic():
+            Department.objects.create(name="Chemistry", faculty=self.science)
+            self.assertIn("Chemistry", Department.get_departments())
+            transaction.set_rollback(True)
+        with self.assertNumQueries(0):
+            self.assertNotIn("Chemistry", Department.get_departments())
+
+        # a write rolled back with its savepoint no longer counts
+        with transaction.atomic():
+            with transaction.atomic():
+                Department.objects.create(
+                    name="Chemistry", faculty=self.science
+                )
+                transaction.set_rollback(True)
+            with self.assertNumQueries(0):
+                Department.get_departments()
+
+        with transaction.atomic():
+            Department.objects.create(name="Chemistry", faculty=self.science)
+        self.assertIn("Chemistry", Department.get_departments())
+
+    def test_invalidated_on_change(self):
+        self.assertEqual(len(Department.get_departments()), 2)
+        Department.objects.create(name="Chemistry", faculty=self.science)
+        self.assertEqual(
+            Department.get_departments(faculty="Science"),
+            ["Chemistry", "Physics"],
+        )
+
+        Course.objects.filter(code="PHY 101").get().delete()
+        self.assertEqual(
+            Course.get_courses(),
+            ["ECE 272 : Introduction to Engineering Programming"],
+        )
+        self.course_obj.is_active = False
+        self.course_obj.save()
+        self.assertEqual(Course.get_courses(), [])
+
+    def test_invalidated_by_queryset_writes(self):
+        self.assertEqual(len(Department.get_departments()), 2)
+        Department.objects.filter(name="Physics").update(name="Chemistry")
+        self.assertEqual(
+            Department.get_departments(faculty="Science"), ["Chemistry"]
+        )
+        with transaction.atomic():
+            Course.objects.filter(code="PHY 101").delete()
+            self.assertEqual(len(Course.get_courses()), 1)
+        self.assertEqual(
+            Course.get_courses(),
+            ["ECE 272 : Introduction to Engineering Programming"],
+        )
+
+
+class ValidatorsTestCase(TestCase):
+    def test_validate_many(self):
+        reg_numbers = ["1999/123456", "99/123456", None, "2001/000001"]
+        np.testing.assert_array_equal(
+            validators.student_reg_number.validate_many(reg_numbers),
+            [True, False, False, True],
+        )
+        np.testing.assert_array_equal(
+            validators.staff_number.validate_many(
+                np.array(["SS.123456", "ss.123456", "SS.12345"])
+            ),
+            [True, True, False],
+        )
+        np.testing.assert_array_equal(
+            validators.get_validator("academic_session").validate_many(
+                ["2020/2021", "2001/2003", "2001_2002"]
+            ),
+            [True, False, False],
+        )
+        np.testing.assert_array_equal(
+            validators.student_reg_number.validate_many(
+                [2001, "2001/000001\n"]
+            ),
+            [False, False],
+        )
+
+    def test_validate_series(self):
+        import pandas as pd
+
+        values = pd.Series(["2020/2021", None], index=[5, 7])
+        result = validators.academic_session.validate_many(values)
+        self.assertIsInstance(result, pd.Series)
+        self.assertEqual(result.to_dict(), {5: True, 7: False})
+
+    def test_str_to_value(self):
+        self.assertEqual(
+            SemesterChoices.str_to_value("second"), SemesterChoices.SECOND
+        )
+        self.assertEqual(
+            RecordTypesChoices.str_to_value("Sign_Out"),
+            RecordTypesChoices.SIGN_OUT,
+        )
+        with self.assertRaises(KeyError):
+            SemesterChoices.str_to_value("__class__")
+
+
+class CheckInTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        # records refresh their summaries when their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+            self.att_session = self.att_sessions[0]
+            AttendanceRecord.objects.filter(
+                attendance_session=self.att_session, student="2001/123454"
+            ).delete()
+
+    def summary_counts(self):
+        return (
+            AttendanceSessionSummary.objects.values_list(
+                "attendance_session", "signed_in", "signed_out"
+            ).order_by("attendance_session"),
+            CourseAttendanceSummary.objects.values_list(
+                "student", "attended"
+            ).order_by("student"),
+        )
+
+    def test_check_in(self):
+        # one INSERT ... SELECT, then the session's and the course's
+        # summary counts are incremented
+        with self.assertNumQueries(3):
+            result = checkin.check_in(
+                self.att_session, "2001/123454", RecordTypesChoices.SIGN_IN
+            )
+        self.assertEqual(result.status, checkin.SIGNED_IN)
+        # the insert is skipped, then the record is read
+        with self.assertNumQueries(2):
+            result = checkin.check_in(
+                self.att_session.pk, "2001/123454", "Sign In"
+            )
+        self.assertEqual(result.status, checkin.ALREADY_SIGNED_IN)
+
+        with self.assertNumQueries(2):
+            result = checkin.check_in(
+                self.att_session, "2001/123454", "sign_out"
+            )
+        self.assertEqual(result.status, checkin.SIGNED_OUT)
+        record = AttendanceRecord.objects.get(
+            attendance_session=self.att_session, student="2001/123454"
+        )
+        self.assertEqual(record.record_type, RecordTypesChoices.SIGN_OUT)
+        self.assertEqual(record.check_out_by, result.check_out_by)
+
+        result = checkin.check_in(
+            self.att_session, "2001/123454", RecordTypesChoices.SIGN_IN
+        )
+        self.assertEqual(result.status, checkin.ALREADY_SIGNED_OUT)
+        self.assertEqual(result.check_out_by, record.check_out_by)
+        self.assertEqual(
+            AttendanceRecord.objects.filter(
+                attendance_session=self.att_session
+            ).count(),
+            5,
+        )
+
+        with self.assertRaises(ValueError):
+            checkin.check_in(self.att_session, "2001/123454", "jump")
+
+    def test_summaries_incremented(self):
+        checkin.check_in(self.att_session, "2001/123454", "sign_in")
+        checkin.check_in(self.att_session, "2001/123454", "sign_out")
+        checkin.check_in(self.att_session, "2001/123451", "sign_out")
+        record = AttendanceRecord.objects.get(
+            attendance_session=self.att_session, student="2001/123452"
+        )
+        record.is_valid = False
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+        checkin.check_in(self.att_session, "2001/123452", "sign_out")
+        counts = [list(rows) for rows in self.summary_counts()]
+        summaries.rebuild()
+        self.assertEqual(
+            counts, [list(rows) for rows in self.summary_counts()]
+        )
+
+    def test_sign_out_without_sign_in(self):
+        result = checkin.check_in(
+            self.att_session, "2001/123454", RecordTypesChoices.SIGN_OUT
+        )
+        self.assertEqual(result.status, checkin.NOT_SIGNED_IN)
+        self.assertIsNone(result.record_type)
+
+    def test_unknown_student_or_session(self):
+        count = AttendanceRecord.objects.count()
+        for action in RecordTypesChoices.values:
+            result = checkin.check_in(self.att_session, "2001/999999", action)
+            self.assertEqual(result.status, checkin.UNKNOWN_STUDENT)
+            result = checkin.check_in(999999, "2001/123454", action)
+            self.assertEqual(result.status, checkin.UNKNOWN_SESSION)
+        self.assertEqual(AttendanceRecord.objects.count(), count)
+
+    def test_check_in_many(self):
+        sign_in = RecordTypesChoices.SIGN_IN
+        sign_out = RecordTypesChoices.SIGN_OUT
+        scans = [
+            (self.att_session, "2001/123454", sign_in),
+            (self.att_session, "2001/123450", sign_out),
+            (self.att_session, "2001/123450", sign_out),
+            (self.att_session, "2001/123454", sign_out),
+            (self.att_session, "2001/123451", sign_in),
+            (self.att_session, "2001/999999", sign_in),
+            (self.att_sessions[1], "2001/123452", sign_out),
+            (999999, "2001/123451", sign_in),
+        ]
+        # students, sessions, records, insert, one update per session,
+        # summary refresh and savepoints
+        with self.assertNumQueries(13):
+            results = checkin.check_in_many(scans)
+        self.assertEqual(
+            [result.status for result in results],
+            [
+                checkin.SIGNED_IN,
+                checkin.SIGNED_OUT,
+                checkin.ALREADY_SIGNED_OUT,
+                checkin.SIGNED_OUT,
+                checkin.ALREADY_SIGNED_IN,
+                checkin.UNKNOWN_STUDENT,
+                checkin.SIGNED_OUT,
+                checkin.UNKNOWN_SESSION,
+            ],
+        )
+        self.assertEqual(
+            set(
+                AttendanceRecord.objects.filter(
+                    record_type=RecordTypesChoices.SIGN_OUT,
+                    check_out_by__isnull=False,
+                ).values_list("attendance_session", "student")
+            ),
+            {
+                (self.att_session.pk, "2001/123450"),
+                (self.att_session.pk, "2001/123454"),
+                (self.att_sessions[1].pk, "2001/123452"),
+            },
+        )
+        self.assertEqual(AttendanceRecord.objects.count(), 10)
+
+    def test_save_sign_out_without_refetch(self):
+        record = AttendanceRecord.objects.filter(
+            attendance_session=self.att_session
+        ).first()
+        record.record_type = RecordTypesChoices.SIGN_OUT
+        # the update; the summary is refreshed on commit
+        with self.assertNumQueries(1):
+            record.save()
+        self.assertIsNotNone(record.check_out_by)
+
+
+class CheckInBufferTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.journal_path = os.path.join(tmp_dir.name, "journal.jsonl")
+        self.att_session = self.att_sessions[0]
+        AttendanceRecord.objects.filter(
+            attendance_session=self.att_session, student="2001/123454"
+        ).delete()
+
+    def make_buffer(self):
+        checkin_buffer = checkinbuffer.CheckInBuffer(
+            self.journal_path, fsync=False
+        )
+        self.addCleanup(checkin_buffer.stop)
+        return checkin_buffer
+
+    def journal_lines(self):
+        with open(self.journal_path) as journal:
+            return journal.readlines()
+
+    def test_flush(self):
+        checkin_buffer = self.make_buffer()
+        scan_time = timezone.now() - timedelta(minutes=5)
+        checkin_buffer.record(
+            self.att_session,
+            "2001/123454",
+            RecordTypesChoices.SIGN_IN,
+            scan_time,
+        )
+        sign_out = checkin_buffer.record(
+            self.att_session.pk, "2001/123450", "sign_out"
+        )
+        self.assertEqual(checkin_buffer.pending(), 2)
+        self.assertEqual(len(self.journal_lines()), 2)
+        self.assertFalse(
+            AttendanceRecord.objects.filter(
+                attendance_session=self.att_session, student="2001/123454"
+            ).exists()
+        )
+
+        results = checkin_buffer.flush()
+        self.assertEqual(
+            [result.status for result in results],
+            [checkin.SIGNED_IN, checkin.SIGNED_OUT],
+        )
+        self.assertEqual(checkin_buffer.pending(), 0)
+        self.assertEqual(self.journal_lines(), [])
+        self.assertEqual(
+            AttendanceRecord.objects.get(
+                attendance_session=self.att_session, student="2001/123454"
+            ).check_in_by,
+            scan_time,
+        )
+        self.assertEqual(
+            AttendanceRecord.objects.get(
+                attendance_session=self.att_session, student="2001/123450"
+            ).check_out_by,
+            sign_out.time,
+        )
+
+    def test_replay(self):
+        checkin_buffer = self.make_buffer()
+        checkin_buffer.record(
+            self.att_session, "2001/123454", RecordTypesChoices.SIGN_IN
+        )
+        checkin_buffer.record(
+            self.att_session, "2001/123450", RecordTypesChoices.SIGN_OUT
+        )
+        # the node crashes while writing a scan
+        with open(self.journal_path, "a") as journal:
+            journal.write('{"attendance_session": "node-se')
+
+        replayed = self.make_buffer()
+        self.assertEqual(replayed.replay(), 2)
+        results = replayed.flush()
+        self.assertEqual(
+            [result.status for result in results],
+            [checkin.SIGNED_IN, checkin.SIGNED_OUT],
+        )
+
+        # replaying scans that were already applied changes nothing
+        again = self.make_buffer()
+        with open(self.journal_path, "w") as journal:
+            journal.writelines(
+                checkinbuffer._dump_scan(scan)
+                for scan in checkin_buffer._pending
+            )
+        again.replay()
+        self.assertEqual(
+            [result.status for result in again.flush()],
+            [checkin.ALREADY_SIGNED_IN, checkin.ALREADY_SIGNED_OUT],
+        )
+        self.assertEqual(AttendanceRecord.objects.count(), 10)
+
+    def test_dead_letters(self):
+        checkin_buffer = self.make_buffer()
+        checkin_buffer.record(
+            self.att_session, "2001/123454", RecordTypesChoices.SIGN_IN
+        )
+        checkin_buffer.record(
+            "no-such-session", "2001/123451", RecordTypesChoices.SIGN_IN
+        )
+        # a scan with an invalid action makes its whole batch fail
+        with open(self.journal_path, "a") as journal:
+            journal.write(
+                checkinbuffer._dump_scan(
+                    checkin.Scan(
+                        self.att_session.pk, "2001/123452", 7, timezone.now()
+                    )
+                )
+            )
+        checkin_buffer.record(
+            self.att_session, "2001/123450", RecordTypesChoices.SIGN_OUT
+        )
+
+        replayed = self.make_buffer()
+        self.assertEqual(replayed.replay(), 4)
+        self.assertEqual(
+            [result.status for result in replayed.flush()],
+            [
+                checkin.SIGNED_IN,
+                checkin.UNKNOWN_SESSION,
+                checkinbuffer.REJECTED,
+                checkin.SIGNED_OUT,
+            ],
+        )
+        self.assertEqual(replayed.pending(), 0)
+        self.assertEqual(
+            [
+                (scan.reg_number, reason.split("(")[0])
+                for scan, reason in replayed.dead_letters
+            ],
+            [
+                ("2001/123451", checkin.UNKNOWN_SESSION),
+                ("2001/123452", "ValueError"),
+            ],
+        )
+        with open(replayed.dead_letter_path) as dead_letters:
+            self.assertEqual(len(dead_letters.readlines()), 2)
+
+    def test_fsync_once_per_flush(self):
+        checkin_buffer = checkinbuffer.CheckInBuffer(self.journal_path)
+        self.addCleanup(checkin_buffer.stop)
+        with mock.patch.object(checkinbuffer.os, "fsync") as fsync:
+            for reg_number in ("2001/123450", "2001/123451", "2001/123452"):
+                checkin_buffer.record(
+                    self.att_session, reg_number, RecordTypesChoices.SIGN_OUT
+                )
+            self.assertEqual(fsync.call_count, 0)
+            checkin_buffer.flush()
+        # the journal before the batch, then its rewrite after it
+        self.assertEqual(fsync.call_count, 2)
+
+    def test_journal_rewritten_once_per_flush(self):
+        checkin_buffer = checkinbuffer.CheckInBuffer(
+            self.journal_path, batch_size=1
+        )
+        self.addCleanup(checkin_buffer.stop)
+        recorded = []
+
+        def on_flush(scans, results):
+            # a scan arriving while the buffer drains stays journaled
+            if not recorded:
+                recorded.append(
+                    checkin_buffer.record(
+                        self.att_session,
+                        "2001/123454",
+                        RecordTypesChoices.SIGN_IN,
+                    )
+                )
+
+        checkin_buffer.on_flush = on_flush
+        for reg_number in ("2001/123450", "2001/123451", "2001/123452"):
+            checkin_buffer.record(
+                self.att_session, reg_number, RecordTypesChoices.SIGN_OUT
+            )
+        with mock.patch.object(
+            checkin_buffer,
+            "_rewrite_journal",
+            wraps=checkin_buffer._rewrite_journal,
+        ) as rewrite:
+            results = checkin_buffer.flush()
+        self.assertEqual(rewrite.call_count, 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(checkin_buffer.pending(), 0)
+        self.assertEqual(self.journal_lines(), [])
+
+    def test_scans_recorded_during_rewrite_kept(self):
+        checkin_buffer = self.make_buffer()
+        checkin_buffer.record(
+            self.att_session, "2001/123450", RecordTypesChoices.SIGN_OUT
+        )
+        checkin_buffer.flush()
+        dump_scan = checkinbuffer._dump_scan
+        recorded = []
+
+        def slow_dump(scan):
+            # record() runs while the new journal is being written
+            if not recorded:
+                recorded.append(scan)
+                checkin_buffer.record(
+                    self.att_session, "2001/123454", RecordTypesChoices.SIGN_IN
+                )
+            return dump_scan(scan)
+
+        checkin_buffer.record(
+            self.att_session, "2001/123451", RecordTypesChoices.SIGN_OUT
+        )
+        with mock.patch.object(checkinbuffer, "_dump_scan", slow_dump):
+            checkin_buffer._rewrite_journal()
+        self.assertEqual(
+            self.journal_lines(),
+            [dump_scan(scan) for scan in checkin_buffer._pending],
+        )
+        self.assertEqual(checkin_buffer.pending(), 2)
+
+
+class CheckInBufferThreadTestCase(AttendanceDataMixin, TransactionTestCase):
+    def test_background_writer(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        flushed = []
+        checkin_buffer = checkinbuffer.CheckInBuffer(
+            os.path.join(tmp_dir.name, "journal.jsonl"),
+            batch_size=2,
+            flush_interval=0.05,
+            fsync=False,
+            on_flush=lambda scans, results: flushed.extend(results),
+        )
+        checkin_buffer.start()
+        for idx in range(5):
+            checkin_buffer.record(
+                self.att_sessions[0],
+                "2001/12345%d" % idx,
+                RecordTypesChoices.SIGN_OUT,
+            )
+        checkin_buffer.stop()
+
+        self.assertIsNone(checkin_buffer.last_error)
+        self.assertEqual(len(flushed), 5)
+        self.assertEqual(
+            AttendanceRecord.objects.filter(
+                record_type=RecordTypesChoices.SIGN_OUT
+            ).count(),
+            5,
+        )
+
+
+class ActiveSessionTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        activesessions.clear_active_sessions()
+        self.addCleanup(activesessions.clear_active_sessions)
+        self.now = timezone.now()
+        AttendanceSession.objects.update(
+            start_time=F("start_time") - timedelta(days=14)
+        )
+        self.current = AttendanceSession.objects.create(
+            id="node-session-current",
+            node_device=self.node,
+            course=self.course_obj,
+            session=self.acad_session,
+            event_type=EventTypeChoices.LECTURE,
+            start_time=self.now - timedelta(minutes=30),
+            duration=timedelta(hours=1),
+        )
+
+    def test_running_sessions(self):
+        self.assertEqual(
+            list(AttendanceSession.running_sessions(self.node)),
+            [self.current],
+        )
+        self.assertEqual(
+            list(
+                AttendanceSession.running_sessions(
+                    self.node, self.now + timedelta(hours=1)
+                )
+            ),
+            [],
+        )
+
+    def test_cached_per_node(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                activesessions.get_active_session(self.node), self.current
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                activesessions.get_active_session(self.node.pk), self.current
+            )
+
+        self.current.status = AttendanceSessionStatusChoices.ENDED
+        self.current.save()
+        self.assertIsNone(activesessions.get_active_session(self.node))
+
+    def test_cache_expires_with_session(self):
+        activesessions.get_active_session(self.node)
+        with mock.patch.object(
+            timezone,
+            "now",
+            return_value=self.now + timedelta(hours=1),
+        ):
+            self.assertIsNone(activesessions.get_active_session(self.node))
+
+    def test_end_expired_sessions(self):
+        activesessions.get_active_session(self.node)
+        with self.assertNumQueries(1):
+            ended = AttendanceSession.end_expired_sessions()
+        self.assertEqual(ended, 2)
+        self.assertEqual(
+            set(
+                AttendanceSession.objects.filter(
+                    status=AttendanceSessionStatusChoices.ACTIVE
+                ).values_list("pk", flat=True)
+            ),
+            {self.current.pk},
+        )
+
+        ended = activesessions.end_expired_sessions(
+            self.now + timedelta(hours=1)
+        )
+        self.assertEqual(ended, 1)
+        self.assertIsNone(activesessions.get_active_session(self.node))
+
+
+@override_settings(TIME_ZONE="Africa/Lagos")
+class RecurrenceTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.node = NodeDevice.objects.create()
+        self.now = timezone.now().replace(microsecond=0)
+        self.lecture = AttendanceSession.objects.create(
+            id="weekly-lecture",
+            node_device=self.node,
+            course=self.course_obj,
+            session=self.acad_session,
+            event_type=EventTypeChoices.LECTURE,
+            start_time=self.now - timedelta(days=1),
+            duration=timedelta(hours=2),
+            recurring=True,
+        )
+
+    def test_expand(self):
+        until = self.lecture.start_time + timedelta(weeks=12)
+        # a lecture already created by hand for the third week
+        AttendanceSession.objects.create(
+            id="week-3",
+            node_device=self.node,
+            course=self.course_obj,
+            session=self.acad_session,
+            event_type=EventTypeChoices.LECTURE,
+            start_time=self.lecture.start_time + timedelta(weeks=2),
+            duration=timedelta(hours=2),
+            recurring=True,
+        )
+        # lookup, insert and savepoints
+        with self.assertNumQueries(4):
+            created = recurrence.expand_recurring_session(self.lecture, until)
+        self.assertEqual(len(created), 11)
+        self.assertEqual(recurrence.series_sessions(self.lecture).count(), 13)
+        self.assertEqual(
+            recurrence.expand_recurring_session(self.lecture, until), []
+        )
+
+        self.lecture.recurring = False
+        with self.assertRaises(ValueError):
+            recurrence.expand_recurring_session(self.lecture, until)
+
+    def test_materialize_upcoming(self):
+        created = recurrence.materialize_upcoming(self.lecture, now=self.now)
+        self.assertEqual(
+            [att_session.start_time for att_session in created],
+            [
+                self.lecture.start_time + timedelta(weeks=weeks)
+                for weeks in range(1, 3)
+            ],
+        )
+        self.assertEqual(
+            recurrence.materialize_upcoming(self.lecture, now=self.now), []
+        )
+
+        later = self.now + timedelta(weeks=3)
+        created = recurrence.materialize_all_upcoming(now=later)
+        self.assertEqual(
+            [att_session.start_time for att_session in created],
+            [
+                self.lecture.start_time + timedelta(weeks=weeks)
+                for weeks in range(3, 6)
+            ],
+        )
+        self.assertTrue(
+            all(
+                att_session.node_device_id == self.node.pk
+                for att_session in created
+            )
+        )
+
+    def test_expand_drops_cached_active_session(self):
+        activesessions.clear_active_sessions()
+        self.addCleanup(activesessions.clear_active_sessions)
+        node = NodeDevice.objects.create()
+        lecture = AttendanceSession.objects.create(
+            id="running-lecture",
+            node_device=node,
+            course=self.course_obj,
+            session=self.acad_session,
+            event_type=EventTypeChoices.LECTURE,
+            start_time=self.now - timedelta(weeks=1, minutes=10),
+            duration=timedelta(hours=1),
+            recurring=True,
+        )
+        self.assertIsNone(activesessions.get_active_session(node))
+        with self.captureOnCommitCallbacks(execute=True):
+            (occurrence,) = recurrence.expand_recurring_session(
+                lecture, self.now
+            )
+        self.assertEqual(activesessions.get_active_session(node), occurrence)
+
+    @override_settings(TIME_ZONE="America/Chicago")
+    def test_wall_clock_kept_across_dst(self):
+        first_start = timezone.make_aware(datetime(2026, 10, 26, 9, 0))
+        start_times = list(
+            recurrence.occurrence_times(
+                first_start, first_start + timedelta(weeks=1)
+            )
+        )
+        self.assertEqual(
+            [timezone.localtime(start).hour for start in start_times], [9, 9]
+        )
+        self.assertEqual(
+            start_times[1].timestamp() - start_times[0].timestamp(),
+            timedelta(weeks=1, hours=1).total_seconds(),
+        )
+
+
+class SessionIdTestCase(ServerDataMixin, TestCase):
+    def test_ids_unique_and_ordered(self):
+        ids = [sessionids.new_session_id(7) for _ in range(5000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(sorted(ids), ids)
+        self.assertTrue(all(len(pk) <= 50 for pk in ids))
+        self.assertEqual(sessionids.node_of(ids[0]), 7)
+        self.assertIsNone(
+            sessionids.node_of("d41d8cd98f00b204e9800998ecf8427e")
+        )
+
+    def test_sessions_with_equal_duration(self):
+        node = NodeDevice.objects.create()
+        start_time = timezone.now()
+        att_sessions = [
+            AttendanceSession.objects.create(
+                node_device=node,
+                course=self.course_obj,
+                session=self.acad_session,
+                event_type=EventTypeChoices.LECTURE,
+                start_time=start_time + timedelta(hours=idx),
+                duration=timedelta(hours=1),
+            )
+            for idx in range(3)
+        ]
+        self.assertEqual(len({obj.pk for obj in att_sessions}), 3)
+        self.assertEqual(
+            {sessionids.node_of(obj.pk) for obj in att_sessions}, {node.pk}
+        )
+
+
+class ReportsTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.at = self.start_time + timedelta(days=8)
+        self.reg_numbers = sorted(
+            Student.objects.values_list("reg_number", flat=True)
+        )
+        # the first student's second sign-in doesn't count
+        AttendanceRecord.objects.filter(
+            attendance_session=self.att_sessions[1],
+            student_id=self.reg_numbers[0],
+        ).update(is_valid=False)
+
+    def test_attendance_matrix(self):
+        # refcache doesn't store tables read inside a transaction, so the
+        # course lookup is a query of its own here
+        with self.assertNumQueries(4):
+            matrix = reports.attendance_matrix(
+                [self.course_obj.pk], self.acad_session.pk, at=self.at
+            )
+        self.assertEqual(matrix.students, self.reg_numbers)
+        self.assertEqual(matrix.held.tolist(), [2])
+        self.assertEqual(matrix.attended.tolist(), [[1, 2, 2, 2, 2]])
+        self.assertEqual(
+            matrix.percentage.tolist(), [[50.0, 100.0, 100.0, 100.0, 100.0]]
+        )
+        self.assertEqual(
+            matrix.eligible().tolist(), [[False, True, True, True, True]]
+        )
+        self.assertTrue(matrix.eligible(threshold=50).all())
+
+    def test_sessions_not_yet_held(self):
+        matrix = reports.attendance_matrix(
+            [self.course_obj.pk], self.acad_session.pk, at=self.start_time
+        )
+        self.assertEqual(matrix.held.tolist(), [1])
+        self.assertTrue(matrix.eligible().all())
+
+    def test_unregistered_student(self):
+        CourseRegistration.objects.filter(
+            student_id=self.reg_numbers[1]
+        ).delete()
+        matrix = reports.attendance_matrix(
+            [self.course_obj.pk], self.acad_session.pk, at=self.at
+        )
+        self.assertNotIn(self.reg_numbers[1], matrix.students)
+        self.assertEqual(len(list(matrix.rows())), 4)
+
+    def test_exports(self):
+        matrix = reports.attendance_matrix(
+            [self.course_obj.pk], self.acad_session.pk, at=self.at
+        )
+        frame = matrix.to_dataframe()
+        self.assertEqual(list(frame.columns), list(reports.REPORT_COLUMNS))
+        self.assertEqual(frame["eligible"].sum(), 4)
+
+        csv_file = io.StringIO()
+        reports.write_csv(matrix, csv_file)
+        lines = csv_file.getvalue().splitlines()
+        self.assertEqual(lines[0], ",".join(reports.REPORT_COLUMNS))
+        self.assertEqual(
+            lines[1], "ECE 272,%s,1,2,50.0,False" % self.reg_numbers[0]
+        )
+        self.assertEqual(len(lines), 6)
+
+    def test_exam_officer_report(self):
+        with self.assertRaises(PermissionDenied):
+            reports.exam_officer_report(self.staff_obj, self.acad_session.pk)
+
+        self.staff_obj.is_exam_officer = True
+        Course.objects.create(
+            code="ECE 101",
+            title="Basic Electronics",
+            level_of_study=1,
+            department=self.dept_obj,
+            unit_load=2,
+            semester=SemesterChoices.FIRST,
+        )
+        matrix = reports.exam_officer_report(
+            self.staff_obj, self.acad_session.pk, at=self.at
+        )
+        self.assertEqual(
+            [course.code for course in matrix.courses], ["ECE 272", "ECE 101"]
+        )
+        self.assertEqual(matrix.held.tolist(), [2, 0])
+
+        matrix = reports.exam_officer_report(
+            self.staff_obj,
+            self.acad_session.pk,
+            semester=SemesterChoices.FIRST,
+        )
+        self.assertEqual(
+            [course.code for course in matrix.courses], ["ECE 101"]
+        )
+
+
+class AttendanceSummaryTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        # records refresh their summaries when their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+        self.reg_numbers = sorted(
+            Student.objects.values_list("reg_number", flat=True)
+        )
+
+    def attended(self):
+        return dict(
+            CourseAttendanceSummary.objects.filter(
+                course=self.course_obj, session=self.acad_session
+            ).values_list("student_id", "attended")
+        )
+
+    def signed_in(self, att_session):
+        return AttendanceSessionSummary.objects.get(
+            attendance_session=att_session
+        ).signed_in
+
+    def test_refreshed_on_save(self):
+        self.assertEqual(self.attended(), dict.fromkeys(self.reg_numbers, 2))
+        self.assertEqual(self.signed_in(self.att_sessions[0]), 5)
+
+        record = AttendanceRecord.objects.get(
+            attendance_session=self.att_sessions[0],
+            student_id=self.reg_numbers[0],
+        )
+        record.is_valid = False
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+        self.assertEqual(self.attended()[self.reg_numbers[0]], 1)
+        self.assertEqual(self.signed_in(self.att_sessions[0]), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record.delete()
+            AttendanceRecord.objects.get(
+                attendance_session=self.att_sessions[1],
+                student_id=self.reg_numbers[0],
+            ).delete()
+        self.assertEqual(self.attended()[self.reg_numbers[0]], 0)
+
+    def test_refreshed_once_per_transaction(self):
+        records = list(
+            AttendanceRecord.objects.filter(
+                attendance_session=self.att_sessions[0]
+            ).order_by("student")
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    records[0].is_valid = False
+                    records[0].save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+            for record in records[1:]:
+                record.is_valid = False
+                # the record update only, the refresh waits for the commit
+                with self.assertNumQueries(1):
+                    record.save()
+        self.assertEqual(len(callbacks), 1)
+        with self.assertNumQueries(5):
+            callbacks[0]()
+        self.assertEqual(self.signed_in(self.att_sessions[0]), 1)
+
+    def test_refreshed_by_check_in(self):
+        att_session = AttendanceSession.objects.create(
+            node_device=self.node,
+            course=self.course_obj,
+            session=self.acad_session,
+            event_type=EventTypeChoices.LECTURE,
+            start_time=self.start_time + timedelta(days=14),
+            duration=timedelta(hours=2),
+        )
+        checkin.check_in(att_session, self.reg_numbers[0], "sign_in")
+        checkin.check_in_many(
+            (att_session, reg_number, RecordTypesChoices.SIGN_IN)
+            for reg_number in self.reg_numbers[1:3]
+        )
+        checkin.check_in_many(
+            [(att_session, self.reg_numbers[1], RecordTypesChoices.SIGN_OUT)]
+        )
+        summary = AttendanceSessionSummary.objects.get(
+            attendance_session=att_session
+        )
+        self.assertEqual((summary.signed_in, summary.signed_out), (3, 1))
+        self.assertEqual(
+            self.attended(),
+            {
+                reg_number: 3 if idx < 3 else 2
+                for idx, reg_number in enumerate(self.reg_numbers)
+            },
+        )
+
+    def test_refreshed_by_ingest(self):
+        node_records = list(datasynch.iter_model_records(datasynch.NODE_DUMP))
+        with self.captureOnCommitCallbacks(execute=True):
+            AttendanceSession.objects.all().delete()
+        self.assertEqual(self.attended(), dict.fromkeys(self.reg_numbers, 0))
+
+        ingest.ingest_node_dump(node_records, self.node)
+        self.assertEqual(self.attended(), dict.fromkeys(self.reg_numbers, 2))
+
+    def test_rebuild(self):
+        AttendanceRecord.objects.filter(student_id=self.reg_numbers[0]).update(
+            is_valid=False
+        )
+        CourseAttendanceSummary.objects.all().delete()
+        summaries.rebuild()
+        self.assertEqual(
+            self.attended(),
+            {
+                reg_number: 0 if idx == 0 else 2
+                for idx, reg_number in enumerate(self.reg_numbers)
+            },
+        )
+        self.assertEqual(self.signed_in(self.att_sessions[1]), 4)
+
+    def test_report_from_summary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            AttendanceRecord.objects.get(
+                attendance_session=self.att_sessions[1],
+                student_id=self.reg_numbers[0],
+            ).delete()
+        at = self.start_time + timedelta(days=8)
+        matrix = reports.attendance_matrix(
+            [self.course_obj.pk], self.acad_session.pk, at, use_summary=True
+        )
+        self.assertEqual(matrix.attended.tolist(), [[1, 2, 2, 2, 2]])
+
+    def test_exam_officer_report_at(self):
+        self.staff_obj.is_exam_officer = True
+        # only the first attendance session was held by then, which the
+        # summaries can't tell
+        matrix = reports.exam_officer_report(
+            self.staff_obj,
+            self.acad_session.pk,
+            at=self.start_time + timedelta(days=1),
+        )
+        self.assertEqual(matrix.held.tolist(), [1])
+        self.assertEqual(matrix.attended.tolist(), [[1, 1, 1, 1, 1]])
+
+
+@override_settings(
+    TAMS_FINGERPRINT_MATCHER="%s.BitwiseMatcher" % fingerprints.__name__
+)
+class FingerprintGalleryTestCase(ServerDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fingerprints.clear_gallery_cache()
+        self.addCleanup(fingerprints.clear_gallery_cache)
+        rng = np.random.default_rng(2)
+        self.templates = {}
+        for student_obj in Student.objects.order_by("reg_number"):
+            template = rng.integers(0, 256, 512, dtype=np.uint8).tobytes()
+            self.templates[student_obj.reg_number] = template
+            student_obj.fingerprint_template = template.hex()
+            student_obj.save()
+
+    def noisy(self, template, flipped_bytes=20):
+        probe = bytearray(template)
+        for idx in range(flipped_bytes):
+            probe[idx] ^= 0xFF
+        return bytes(probe)
+
+    def test_template_decoding(self):
+        template = self.templates["2001/123450"]
+        for encoded, encoding in (
+            (template.hex(), FingerprintEncodingChoices.HEX),
+            (
+                base64.b64encode(template).decode(),
+                FingerprintEncodingChoices.BASE64,
+            ),
+            (
+                ",".join(str(byte) for byte in template),
+                FingerprintEncodingChoices.DECIMAL,
+            ),
+        ):
+            self.assertEqual(
+                fingerprint_template_to_bytes(encoded, encoding), template
+            )
+        self.assertEqual(
+            fingerprint_template_to_bytes(template.hex()), template
+        )
+        self.assertIsNone(fingerprint_template_to_bytes("not a template!"))
+        self.assertIsNone(fingerprint_template_to_bytes(""))
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        self.assertEqual(bytes(student_obj.fingerprint_template_bin), template)
+
+        # base64 made of hex digits only is still read as base64
+        student_obj.fingerprint_template = "deadbeef"
+        student_obj.fingerprint_template_encoding = (
+            FingerprintEncodingChoices.BASE64
+        )
+        student_obj.save(
+            update_fields=[
+                "fingerprint_template",
+                "fingerprint_template_encoding",
+            ]
+        )
+        student_obj.refresh_from_db()
+        self.assertEqual(
+            bytes(student_obj.fingerprint_template_bin),
+            base64.b64decode("deadbeef"),
+        )
+
+    def test_template_decoded_by_queryset_update(self):
+        students = Student.objects.filter(reg_number="2001/123450")
+        # the rows' encodings aren't known to update()
+        with self.assertRaises(ValueError):
+            students.update(fingerprint_template="deadbeef")
+        students.update(
+            fingerprint_template="deadbeef",
+            fingerprint_template_encoding=FingerprintEncodingChoices.HEX,
+        )
+        self.assertEqual(
+            bytes(students.get().fingerprint_template_bin),
+            bytes.fromhex("deadbeef"),
+        )
+
+    def test_matcher_is_abstract(self):
+        with self.assertRaises(TypeError):
+            fingerprints.FingerprintMatcher()
+
+    @override_settings(TAMS_FINGERPRINT_MATCHER=None)
+    def test_matcher_required(self):
+        gallery = fingerprints.FingerprintGallery.for_department(self.dept_obj)
+        with self.assertRaises(ImproperlyConfigured):
+            gallery.identify(self.templates["2001/123450"])
+
+    def test_identify(self):
+        gallery = fingerprints.get_course_gallery(
+            self.course_obj.id, self.acad_session.id
+        )
+        self.assertEqual(len(gallery), 5)
+        match = gallery.identify(self.noisy(self.templates["2001/123453"]))
+        self.assertEqual(match.label, "2001/123453")
+        self.assertAlmostEqual(match.score, 1 - 20 / 512)
+        # unrelated templates agree on about half of their bits
+        self.assertIsNone(gallery.identify(bytes(512)))
+
+    def test_early_exit(self):
+        gallery = fingerprints.FingerprintGallery.for_department(self.dept_obj)
+        matcher = fingerprints.BitwiseMatcher()
+        probe = self.templates["2001/123450"]
+        with mock.patch.object(matcher, "score", wraps=matcher.score) as score:
+            match = gallery.identify(
+                probe, early_exit=0.99, matcher=matcher, batch_size=2
+            )
+        self.assertEqual(match, ("2001/123450", 1.0))
+        self.assertEqual(score.call_count, 1)
+
+        with mock.patch.object(matcher, "score", wraps=matcher.score) as score:
+            gallery.identify(probe, matcher=matcher, batch_size=2)
+        self.assertEqual(score.call_count, 3)
+
+    def test_shorter_probe(self):
+        gallery = fingerprints.FingerprintGallery.for_department(self.dept_obj)
+        scores = gallery.scores(self.templates["2001/123452"][:256])
+        self.assertEqual(gallery.labels[int(np.argmax(scores))], "2001/123452")
+        self.assertEqual(scores.max(), 1.0)
+
+    def test_template_change_invalidates(self):
+        gallery = fingerprints.get_course_gallery(self.course_obj.id)
+        with self.assertNumQueries(0):
+            fingerprints.get_course_gallery(self.course_obj.id)
+        student_obj = Student.objects.get(reg_number="2001/123450")
+        student_obj.fingerprint_template = bytes(512).hex()
+        with self.captureOnCommitCallbacks(execute=True):
+            student_obj.save()
+        refreshed = fingerprints.get_course_gallery(self.course_obj.id)
+        self.assertIsNot(gallery, refreshed)
+        self.assertEqual(refreshed.template("2001/123450"), bytes(512))
+
+
+class StartupTestCase(TestCase):
+    # modules a node imports on every boot and management command
+    STARTUP_MODULES = (
+        "db.models",
+        "db.signals",
+        "db.datasynch",
+        "db.ingest",
+        "db.checkin",
+        "db.checkinbuffer",
+        "db.activesessions",
+        "db.summaries",
+    )
+    HEAVY_MODULES = ("numpy", "pandas")
+    # seconds, generous enough for a Raspberry Pi class node
+    IMPORT_TIME_BUDGET = 5.0
+
+    def test_startup_imports(self):
+        script = "\n".join(
+            [
+                "import importlib, json, sys, time",
+                "import django",
+                "started = time.perf_counter()",
+                "django.setup()",
+                "for name in %r: importlib.import_module(name)"
+                % (self.STARTUP_MODULES,),
+                "print(json.dumps({'seconds': time.perf_counter() - started,"
+                " 'heavy': [m for m in %r if m in sys.modules]}))"
+                % (self.HEAVY_MODULES,),
+            ]
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result["heavy"], [])
+        self.assertLess(result["seconds"], self.IMPORT_TIME_BUDGET)
+
+    def test_config_read_once(self):
+        self.assertIs(validators.get_config(), validators.get_config())
+        self.assertEqual(
+            validators.STAFF_NO_FORMAT,
+            validators.get_config()["STAFF_NO_FORMAT"],
+        )
+        from . import models
+
+        self.assertIs(models.config_dict, validators.get_config())
+
+
+class BenchmarkTestCase(TestCase):
+    SIZE = benchmarks.DatasetSize(
+        faculties=1,
+        departments_per_faculty=2,
+        courses_per_department=4,
+        students_per_department=20,
+        attendance_sessions_per_course=2,
+    )
+
+    def test_query_budgets(self):
+        dataset = benchmarks.generate_dataset(self.SIZE)
+        self.assertEqual(Student.objects.count(), 40)
+        self.assertEqual(CourseRegistration.objects.count(), 160)
+        results = benchmarks.run_benchmarks(dataset)
+        self.assertEqual(
+            [result.name for result in results], list(benchmarks.SCENARIOS)
+        )
+        benchmarks.check_budgets(results)
+
+    def test_queries_independent_of_size(self):
+        small = benchmarks.run_benchmarks(
+            benchmarks.generate_dataset(self.SIZE, prefix="S")
+        )
+        large = benchmarks.run_benchmarks(
+            benchmarks.generate_dataset(
+                self.SIZE._replace(
+                    courses_per_department=8, students_per_department=60
+                ),
+                prefix="L",
+            )
+        )
+        self.assertEqual(
+            [(result.name, result.queries) for result in small],
+            [(result.name, result.queries) for result in large],
+        )
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(AssertionError):
+            benchmarks.check_budgets(
+                [benchmarks.BenchmarkResult("course.get_courses", 4, 0.1, 3)]
+            )
+
+
+@override_settings(TAMS_INSTRUMENTATION=True)
+class InstrumentationTestCase(AttendanceDataMixin, TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    def test_check_in_sampled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            AttendanceRecord.objects.filter(student="2001/123454").delete()
+        checkin.check_in(self.att_sessions[0], "2001/123454", "sign_in")
+        (sample,) = instrumentation.samples("checkin.check_in")
+        self.assertEqual(sample["queries"], 3)
+        self.assertGreater(sample["db_seconds"], 0)
+        self.assertGreaterEqual(sample["python_seconds"], 0)
+        self.assertGreaterEqual(sample["rows"], 1)
+        self.assertFalse(sample["failed"])
+
+    def test_failures_and_totals(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                checkin.check_in(self.att_sessions[0], "2001/123454", "x")
+        totals = instrumentation.totals()["checkin.check_in"]
+        self.assertEqual((totals["count"], totals["failed"]), (2, 2))
+
+    def test_reference_loads(self):
+        Course.get_courses()
+        (sample,) = instrumentation.samples("refcache.courses")
+        self.assertEqual((sample["queries"], sample["rows"]), (1, 1))
+
+    @override_settings(TAMS_INSTRUMENTATION_BUFFER_SIZE=3)
+    def test_ring_buffer(self):
+        for _ in range(5):
+            refcache.invalidate()
+            Faculty.get_all_faculties()
+        self.assertEqual(len(instrumentation.samples()), 3)
+        self.assertEqual(
+            instrumentation.totals()["refcache.faculties"]["count"], 5
+        )
+
+    def test_exports(self):
+        Faculty.get_all_faculties()
+        exported = json.loads(instrumentation.to_json())
+        self.assertEqual(
+            exported["samples"][0]["operation"], "refcache.faculties"
+        )
+        text = instrumentation.to_prometheus()
+        self.assertIn("# TYPE tams_operations_total counter", text)
+        self.assertIn(
+            'tams_operation_queries_total{operation="refcache.faculties"} 1.0',
+            text,
+        )
+
+    @override_settings(TAMS_INSTRUMENTATION=False)
+    def test_disabled(self):
+        Faculty.get_all_faculties()
+        self.assertEqual(instrumentation.samples(), [])
@@ -0,0 +1,129 @@
+"""
+Identifier validators.
+
+The staff number, student registration number and academic session
+formats are read from config.json and compiled once, the first time a
+value is validated; the parsed config is cached. Every validator checks a
+single value (is_valid) or a whole list, numpy array or pandas Series at
+once (validate_many, with pandas' vectorized string methods).
+
+Values must match a format in full. The formats in config.json are
+anchored (^...$) anyway, as the re.search checks these replace needed
+them to be.
+"""
+from functools import lru_cache
+import json
+import os
+from pathlib import Path
+import re
+
+# configuring the staff_number and studnet reg number format
+config_file_path = os.path.join(
+    Path(os.path.abspath(__file__)).parent.parent, "config.json"
+)
+
+# config.json keys of the formats, also readable as module attributes
+CONFIG_NAMES = (
+    "config_dict",
+    "STAFF_NO_FORMAT",
+    "STUDENT_REG_NO_FORMAT",
+    "SESSION_FORMAT",
+)
+
+
+@lru_cache(maxsize=None)
+def get_config():
+    """The parsed config.json, read once"""
+    if not os.path.exists(config_file_path):
+        raise FileNotFoundError("File: config.json not found")
+    with open(config_file_path, "r") as data:
+        return json.loads(data.read())
+
+
+def __getattr__(name):
+    if name == "config_dict":
+        return get_config()
+    if name in CONFIG_NAMES:
+        return get_config()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+class Validator:
+    """A format (the name of a config.json key), compiled on first use,
+    with an optional normalization (the name of a str method, e.g.
+    "upper") applied to values before matching and an optional extra
+    check of the values that match
+    """
+
+    def __init__(self, config_name, normalize=None, check=None):
+        self.config_name = config_name
+        self._pattern = None
+        self._normalize = normalize
+        self._check = check
+
+    @property
+    def pattern(self):
+        if self._pattern is None:
+            self._pattern = re.compile(get_config()[self.config_name])
+        return self._pattern
+
+    def is_valid(self, value):
+        if not isinstance(value, str):
+            return False
+        if self._normalize is not None:
+            value = getattr(value, self._normalize)()
+        if self.pattern.fullmatch(value) is None:
+            return False
+        return self._check is None or self._check(value)
+
+    def validate_many(self, values):
+        """Validate every value of a list, numpy array or pandas Series.
+        Returns a numpy bool array, or a bool Series with the same index
+        for a Series. Missing and non string values are invalid.
+        """
+        import pandas as pd
+
+        if isinstance(values, pd.Series):
+            series = values.astype(object)
+        else:
+            series = pd.Series(list(values), dtype=object)
+        result = pd.Series(False, index=series.index)
+        try:
+            strings = series.str
+        except AttributeError:
+            # the str accessor refuses a series without any string value
+            strings = None
+        if strings is not None:
+            if self._normalize is not None:
+                strings = getattr(strings, self._normalize)().str
+            # non string values match as NA
+            result = strings.fullmatch(self.pattern).fillna(False)
+            result = result.astype(bool)
+        if self._check is not None and result.any():
+            result[result] = series[result].map(self._check).astype(bool)
+        if isinstance(values, pd.Series):
+            return result.rename(values.name)
+        return result.to_numpy()
+
+
+def _is_consecutive_years(session):
+    session_yrs = session.split("/")
+    try:
+        return (int(session_yrs[1]) - int(session_yrs[0])) == 1
+    except (IndexError, ValueError):
+        return False
+
+
+staff_number = Validator("STAFF_NO_FORMAT", normalize="upper")
+student_reg_number = Validator("STUDENT_REG_NO_FORMAT")
+academic_session = Validator("SESSION_FORMAT", check=_is_consecutive_years)
+
+VALIDATORS = {
+    "staff_number": staff_number,
+    "student_reg_number": student_reg_number,
+    "academic_session": academic_session,
+}
+
+
+def get_validator(name):
+    return VALIDATORS[name]